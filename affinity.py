@@ -0,0 +1,58 @@
+"""
+房間與 worker 的對應（一致性雜湊）
+
+多 worker 模式下，每個房間由一個 worker 負責：該房間的所有 Socket.IO 連線都會被
+run_cluster.py 的轉發層送到同一個 worker，比賽計時器也只在那裡執行。
+以一致性雜湊決定負責的 worker，worker 數量改變時只有約 1/N 的房間需要換手。
+"""
+import bisect
+import hashlib
+import os
+
+WORKER_ID = int(os.environ.get('WORKER_ID', 0))
+WORKER_COUNT = int(os.environ.get('WORKER_COUNT', 1))
+VIRTUAL_NODES = 160          # 每個 worker 在環上的虛擬節點數，讓房間分布更平均
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    def __init__(self, nodes, vnodes=VIRTUAL_NODES):
+        points = sorted((_hash(f'{node}#{i}'), node) for node in nodes for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key):
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+ring = HashRing(range(WORKER_COUNT))
+misrouted = 0                # 連到非負責 worker 的 Socket.IO 連線數
+
+
+def owner_of(room_id):
+    return ring.node_for(str(room_id))
+
+
+def is_owner(room_id):
+    return WORKER_COUNT == 1 or owner_of(room_id) == WORKER_ID
+
+
+def record_connect(room_id):
+    """記錄房間連線是否落在負責的 worker，回傳是否正確"""
+    global misrouted
+    if is_owner(room_id):
+        return True
+    misrouted += 1
+    return False
+
+
+def stats():
+    return {
+        'worker_id': WORKER_ID,
+        'worker_count': WORKER_COUNT,
+        'misrouted_connects': misrouted,
+    }
@@ -1,33 +1,121 @@
-import os, time, random, math, sqlite3
+import os, time, math, uuid, secrets, collections
 from datetime import timedelta
 from flask import Flask, render_template, request, session, jsonify, redirect, url_for
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from functools import wraps
 
 # 引入我們的 SQLite 資料庫函數
-from db_utils import init_db, find_account, register_account, verify_account, update_ratings
+from db_utils import (init_db, find_account, find_accounts, register_account, verify_account, update_ratings,
+                      get_leaderboard as fetch_leaderboard, get_leaderboard_stats, LEADERBOARD_PAGE_SIZE, LEADERBOARD_MAX_PAGE_SIZE,
+                      load_rank_index, sync_rank_index, RANK_SYNC_INTERVAL, get_account_cache_stats)
+from rank_index import rank_index
+from hash_pool import hash_pool, HashPoolBusy
+from match_log import match_log, log_answer, log_match
+from question_utils import DIFFICULTIES, generate_schedule
+from room import Room, RoomState, RoomRegistry, RoomExists
+from room_reaper import RoomReaper
+from room_store import create_store
+from matchmaker import RankedQueue
+from game_scheduler import game_scheduler
+from broadcast import BroadcastBatcher
+import room_status
+import affinity
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get("SECRET_KEY", "replace‑me‑with‑a‑real‑secret")
-socketio = SocketIO(app, cors_allowed_origins="*")
+
+# 多 worker 模式：廣播經由訊息佇列轉給持有連線的 worker
+# SOCKETIO_MESSAGE_QUEUE 可以是 redis://...（Flask-SocketIO 內建）或 local://host:port（local_broker.py）
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+if SOCKETIO_MESSAGE_QUEUE and SOCKETIO_MESSAGE_QUEUE.startswith('local://'):
+    from local_broker import LocalBrokerManager
+    socketio = SocketIO(app, cors_allowed_origins="*",
+                        client_manager=LocalBrokerManager(SOCKETIO_MESSAGE_QUEUE))
+else:
+    socketio = SocketIO(app, cors_allowed_origins="*", message_queue=SOCKETIO_MESSAGE_QUEUE)
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=30)
 
+# 密碼雜湊在 eventlet 模式下改用 tpool 的 OS 執行緒，避免卡住 hub
+hash_pool.configure(use_eventlet=socketio.async_mode == 'eventlet')
+
+# 所有房間的倒數與逾時由同一個排程任務驅動
+game_scheduler.start(socketio.start_background_task, socketio.server.eio.create_event)
+
+# 房間廣播在 BROADCAST_TICK 內合併成一個訊框送出，同一房間的事件依序送達
+broadcaster = BroadcastBatcher(socketio.emit, game_scheduler)
+
+def room_emit(room_id, event, data, skip_sid=None):
+    """廣播給房間內的玩家；skip_sid 的連線不處理該事件"""
+    broadcaster.emit(event, data, room_id, skip_sid)
+
 # 確保資料庫初始化
 init_db()
+load_rank_index()
+
+def rank_sync_loop():
+    """定期套用其他 worker 寫入的積分與註冊，各 worker 的排名最多落後 RANK_SYNC_INTERVAL 秒"""
+    while True:
+        socketio.sleep(RANK_SYNC_INTERVAL)
+        try:
+            sync_rank_index()
+        except Exception as e:
+            print(f"排名索引同步失敗: {e!r}")
+
+socketio.start_background_task(rank_sync_loop)
 
 # 遊戲相關常數
 VALID_GAME_TIMES = [15, 30, 100]  # 合法的遊戲時間（秒）
 VALID_QUESTION_COUNTS = [3, 7, 15]  # 合法的題目數量
 
-DIFFICULTY_BOUNDS = {
-    'easy':    50,  # a,b < 50
-    'medium':  100, # a,b < 100
-    'hard':    200  # a,b < 200
-}
 GAME_MODES = {'first', 'speed', 'practice', 'ranked'}  # 添加 'ranked' 積分模式
 
-# 遊戲房間數據
-rooms = {}
+GAME_START_COUNTDOWN = 5     # 全員準備後開始第一題前的倒數秒數
+RANKED_START_DELAY = 5       # 積分模式配對成功後自動開始前的秒數
+NEXT_QUESTION_COUNTDOWN = 3  # 下一題前的倒數秒數
+ANSWER_REVEAL_DELAY = 3      # 本題結束後顯示答案的秒數
+
+# 房間與配對隊列的儲存層，由 ROOM_STORE 設定（記憶體 / SQLite / Redis）
+room_store = create_store()
+
+# 遊戲房間數據：room_id → Room，並維護 username → room_id 的反向索引
+rooms = RoomRegistry(store=room_store)
+
+def on_room_reaped(room_id, room, reason):
+    """閒置房間被回收後通知仍在房間頻道中的玩家"""
+    broadcaster.flush(room_id)      # 先送出尚未送出的廣播，關閉頻道後就送不到了
+    socketio.emit('room_closed', {'reason': reason}, room=room_id)
+    socketio.close_room(room_id)
+
+# 依房間狀態回收閒置房間
+room_reaper = RoomReaper(rooms, on_reap=on_room_reaped)
+rooms.on_load = room_reaper.watch   # 其他 worker 建立的房間載入後也納入回收
+room_reaper.start(socketio.start_background_task, socketio.sleep)
+
+# Socket.IO 事件處理時間與 CPU 時間（秒），處理函式應立即返回，等待交給 game_scheduler
+handler_latency = collections.defaultdict(lambda: collections.deque(maxlen=1000))
+
+def timed_handler(f):
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        started = time.perf_counter()
+        cpu_started = time.thread_time()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            handler_latency[f.__name__].append(
+                (time.perf_counter() - started, time.thread_time() - cpu_started))
+    return wrapped
+
+def handler_latency_stats():
+    return {
+        name: {
+            'count': len(samples),
+            'avg_ms': sum(wall for wall, _ in samples) / len(samples) * 1000,
+            'max_ms': max(wall for wall, _ in samples) * 1000,
+            'avg_cpu_ms': sum(cpu for _, cpu in samples) / len(samples) * 1000,
+        }
+        for name, samples in handler_latency.items() if samples
+    }
 
 def login_required(f):
     @wraps(f)
@@ -43,12 +131,15 @@ def register():
     if request.method=='POST':
         u = request.form['username'].strip()
         p = request.form['password']
-        if not u or not p:
-            error = '帳號密碼不可空'
-        elif not register_account(u, p):
-            error = '使用者已存在'
-        else:
-            return redirect(url_for('login'))
+        try:
+            if not u or not p:
+                error = '帳號密碼不可空'
+            elif not register_account(u, p):
+                error = '使用者已存在'
+            else:
+                return redirect(url_for('login'))
+        except HashPoolBusy:
+            error = '伺服器忙碌中，請稍後再試'
     return render_template('register.html', error=error)
 
 @app.route('/login', methods=['GET','POST'])
@@ -58,12 +149,15 @@ def login():
         u = request.form['username']
         p = request.form['password']
         remember = request.form.get('remember')  # 來自前端的 checkbox
-        if verify_account(u, p):
-            session['username'] = u
-            # 如果使用者勾選「記住我」，把這個 Session 設為永久
-            session.permanent = bool(remember)
-            return redirect(url_for('index'))
-        error = '帳號或密碼錯誤'
+        try:
+            if verify_account(u, p):
+                session['username'] = u
+                # 如果使用者勾選「記住我」，把這個 Session 設為永久
+                session.permanent = bool(remember)
+                return redirect(url_for('index'))
+            error = '帳號或密碼錯誤'
+        except HashPoolBusy:
+            error = '伺服器忙碌中，請稍後再試'
     return render_template('login.html', error=error)
 
 @app.route('/logout')
@@ -71,44 +165,35 @@ def logout():
     session.clear()
     return redirect(url_for('login'))
 
-def is_prime(n):
-    """檢查一個數是否為質數"""
-    if n <= 1:
-        return False
-    if n <= 3:
-        return True
-    if n % 2 == 0 or n % 3 == 0:
-        return False
-    i = 5
-    while i * i <= n:
-        if n % i == 0 or n % (i + 2) == 0:
-            return False
-        i += 6
-    return True
+def get_ratings(usernames):
+    """一次查詢多位玩家的積分，查無帳號者視為 1500"""
+    accounts = find_accounts(usernames)
+    return {u: accounts[u]['rating'] if u in accounts else 1500 for u in usernames}
 
-def get_primes(start, end):
-    """獲取指定範圍內的所有質數"""
-    return [num for num in range(start, end + 1) if is_prime(num)]
+def build_room_status(room_id, **extra):
+    """組出完整的 room_status 快照，額外欄位以關鍵字參數附加"""
+    room = rooms[room_id]
+    return room_status.snapshot(room, get_ratings(room.player_list()),
+                                game_mode=room.game_mode,
+                                is_ranked=room.is_ranked,
+                                auto_start=room.auto_start,
+                                **extra)
 
-def mod_inverse(a, m):
-    return pow(a, -1, m)
+def broadcast_room_delta(room_id, delta, skip_sid=None):
+    """廣播房間狀態的變更（由 room_status.delta 產生，房間需已儲存）"""
+    room_emit(room_id, 'room_delta', delta, skip_sid=skip_sid)
 
-def generate_question(difficulty: str):
-    """生成一個有關模反元素的問題"""
-    bound = DIFFICULTY_BOUNDS[difficulty]
-    primes = get_primes(11, bound - 1)
-    p = random.choice(primes)
-    
-    # 選擇 a，確保 a 和 p 互質 (這裡小於 p 的數一定與 p 互質，因為 p 是質數)
-    a = random.randint(2, p - 1)
-    
-    answer = mod_inverse(a, p)
-    return {
-        'p': p,
-        'a': a,
-        'answer': answer,
-        'time_started': time.time()  # 記錄問題開始時間
-    }
+def notify_player_left(room_id, username):
+    """玩家離開後通知房間內其他玩家；房間已因無人而刪除時不做任何事"""
+    delta = rooms.update(room_id, lambda room: room_status.delta(room, room_status.left(username)))
+    if delta is not None:
+        room_emit(room_id, 'user_left', {'username': username})
+        broadcast_room_delta(room_id, delta)
+
+def notify_moved_players(moved):
+    """通知玩家因加入新房間而離開的原房間"""
+    for username, previous_room_id in moved:
+        notify_player_left(previous_room_id, username)
 
 @app.route('/')
 @login_required
@@ -129,7 +214,9 @@ def index():
     return render_template('index.html',
                            username=username,
                            rating=rating,
-                           rating_class=rating_class)
+                           rating_class=rating_class,
+                           rank=rank_index.rank(username),
+                           total_players=len(rank_index))
 
 # 修改 create_room 函數，添加 question_count 參數
 @app.route('/create_room', methods=['POST'])
@@ -144,7 +231,7 @@ def create_room():
     question_count = request.form.get('question_count', '7')
     
     # 驗證難度
-    if difficulty not in DIFFICULTY_BOUNDS:
+    if difficulty not in DIFFICULTIES:
         return jsonify({'error': '無效的難度設定'})
     
     # 驗證遊戲模式
@@ -167,37 +254,30 @@ def create_room():
     except ValueError:
         return jsonify({'error': '無效的題目數量'})
     
-    if not room_id:
-        # 創建一個6位數的隨機房間ID
-        room_id = ''.join(random.choices('0123456789', k=6))
+    if room_id:
+        # 6位數字保留給系統分配，自訂ID不可使用
+        if rooms.ids.is_reserved(room_id):
+            return jsonify({'error': '6位數字的房間ID保留給系統分配，請選擇其他房間ID'})
+        if room_id in rooms:
+            return jsonify({'error': '房間已存在，請選擇其他房間ID'})
+    else:
+        # 留空時由系統分配一個6位數的房間ID
+        room_id = None
     
-    if room_id in rooms:
+    # 設置房間屬性，包括是否為練習模式
+    room = Room(difficulty, game_mode, game_time, question_count,
+                is_practice=game_mode == 'practice')
+    try:
+        room_id, moved = rooms.create(room_id, room, [username])
+    except RoomExists:
+        # 檢查之後才被其他 worker 建立
         return jsonify({'error': '房間已存在，請選擇其他房間ID'})
+    room_reaper.watch(room_id, room)
+    notify_moved_players(moved)
     
     session['username'] = username
     session['room_id'] = room_id
     
-    # 設置房間屬性，包括是否為練習模式
-    is_practice = game_mode == 'practice'
-    
-    rooms[room_id] = {
-        'players': [username],
-        'ready': {},
-        'scores': {username: 0},
-        'current_question': None,
-        'question_number': 0,
-        'answers': {},
-        'game_started': False,
-        'question_timer': None,
-        'difficulty': difficulty,
-        'game_mode': game_mode,
-        'game_time': str(game_time),  # 轉換為字串以保持一致性
-        'question_count': question_count,
-        'correct_order': [],        # 比速度用
-        'first_correct_done': False, # 搶快用
-        'is_practice': is_practice   # 標記是否為練習模式
-    }
-    
     return jsonify({'room_id': room_id})
 
 # 修改 join_existing_room 函數，檢查用戶名長度
@@ -208,24 +288,26 @@ def join_existing_room():
     username = session['username']
     room_id = request.form.get('room_id')
     
-    if not room_id in rooms:
+    room = rooms.get(room_id)
+    if room is None:
         return jsonify({'error': '找不到此房間'})
     
-    if rooms[room_id]["game_started"] == True:
+    if room.game_started:
         return jsonify({'error': '遊戲已經開始，無法加入'})
     
     # 檢查是否為練習模式房間，練習模式只允許創建者一人
-    if rooms[room_id].get('is_practice', False) or rooms[room_id]['game_mode'] == 'practice':
+    if room.is_practice or room.game_mode == 'practice':
         return jsonify({'error': '此為練習模式房間，不允許其他玩家加入'})
     
-    if len(rooms[room_id]['players']) >= 10:
+    if len(room) >= 10:
         return jsonify({'error': '房間已滿'})
     
     session['username'] = username
     session['room_id'] = room_id
     
-    rooms[room_id]['players'].append(username)
-    rooms[room_id]['scores'][username] = 0
+    moved = rooms.add_player(room_id, username)
+    if moved:
+        notify_moved_players([moved])
     
     return jsonify({'room_id': room_id})
 
@@ -237,242 +319,291 @@ def leave_current_room():
         username = session['username']
         room_id = session['room_id']
         
-        if room_id in rooms and username in rooms[room_id]['players']:
-            rooms[room_id]['players'].remove(username)
-            
-            if username in rooms[room_id]['scores']:
-                del rooms[room_id]['scores'][username]
-            
-            if username in rooms[room_id]['ready']:
-                del rooms[room_id]['ready'][username]
-            
-            # 如果房間空了，刪除房間
-            if len(rooms[room_id]['players']) == 0:
-                del rooms[room_id]
-            else:
-                # 通知房間內其他玩家
-                socketio.emit('user_left', {'username': username}, room=room_id)
-                ratings = {}
-                for u in rooms[room_id]['players']:
-                    acct = find_account(u)
-                    ratings[u] = acct['rating'] if acct else 1500
-
-                socketio.emit('room_status', {
-                    'players':      rooms[room_id]['players'],
-                    'scores':       rooms[room_id]['scores'],
-                    'ready':        rooms[room_id]['ready'],
-                    'game_started': rooms[room_id]['game_started'],
-                    'ratings':      ratings
-                }, room=room_id)
+        # 房間空了會由 rooms 一併刪除，否則通知房間內其他玩家
+        if rooms.remove_player(room_id, username):
+            notify_player_left(room_id, username)
         
         # 清除會話
         session.pop('room_id', None)
         
     return jsonify({'success': True})
 
+def lobby_channel(username):
+    """大廳連線加入的個人頻道，配對結果與排隊狀態推送到這裡"""
+    return f'user:{username}'
+
 @socketio.on('connect')
 def handle_connect():
+    # 大廳（首頁）的連線只訂閱個人頻道，不是房間連線
+    if request.args.get('lobby'):
+        if 'username' in session:
+            join_room(lobby_channel(session['username']))
+            if session['username'] in ranked_queue:
+                emit('queue_position', {'waiting': len(ranked_queue)})
+        return
+    
     if 'username' in session and 'room_id' in session:
         username = session['username']
         room_id = session['room_id']
         
-        if room_id in rooms:
+        room = rooms.get(room_id)
+        if room is not None:
+            # 轉發層應把房間的連線都送到負責的 worker，這裡記錄送錯的次數
+            affinity.record_connect(room_id)
+            room.touch()
             join_room(room_id)
-            emit('user_joined', {'username': username}, room=room_id)
+            rating = get_ratings([username])[username]
             
-            # 如果是積分模式，標記該玩家已連接
-            if rooms[room_id].get('is_ranked', False) or rooms[room_id]['game_mode'] == 'ranked':
-                # 記錄玩家已連接，但還不是準備狀態
-                if username not in rooms[room_id]['ready']:
-                    rooms[room_id]['ready'][username] = False
+            def mark_connected(room):
+                # 斷線期間已被移出房間的玩家不算重新加入
+                if username not in room:
+                    return None
+                # 如果是積分模式，記錄玩家已連接，但還不是準備狀態
+                if (room.is_ranked or room.game_mode == 'ranked') and username not in room.ready:
+                    room.ready[username] = False
+                return room_status.delta(room, room_status.joined(username, rating, room.ready.get(username)))
+            
+            # 其他玩家收到加入的變更，連線的玩家收到完整快照
+            delta = rooms.update(room_id, mark_connected)
+            if delta is None:
+                # 不廣播加入；房間還在時讓連線的玩家看到伺服器上的名單
+                if room_id in rooms:
+                    emit('room_status', build_room_status(room_id))
+                return
+            room_emit(room_id, 'user_joined', {'username': username})
+            broadcast_room_delta(room_id, delta, skip_sid=request.sid)
+            emit('room_status', build_room_status(room_id))
+            
+            # 由伺服器排定自動開始，推送一次剩餘秒數，前端自行倒數
+            if room.is_ranked and not room.game_started and room.games_played == 0:
+                countdown = schedule_ranked_start(room_id, room)
+                room_emit(room_id, 'ranked_countdown_update', {
+                    'countdown': countdown,
+                    'total_players': len(room),
+                    'connected_players': len(room.ready)
+                })
                 
                 # 檢查是否所有玩家都已連接
-                if len(rooms[room_id]['ready']) == len(rooms[room_id]['players']):
+                if room.all_ready():
                     # 觸發積分模式倒數
-                    socketio.emit('ranked_all_connected', {
-                        'countdown': 5,
-                        'players': rooms[room_id]['players']
-                    }, room=room_id)
-            
-            # 更新房間狀態
-            ratings = {}
-            for u in rooms[room_id]['players']:
-                acct = find_account(u)
-                ratings[u] = acct['rating'] if acct else 1500
-
-            socketio.emit('room_status', {
-                'players':      rooms[room_id]['players'],
-                'scores':       rooms[room_id]['scores'],
-                'ready':        rooms[room_id]['ready'],
-                'game_started': rooms[room_id]['game_started'],
-                'ratings':      ratings,
-                'game_mode':    rooms[room_id]['game_mode'],
-                'is_ranked':    rooms[room_id].get('is_ranked', False),
-                'auto_start':   rooms[room_id].get('auto_start', False)
-            }, room=room_id)
+                    room_emit(room_id, 'ranked_all_connected', {
+                        'countdown': countdown,
+                        'players': room.player_list()
+                    })
+
+@socketio.on('sync_room_status')
+def handle_sync_room_status():
+    """前端發現版本不連續時，重新送出完整快照"""
+    room_id = session.get('room_id')
+    if room_id in rooms:
+        emit('room_status', build_room_status(room_id))
 
 @socketio.on('disconnect')
+@timed_handler
 def handle_disconnect():
+    if request.args.get('lobby'):
+        return
+    
     if 'username' in session and 'room_id' in session:
         username = session['username']
         room_id = session['room_id']
         
-        if room_id in rooms:
-            if username in rooms[room_id]['players']:
-                rooms[room_id]['players'].remove(username)
-                
-                if username in rooms[room_id]['scores']:
-                    del rooms[room_id]['scores'][username]
-                
-                if username in rooms[room_id]['ready']:
-                    del rooms[room_id]['ready'][username]
-                
-                if len(rooms[room_id]['players']) == 0:
-                    del rooms[room_id]
-                else:
-                    emit('user_left', {'username': username}, room=room_id)
-                    ratings = {}
-                    for u in rooms[room_id]['players']:
-                        acct = find_account(u)
-                        ratings[u] = acct['rating'] if acct else 1500
-
-                    socketio.emit('room_status', {
-                        'players':      rooms[room_id]['players'],
-                        'scores':       rooms[room_id]['scores'],
-                        'ready':        rooms[room_id]['ready'],
-                        'game_started': rooms[room_id]['game_started'],
-                        'ratings':      ratings
-                    }, room=room_id)
+        if rooms.remove_player(room_id, username):
+            notify_player_left(room_id, username)
             
         leave_room(room_id)
 
 @socketio.on('player_ready')
+@timed_handler
 def handle_player_ready():
     username = session.get('username')
     room_id = session.get('room_id')
     
-    if not (username and room_id and room_id in rooms):
+    if not username:
         return
     
-    rooms[room_id]['ready'][username] = True
+    def mark_ready(room):
+        if username not in room:
+            return None
+        room.ready[username] = True
+        room.touch()
+        delta = room_status.delta(room, room_status.ready(username, True))
+        # 全員準備且人數足夠時在同一次寫入中進入 STARTING，兩個 worker 不會都開始比賽
+        # 練習模式允許單人，其他模式需要至少兩人
+        min_players = 1 if room.game_mode == 'practice' else 2
+        starting = room.all_ready() and len(room) >= min_players and not room.game_started
+        if starting:
+            room.state = RoomState.STARTING
+        return room, delta, starting, min_players
+    
+    marked = rooms.update(room_id, mark_ready)
+    if marked is None:
+        return
+    room, delta, starting, min_players = marked
+    broadcast_room_delta(room_id, delta)
     
     # 檢查是否所有玩家都準備好了
-    all_ready = len(rooms[room_id]['ready']) == len(rooms[room_id]['players'])
-    
-    # 檢查玩家人數是否滿足要求：練習模式允許單人，其他模式需要至少兩人
-    game_mode = rooms[room_id]['game_mode']
-    min_players = 1 if game_mode == 'practice' else 2
-    enough_players = len(rooms[room_id]['players']) >= min_players
+    all_ready = room.all_ready()
+    game_mode = room.game_mode
+    enough_players = len(room) >= min_players
     
-    if all_ready and enough_players and not rooms[room_id]['game_started']:
-        emit('player_ready_status', {
+    if starting:
+        room_emit(room_id, 'player_ready_status', {
             'username': username,
-            'ready_count': len(rooms[room_id]['ready']),
-            'total_players': len(rooms[room_id]['players'])
-        }, room=room_id)
-        rooms[room_id]['game_started'] = True
+            'ready_count': len(room.ready),
+            'total_players': len(room)
+        })
         start_game(room_id)
     else:
         # 如果準備好了但人數不足，發送特殊消息
         if all_ready and not enough_players and game_mode != 'practice':
-            emit('not_enough_players', {
+            room_emit(room_id, 'not_enough_players', {
                 'min_players': min_players,
-                'current_players': len(rooms[room_id]['players']),
-                'game_mode': rooms[room_id]['game_mode']
-            }, room=room_id)
+                'current_players': len(room),
+                'game_mode': room.game_mode
+            })
         else:
-            emit('player_ready_status', {
+            room_emit(room_id, 'player_ready_status', {
                 'username': username,
-                'ready_count': len(rooms[room_id]['ready']),
-                'total_players': len(rooms[room_id]['players'])
-            }, room=room_id)
+                'ready_count': len(room.ready),
+                'total_players': len(room)
+            })
 
 # 修改 start_game 函數
 def start_game(room_id):
     """開始遊戲"""
-    if room_id not in rooms:
+    def reset_match(room):
+        # 重置積分和問題計數
+        room.question_number = 1
+        room.scores = {player: 0 for player in room.players}
+        room.answers = {}
+        room.match_id = uuid.uuid4().hex  # 對戰紀錄編號
+        room.match_started_at = time.time()
+        
+        # 一次產生整場比賽的題目；(seed, difficulty, question_count) 可完整重現本場比賽
+        room.seed = secrets.randbits(63)
+        room.schedule = generate_schedule(room.seed, room.difficulty, room.question_count)
+        return room, room_status.delta(room, room_status.started(True),
+                                       *(room_status.score(player, 0) for player in room.players))
+    
+    started = rooms.update(room_id, reset_match)
+    if started is None:
         return
+    room, delta = started
+    broadcast_room_delta(room_id, delta)
     
-    game_mode = rooms[room_id]['game_mode']
-    is_ranked = rooms[room_id].get('is_ranked', False)
+    # 發送開始遊戲倒數（之後的流程在排程器中執行，不能使用依賴請求的 emit）
+    room_emit(room_id, 'game_countdown', {'countdown': GAME_START_COUNTDOWN})
     
-    # 重置積分和問題計數
-    rooms[room_id]['question_number'] = 1
-    rooms[room_id]['scores'] = {player: 0 for player in rooms[room_id]['players']}
-    rooms[room_id]['answers'] = {}
-    
-    # 發送開始遊戲倒數
-    emit('game_countdown', {'countdown': 5}, room=room_id)
-    
-    # 等待5秒後開始第一題
-    socketio.sleep(5)
-    
-    # 檢查房間是否還存在
-    if room_id not in rooms:
+    # 倒數結束後由排程器開始第一題
+    room.question_timer = game_scheduler.call_later(
+        GAME_START_COUNTDOWN, begin_game, room_id, room, room.match_id)
+
+def begin_game(room_id, room, match_id):
+    """開始倒數結束，進入第一題"""
+    def play(current):
+        # 檢查房間是否還存在，且仍是同一場比賽
+        if current is not room or current.match_id != match_id:
+            return None
+        # 如果是積分模式，確保使用搶快模式
+        if current.is_ranked:
+            current.game_mode = 'first'
+        current.state = RoomState.PLAYING
+        return current.game_mode
+    
+    game_mode = rooms.update(room_id, play)
+    if game_mode is None:
         return
-    
-    # 如果是積分模式，確保使用搶快模式
-    if is_ranked and game_mode != 'first':
-        rooms[room_id]['game_mode'] = 'first'
-        game_mode = 'first'
-    
-    emit('game_started', {'game_mode': game_mode}, room=room_id)
+    room_emit(room_id, 'game_started', {'game_mode': game_mode})
     next_question(room_id)
 
 # 修改 next_question 函數，檢查題目數量
 def next_question(room_id):
     """生成下一個問題"""
-    print(f"進入 next_question 函數，房間 {room_id}，問題編號 {rooms[room_id]['question_number'] if room_id in rooms else 'N/A'}")
+    room = rooms.get(room_id)
+    print(f"進入 next_question 函數，房間 {room_id}，問題編號 {room.question_number if room else 'N/A'}")
     
     # 檢查房間是否存在
-    if room_id not in rooms:
+    if room is None:
         print(f"房間 {room_id} 不存在，退出 next_question")
         return
     
     # 檢查是否達到最大問題數量
-    if rooms[room_id]['question_number'] > rooms[room_id]['question_count']:
+    if room.question_number > room.question_count:
         print(f"達到最大問題數量，結束遊戲，房間 {room_id}")
         end_game(room_id)
         return
     
-    # 發送下一題倒數提示
-    if rooms[room_id]['question_number'] > 1:
+    # 發送下一題倒數提示，倒數結束後由排程器出題
+    if room.question_number > 1:
         print(f"發送下一題倒數，房間 {room_id}")
-        socketio.emit('next_question_countdown', {'countdown': 3}, room=room_id)
-        socketio.sleep(3)
+        room_emit(room_id, 'next_question_countdown', {'countdown': NEXT_QUESTION_COUNTDOWN})
+        room.question_timer = game_scheduler.call_later(
+            NEXT_QUESTION_COUNTDOWN, show_question, room_id, room, room.question_number)
+    else:
+        show_question(room_id, room, room.question_number)
+
+def show_question(room_id, room, question_number):
+    """出題並排定本題的逾時"""
+    def ask(current):
+        if current is not room or current.question_number != question_number:
+            return None
+        # 重置房間狀態
+        current.first_correct_done = False
+        current.answers = {}
+        current.correct_order = []
+        
+        # 從預先產生的題目表取出本題
+        p, a, answer = current.schedule[question_number - 1]
+        current.current_question = {
+            'p': p,
+            'a': a,
+            'answer': answer,
+            'time_started': time.time()  # 記錄問題開始時間
+        }
+        current.touch()
+        return current.current_question
     
-    # 重置房間狀態
     print(f"重置房間狀態，准備新問題，房間 {room_id}")
-    rooms[room_id]['first_correct_done'] = False
-    rooms[room_id]['answers'] = {}
-    rooms[room_id]['correct_order'] = []
-    
-    # 生成新問題
-    question = generate_question(rooms[room_id]['difficulty'])
-    rooms[room_id]['current_question'] = question
+    question = rooms.update(room_id, ask)
+    if question is None:
+        return
     
-    # 啟動新的問題計時器
-    rooms[room_id]['question_timer'] = socketio.start_background_task(
-        question_timeout, room_id, rooms[room_id]['question_number']
-    )
+    # 排定本題的逾時，提前結束時會被取消
+    room.question_timer = game_scheduler.call_later(
+        room.game_time, question_timeout, room_id, room, room.question_number)
     
     # 發送新問題到前端
-    print(f"發送新問題到前端，房間 {room_id}，問題編號 {rooms[room_id]['question_number']}")
-    socketio.emit('new_question', {
-        'question_number': rooms[room_id]['question_number'],
-        'question_count': rooms[room_id]['question_count'],
-        'p': question['p'],
-        'a': question['a'],
-        'game_mode': rooms[room_id]['game_mode'],
-        'game_time': rooms[room_id]['game_time'],
-    }, room=room_id)
+    print(f"發送新問題到前端，房間 {room_id}，問題編號 {room.question_number}")
+    room_emit(room_id, 'new_question', {
+        'question_number': room.question_number,
+        'question_count': room.question_count,
+        # 大模數超過 JavaScript 的安全整數範圍，一律以字串傳送
+        'p': str(question['p']),
+        'a': str(question['a']),
+        'game_mode': room.game_mode,
+        'game_time': room.game_time,
+    })
 
 def end_game(room_id):
     """結束遊戲並計算最終結果"""
-    if room_id not in rooms:
+    def finish(room):
+        # 回到等待狀態只會成功一次，積分與對戰紀錄不會重複寫入
+        if not room.game_started:
+            return None
+        ended = (room, dict(room.scores), room.match_id, room.match_started_at)
+        # 重置房間遊戲狀態，稍後廣播回到等待與準備狀態清除的變更
+        was_ready = list(room.ready)
+        room.reset_after_game()
+        delta = room_status.delta(room, room_status.started(False),
+                                  *(room_status.ready(player, False) for player in was_ready))
+        return ended + (delta,)
+    
+    finished = rooms.update(room_id, finish)
+    if finished is None:
         return
+    room, scores, match_id, match_started_at, delta = finished
     
-    scores = rooms[room_id]['scores']
     winner = max(scores, key=scores.get) if scores else None
     max_score = scores.get(winner, 0) if winner else 0
     
@@ -493,167 +624,148 @@ def end_game(room_id):
         }
     
     # 獲取賽前積分
-    old_ratings = {}
-    for u in rooms[room_id]['players']:
-        user = find_account(u)
-        old_ratings[u] = user['rating'] if user else 1500
+    players = room.player_list()
+    old_ratings = get_ratings(players)
     
     # 只有在積分模式下才更新積分
     rating_changes = {}
-    if rooms[room_id].get('is_ranked', False):
-        # 計算積分變化
-        rating_changes = calculate_rating_changes(scores, old_ratings)
-        
-        # 更新每個玩家的積分
-        # 直接傳入比賽分數，讓 update_ratings 函數自己計算積分變化
-        update_ratings(scores)
+    if room.is_ranked:
+        # 賽前積分在寫入交易中重新讀取，不使用可能過期的帳號快取，回傳值即為實際寫入的結果
+        old_ratings, rating_changes = update_ratings(scores)
     
     # 在 game_over 事件中添加積分變化信息
-    result['is_ranked'] = rooms[room_id].get('is_ranked', False)
+    result['is_ranked'] = room.is_ranked
     result['old_ratings'] = old_ratings
     result['rating_changes'] = rating_changes
+    result['ranks'] = {u: rank_index.rank(u) for u in players}
 
-    # 廣播 game_over
-    socketio.emit('game_over', result, room=room_id)
-
-    # 準備最新的 ratings dict
-    ratings = {}
-    for u in rooms[room_id]['players']:
-        user = find_account(u)
-        ratings[u] = user['rating'] if user else 1500
-
-    # 廣播最新房間狀態
-    socketio.emit('room_status', {
-        'players':      rooms[room_id]['players'],
-        'scores':       rooms[room_id]['scores'],
-        'ready':        rooms[room_id]['ready'],
-        'game_started': rooms[room_id]['game_started'],
-        'ratings':      ratings,
-        'room_id':      room_id,
-        'game_mode':    rooms[room_id]['game_mode']
-    }, room=room_id)
-
-    # 重置房間遊戲狀態
-    rooms[room_id]['game_started']     = False
-    rooms[room_id]['ready']            = {}
-    rooms[room_id]['current_question'] = None
-    rooms[room_id]['question_number']  = 0
-
-def question_timeout(room_id, question_number):
-    """處理問題計時，當時間到時自動進入下一題"""
-    # 等待指定的遊戲時間
-    socketio.sleep(int(rooms[room_id]['game_time']))
-    
-    # 檢查房間是否還存在
-    if room_id not in rooms:
+    # 寫入對戰紀錄（背景批次寫入，不等待）
+    if match_id:
+        log_match(match_id, room_id, room, match_started_at,
+                  scores, old_ratings, rating_changes)
+
+    # 廣播 game_over，再廣播回到等待與準備狀態清除的變更
+    room_emit(room_id, 'game_over', result)
+    broadcast_room_delta(room_id, delta)
+
+def question_timeout(room_id, room, question_number):
+    """本題時間到：公布答案，稍後進入下一題"""
+    # 檢查房間是否還存在，且仍在同一個問題
+    if rooms.get(room_id) is not room or room.question_number != question_number:
         return
     
-    # 檢查是否仍在同一個問題（避免重複處理）
-    if rooms[room_id]['question_number'] == question_number:
-        # 通知所有玩家時間到
-        socketio.emit('time_up', {
-            'correct_answer': rooms[room_id]['current_question']['answer']
-        }, room=room_id)
-        
-        # 在前端顯示答案後短暫延遲
-        socketio.sleep(3)
-        
-        # 再次檢查房間是否存在，以防在延遲期間房間被刪除
-        if room_id in rooms and rooms[room_id]['question_number'] == question_number:
-            # 更新問題編號並進入下一題
-            rooms[room_id]['question_number'] += 1
-            
-            # 使用獨立的任務啟動下一題，避免阻塞當前線程
-            socketio.start_background_task(
-                next_question, room_id
-            )
+    # 通知所有玩家時間到
+    room_emit(room_id, 'time_up', {
+        'correct_answer': str(room.current_question['answer'])
+    })
+    
+    # 在前端顯示答案後短暫延遲
+    room.question_timer = game_scheduler.call_later(
+        ANSWER_REVEAL_DELAY, advance_question, room_id, room, question_number)
+
+def advance_question(room_id, room, question_number):
+    """更新問題編號並進入下一題"""
+    def advance(current):
+        if current is not room or current.question_number != question_number:
+            return False
+        current.question_number += 1
+        return True
+    
+    if rooms.update(room_id, advance):
+        next_question(room_id)
 
 @socketio.on('submit_answer')
+@timed_handler
 def handle_answer(data):
     username = session.get('username')
     room_id  = session.get('room_id')
     raw_ans  = data.get('answer', '').strip()
 
     # -------- 基本檢查 --------
-    if not (username and room_id and room_id in rooms):
+    if not username:
         return
-    if not raw_ans.isdigit():
+    # isdigit 也接受「²」等非 ASCII 數字，int() 會失敗
+    if not (raw_ans.isascii() and raw_ans.isdigit()):
         emit('answer_rejected', {'message': '答案必須是整數'})
         return
     answer = int(raw_ans)
 
-    room = rooms[room_id]
-    q    = room['current_question']
-    mode = room['game_mode']
-
-    # 已經回答過就忽略
-    if username in room['answers']:
-        return
+    def record(room):
+        """在房間上記錄作答並計分；回傳 None 表示忽略，字串表示拒絕的原因"""
+        if username not in room or room.state is not RoomState.PLAYING or room.current_question is None:
+            return None
+        q = room.current_question
+        # 模 p 的反元素一定在 [0, p) 內，範圍外的答案不記錄也不計分
+        if answer >= q['p']:
+            return f"答案必須介於 0 與 {q['p'] - 1} 之間"
+        # 已經回答過就忽略
+        if username in room.answers:
+            return None
+        # 搶快規則：第一個正確的人以後全部拒絕
+        if room.game_mode == 'first' and room.first_correct_done:
+            return '已有玩家答對搶走分數'
 
-    # -------- 搶快規則：第一個正確的人以後全部拒絕 --------
-    if mode == 'first' and room['first_correct_done']:
-        emit('answer_rejected', {'message': '已有玩家答對搶走分數'}, to=request.sid)
-        return
+        room.answers[username] = answer
+        room.touch()
+        correct = answer == q['answer']
+        points = 0
+        if correct:
+            if room.game_mode == 'first':
+                points = 1
+                room.first_correct_done = True
+            else:  # speed
+                rank = len(room.correct_order)
+                points = max(1, 3 - rank)      # 3/2/1/1…
+                room.correct_order.append(username)
+            room.scores[username] += points
+        delta = room_status.delta(room, room_status.score(username, room.scores[username])) if points else None
+        # 下一題條件：搶快模式且有人答對，或所有人都已作答
+        needs_next = (room.game_mode == 'first' and room.first_correct_done) or room.all_answered()
+        return room, q, correct, points, delta, needs_next
 
     # -------- 記錄答案 --------
-    room['answers'][username] = answer
-    correct = answer == q['answer']
+    outcome = rooms.update(room_id, record)
+    if outcome is None:
+        return
+    if isinstance(outcome, str):
+        emit('answer_rejected', {'message': outcome}, to=request.sid)
+        return
+    room, q, correct, points, delta, needs_next = outcome
+    mode = room.game_mode
     time_taken = round(time.time() - q['time_started'], 2)
-    emit('player_answered', {'username': username}, room=room_id, include_self=False)
+    room_emit(room_id, 'player_answered', {'username': username}, skip_sid=request.sid)
+    if delta:
+        broadcast_room_delta(room_id, delta)
 
-    points = 0
-    if correct:
-        if mode == 'first':
-            if not room['first_correct_done']:
-                points = 1
-                room['scores'][username] += points
-                room['first_correct_done'] = True
-        else:  # speed
-            rank = len(room['correct_order'])
-            points = max(1, 3 - rank)      # 3/2/1/1…
-            room['correct_order'].append(username)
-            room['scores'][username] += points
-    socketio.emit('update_scores', {'scores': room['scores']}, room=room_id)
+    if room.match_id:
+        log_answer(room.match_id, room.question_number, username, q['p'], q['a'],
+                   answer, correct, points, time_taken)
 
     emit('answer_result', {
         'username': username,
         'correct': correct,
         'points': points,
         'time_taken': time_taken,
-        'correct_answer': q['answer']
+        'correct_answer': str(q['answer'])
     }, to=request.sid)
 
     if correct and points > 0:
-        emit('someone_answered_correctly', {
+        room_emit(room_id, 'someone_answered_correctly', {
             'username': username,
             'mode': mode,
             'stop_timer': mode == 'first'  # 如果是搶快模式則通知前端停止計時器
-        }, room=room_id)
+        })
     else:
-        emit('someone_answered_incorrectly', {
+        room_emit(room_id, 'someone_answered_incorrectly', {
             'username': username,
             'mode': mode                  # ★ 告知前端目前模式
-        }, room=room_id)
-
-    # 下一題條件
-    everyone_done = len(room['answers']) == len(room['players'])
-    needs_next = False
+        })
 
-    if mode == 'first' and room['first_correct_done']:
-        needs_next = True  # 搶快模式且有人答對
-    elif everyone_done:
-        needs_next = True  # 所有人都已作答
-        
     if needs_next:
-        current_question = room['question_number']  # 記錄當前問題編號
-        room['question_number'] += 1  # 增加問題編號
-        
-        # 使用短暫延遲讓玩家看到結果
-        socketio.sleep(3)
-        
-        # 確保仍在相同問題（沒有由其他地方觸發下一題）
-        if room_id in rooms and room['question_number'] == current_question + 1:
-            next_question(room_id)
+        # 本題已結束：取消逾時計時器，短暫顯示結果後進入下一題
+        game_scheduler.cancel(room.question_timer)
+        room.question_timer = game_scheduler.call_later(
+            ANSWER_REVEAL_DELAY, advance_question, room_id, room, room.question_number)
 
 @app.route('/game')
 def game():
@@ -665,7 +777,8 @@ def game():
     if room_id not in rooms:
         return redirect(url_for('index'))
     
-    return render_template('game.html')
+    # room_id 供 Socket.IO 連線時帶上，讓多 worker 的轉發層依房間選擇 worker
+    return render_template('game.html', room_id=room_id)
 
 @app.route('/get_room_id')
 def get_room_id():
@@ -674,7 +787,7 @@ def get_room_id():
         room_id = session['room_id']
         return jsonify({
             'room_id': room_id,
-            'game_mode': rooms[room_id]['game_mode']
+            'game_mode': rooms[room_id].game_mode
         })
     return jsonify({'error': '未找到房間ID'})
 
@@ -686,12 +799,12 @@ def get_room_info():
         room = rooms[room_id]
         return jsonify({
             'room_id': room_id,
-            'game_mode': room['game_mode'],
-            'difficulty': room['difficulty'],
-            'game_time': room['game_time'],
-            'question_count': room['question_count'],
-            'players_count': len(room['players']),
-            'is_ranked': room.get('is_ranked', room['game_mode'] == 'ranked')
+            'game_mode': room.game_mode,
+            'difficulty': room.difficulty,
+            'game_time': room.game_time,
+            'question_count': room.question_count,
+            'players_count': len(room),
+            'is_ranked': room.is_ranked or room.game_mode == 'ranked'
         })
     return jsonify({'error': '未找到房間信息'})
 
@@ -704,49 +817,106 @@ def leaderboard():
 # Add this API endpoint to get leaderboard data
 @app.route('/api/leaderboard')
 def get_leaderboard():
-    """Get the leaderboard data as JSON"""
-    conn = sqlite3.connect('modular_inverse_game.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT username, rating 
-        FROM users 
-        ORDER BY rating DESC
-    """)
-    
-    players = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    
-    return jsonify({'players': players})
+    """Get one page of leaderboard data as JSON"""
+    try:
+        limit = int(request.args.get('limit', LEADERBOARD_PAGE_SIZE))
+        after_rating = request.args.get('after_rating', type=int)
+        after_id = request.args.get('after_id', type=int)
+    except ValueError:
+        return jsonify({'error': '無效的分頁參數'}), 400
+    prefix = request.args.get('q', '').strip() or None
+    
+    players, next_cursor = fetch_leaderboard(limit, after_rating, after_id, prefix)
+    return jsonify({
+        'players': players,
+        'next': next_cursor,
+        'stats': get_leaderboard_stats()
+    })
+
+@app.route('/api/metrics')
+def get_metrics():
+    """伺服器內部指標"""
+    return jsonify({
+        'account_cache': get_account_cache_stats(),
+        'hash_pool': hash_pool.stats(),
+        'match_log': match_log.stats(),
+        'rooms': dict(rooms.ids.stats(), active=len(rooms), store_conflicts=rooms.conflicts),
+        'room_reaper': room_reaper.stats(),
+        'game_scheduler': game_scheduler.stats(),
+        'broadcast': broadcaster.stats(),
+        'matchmaker': ranked_queue.stats(),
+        'handler_latency': handler_latency_stats(),
+        'worker': affinity.stats()
+    })
+
+@app.route('/api/rank')
+@login_required
+def get_rank():
+    """查詢玩家的全域排名與百分位數（預設為目前登入的玩家）"""
+    username = request.args.get('username') or session['username']
+    rank = rank_index.rank(username)
+    if rank is None:
+        return jsonify({'error': '找不到此玩家'}), 404
+    
+    return jsonify({
+        'username': username,
+        'rank': rank,
+        'total': len(rank_index),
+        'percentile': rank_index.percentile(username)
+    })
+
+@app.route('/api/rank/top')
+def get_top_players():
+    """取得積分最高的 k 位玩家"""
+    k = min(max(request.args.get('k', 10, type=int), 1), LEADERBOARD_MAX_PAGE_SIZE)
+    return jsonify({
+        'players': [
+            {'username': username, 'rating': rating, 'rank': rank}
+            for username, rating, rank in rank_index.top(k)
+        ]
+    })
 
 @socketio.on('player_cancel_ready')
+@timed_handler
 def handle_player_cancel_ready():
     username = session.get('username')
     room_id = session.get('room_id')
     
-    if not (username and room_id and room_id in rooms):
+    if not username:
         return
     
+    def cancel_ready(room):
+        # 遊戲已經開始或玩家尚未準備時不修改房間
+        if room.game_started or username not in room.ready:
+            return room, None
+        # 如果玩家之前已準備，則移除準備狀態
+        del room.ready[username]
+        room.touch()
+        return room, room_status.delta(room, room_status.ready(username, False))
+    
+    cancelled = rooms.update(room_id, cancel_ready)
+    if cancelled is None:
+        return
+    room, delta = cancelled
+    
     # 如果遊戲已經開始，則不允許取消準備
-    if rooms[room_id]['game_started']:
+    if delta is None and room.game_started:
         emit('cancel_ready_response', {
             'success': False,
             'message': '遊戲已經開始，無法取消準備'
         }, to=request.sid)
         return
     
-    # 如果玩家之前已準備，則移除準備狀態
-    if username in rooms[room_id]['ready']:
-        del rooms[room_id]['ready'][username]
+    if delta is not None:
+        broadcast_room_delta(room_id, delta)
         
         # 通知所有玩家此玩家取消了準備
-        emit('player_ready_status', {
+        room_emit(room_id, 'player_ready_status', {
             'username': username,
-            'ready_count': len(rooms[room_id]['ready']),
-            'total_players': len(rooms[room_id]['players']),
+            'ready_count': len(room.ready),
+            'total_players': len(room),
             'canceled': True  # 添加一個標記表示這是取消準備
-        }, room=room_id)
+        })
         
         emit('cancel_ready_response', {
             'success': True
@@ -758,8 +928,62 @@ def handle_player_cancel_ready():
             'message': '您尚未準備，無法取消準備'
         }, to=request.sid)
 
-# 創建用於存儲積分模式隊列的字典
-ranked_queue = []  # 僅使用一個簡單的列表儲存等待匹配的玩家
+# 積分模式隊列，存放在儲存層中，多個 worker 共用；依積分分桶配對
+ranked_queue = RankedQueue(room_store)
+
+def create_ranked_match(player1, player2):
+    """為配對成功的兩名玩家建立積分房間，回傳 (room_id, room)"""
+    # 獲取玩家積分
+    player_ratings = get_ratings([player1, player2])
+    player1_rating = player_ratings[player1]
+    player2_rating = player_ratings[player2]
+    
+    # 根據較低積分的玩家決定難度
+    lower_rating = min(player1_rating, player2_rating)
+    
+    if lower_rating < 1400:  # 新手
+        difficulty = 'easy'
+        question_count = 3
+    elif lower_rating < 1600:  # 專家
+        difficulty = 'easy'
+        question_count = 7
+    elif lower_rating < 1900:  # 精通
+        difficulty = 'medium'
+        question_count = 7
+    else:  # 大師
+        difficulty = 'hard'
+        question_count = 15
+    
+    # 創建房間，房間ID由系統分配
+    # 設置房間屬性：固定為搶快模式（而不是 'ranked'）、每題 30 秒，並自動開始
+    room = Room(difficulty, 'first', 30, question_count,
+                is_ranked=True, auto_start=True, match_time=time.time())
+    room_id, moved = rooms.create(None, room, [player1, player2])
+    room_reaper.watch(room_id, room)
+    notify_moved_players(moved)
+    
+    # 推送給大廳中等待的玩家；前端收到後以 check_match_status 取得房間並設定會話
+    for username, opponent in ((player1, player2), (player2, player1)):
+        socketio.emit('matched', {
+            'room_id': room_id,
+            'opponent': opponent,
+            'difficulty': difficulty,
+            'question_count': question_count
+        }, room=lobby_channel(username))
+    return room_id, room
+
+def push_queue_position(username, waited, window, waiting):
+    """推送排隊狀態給仍在等待的玩家"""
+    socketio.emit('queue_position', {
+        'waiting': waiting,
+        'waited': round(waited),
+        'window': round(window)
+    }, room=lobby_channel(username))
+
+# 定期批次配對；共用儲存層時只由一個 worker 負責，其他 worker 的玩家透過 check_match_status 找到房間
+if affinity.is_owner('ranked_queue'):
+    ranked_queue.start(create_ranked_match, socketio.start_background_task, socketio.sleep,
+                       on_waiting=push_queue_position)
 
 # 添加加入積分模式隊列的路由
 @app.route('/join_ranked_queue', methods=['POST'])
@@ -776,67 +1000,12 @@ def join_ranked_queue():
         return jsonify({'status': 'waiting'})
     
     # 添加用戶到隊列
-    ranked_queue.append(username)
+    ranked_queue.append(username, get_ratings([username])[username])
     
-    # 如果隊列中至少有兩名玩家，進行匹配
-    if len(ranked_queue) >= 2:
-        # 獲取前兩名玩家
-        player1 = ranked_queue.pop(0)
-        player2 = ranked_queue.pop(0)
-        
-        # 注意：為確保穩定性，這裡再次檢查玩家是否存在
-        if player1 != username and player2 != username:
-            # 這種情況不應該發生，但為了防止錯誤，將當前玩家重新加入隊列
-            ranked_queue.append(username)
-            return jsonify({'status': 'waiting'})
-        
-        # 獲取玩家積分
-        player1_data = find_account(player1)
-        player2_data = find_account(player2)
-        player1_rating = player1_data['rating'] if player1_data else 1500
-        player2_rating = player2_data['rating'] if player2_data else 1500
-        
-        # 根據較低積分的玩家決定難度
-        lower_rating = min(player1_rating, player2_rating)
-        
-        if lower_rating < 1400:  # 新手
-            difficulty = 'easy'
-            question_count = 3
-        elif lower_rating < 1600:  # 專家
-            difficulty = 'easy'
-            question_count = 7
-        elif lower_rating < 1900:  # 精通
-            difficulty = 'medium'
-            question_count = 7
-        else:  # 大師
-            difficulty = 'hard'
-            question_count = 15
-        
-        # 創建房間
-        room_id = ''.join(random.choices('0123456789', k=6))
-        while room_id in rooms:
-            room_id = ''.join(random.choices('0123456789', k=6))
-        
-        # 設置房間屬性
-        rooms[room_id] = {
-            'players': [player1, player2],
-            'ready': {},
-            'scores': {player1: 0, player2: 0},
-            'current_question': None,
-            'question_number': 0,
-            'answers': {},
-            'game_started': False,
-            'question_timer': None,
-            'difficulty': difficulty,
-            'game_mode': 'first',  # 確保是搶快模式，而不是 'ranked'
-            'game_time': '30',  # 固定為30秒
-            'question_count': question_count,
-            'correct_order': [],
-            'first_correct_done': False,
-            'is_ranked': True,  # 標記為積分模式
-            'auto_start': True,  # 標記為自動開始
-            'match_time': time.time()  # 記錄匹配時間
-        }
+    # 立即尋找積分相近的對手；找不到時由批次配對隨等待時間放寬範圍
+    pair = ranked_queue.try_match(username)
+    if pair:
+        room_id, room = create_ranked_match(*pair)
         
         # 設置當前用戶的會話
         session['room_id'] = room_id
@@ -845,12 +1014,12 @@ def join_ranked_queue():
         return jsonify({
             'status': 'matched',
             'room_id': room_id,
-            'opponent': player2 if username == player1 else player1,
-            'difficulty': difficulty,
-            'question_count': question_count
+            'opponent': pair[1],
+            'difficulty': room.difficulty,
+            'question_count': room.question_count
         })
     
-    # 如果隊列中只有一個玩家，返回等待狀態
+    # 暫時沒有合適的對手，返回等待狀態
     return jsonify({'status': 'waiting'})
 
 @app.route('/check_match_status', methods=['POST'])
@@ -863,26 +1032,26 @@ def check_match_status():
         return jsonify({'error': '用戶未登入'})
     
     # 檢查用戶是否已經在某個房間中
-    for room_id, room in rooms.items():
-        if username in room['players']:
-            # 找到對手
-            opponent = None
-            for player in room['players']:
-                if player != username:
-                    opponent = player
-                    break
-            
-            # 設置會話
-            session['room_id'] = room_id
-            
-            # 返回房間信息
-            return jsonify({
-                'status': 'matched',
-                'room_id': room_id,
-                'opponent': opponent,
-                'difficulty': room['difficulty'],
-                'question_count': room['question_count']
-            })
+    room_id, room = rooms.room_of(username)
+    if room is not None:
+        # 找到對手
+        opponent = None
+        for player in room.players:
+            if player != username:
+                opponent = player
+                break
+        
+        # 設置會話
+        session['room_id'] = room_id
+        
+        # 返回房間信息
+        return jsonify({
+            'status': 'matched',
+            'room_id': room_id,
+            'opponent': opponent,
+            'difficulty': room.difficulty,
+            'question_count': room.question_count
+        })
     
     # 檢查用戶是否在等待隊列中
     if username in ranked_queue:
@@ -910,7 +1079,7 @@ def check_ranked_match():
         
         # 獲取對手信息
         opponent = None
-        for player in room['players']:
+        for player in room.players:
             if player != username:
                 opponent = player
                 break
@@ -926,8 +1095,8 @@ def check_ranked_match():
             'status': 'matched',
             'room_id': room_id,
             'opponent': opponent,
-            'difficulty': room['difficulty'],
-            'question_count': room['question_count'],
+            'difficulty': room.difficulty,
+            'question_count': room.question_count,
             'auto_redirect': True
         })
     
@@ -937,41 +1106,30 @@ def check_ranked_match():
     
     return jsonify({'status': 'not_matched'})
 
-@socketio.on('check_ranked_countdown')
-def check_ranked_countdown():
-    """檢查積分模式倒數狀態"""
-    username = session.get('username')
-    room_id = session.get('room_id')
-    
-    if not (username and room_id and room_id in rooms):
-        return
-    
-    room = rooms[room_id]
-    if not room.get('is_ranked', False):
-        return
-    
-    # 計算自匹配以來經過的時間
-    match_time = room.get('match_time', time.time())
-    elapsed = time.time() - match_time
-    countdown = max(0, 5 - int(elapsed))  # 5秒倒數
-    
-    # 發送倒數信息
-    emit('ranked_countdown_update', {
-        'countdown': countdown,
-        'total_players': len(room['players']),
-        'connected_players': len(room['ready'])
-    }, room=room_id)
-    
-    # 如果倒數結束，且還沒開始遊戲，則自動標記所有玩家為準備就緒
-    if countdown <= 0 and not room['game_started'] and len(room['players']) >= 2:
+def schedule_ranked_start(room_id, room):
+    """在負責房間的 worker 上排定積分模式自動開始（只排一次），回傳剩餘秒數"""
+    match_time = room.match_time or time.time()
+    countdown = max(0, math.ceil(match_time + RANKED_START_DELAY - time.time()))
+    if room.question_timer is None or not room.question_timer.active:
+        room.question_timer = game_scheduler.call_later(
+            match_time + RANKED_START_DELAY - time.time(), start_ranked_game, room_id, room)
+    return countdown
+
+def start_ranked_game(room_id, room):
+    """積分模式倒數結束，自動標記所有玩家為準備就緒並開始遊戲"""
+    def mark_all_ready(current):
+        if current is not room or current.game_started or len(current) < 2:
+            return False
         # 確保所有玩家都準備就緒
-        for player in room['players']:
-            if player not in room['ready']:
-                room['ready'][player] = True
-        
-        # 啟動遊戲
-        room['game_started'] = True
-        socketio.start_background_task(start_game, room_id)
+        for player in current.players:
+            if player not in current.ready:
+                current.ready[player] = True
+        current.state = RoomState.STARTING
+        return True
+    
+    # 啟動遊戲
+    if rooms.update(room_id, mark_all_ready):
+        start_game(room_id)
 
 # 添加確認積分模式匹配的路由
 @app.route('/confirm_ranked_match', methods=['POST'])
@@ -1012,66 +1170,6 @@ def cancel_ranked_queue():
     
     return jsonify({'status': 'canceled'})
 
-# 計算積分變化的函數
-def calculate_rating_changes(scores, old_ratings):
-    """計算每位玩家的積分變化"""
-    players = list(scores.keys())
-    n = len(players)
-    if n < 2:
-        return {}
-    
-    # 檢查是否有平手情況
-    scores_values = list(scores.values())
-    max_score = max(scores_values)
-    winners = [p for p, s in scores.items() if s == max_score]
-    
-    # 如果有多個贏家（平手），返回空字典（不更新積分）
-    if len(winners) > 1:
-        return {player: 0 for player in players}
-    
-    # K 值
-    K = 32
-    
-    # 計算實際得分
-    actual = {}
-    for i in players:
-        si = scores[i]
-        total = 0.0
-        for j in players:
-            if i == j:
-                continue
-            sj = scores[j]
-            if si > sj:
-                total += 1
-            elif si == sj:
-                total += 0.5
-        actual[i] = total
-    
-    # 計算期望得分
-    expected = {}
-    for i in players:
-        Ri = old_ratings[i]
-        esum = 0.0
-        for j in players:
-            if i == j:
-                continue
-            Rj = old_ratings[j]
-            esum += 1 / (1 + 10 ** ((Rj - Ri) / 400))
-        expected[i] = esum
-    
-    # 計算積分變化
-    changes = {}
-    for player in players:
-        S_norm = actual[player] / (n - 1)
-        E_norm = expected[player] / (n - 1)
-        delta = K * (S_norm - E_norm)
-        changes[player] = round(delta)
-    
-    return changes
-
-if __name__ == '__main__':
-    socketio.run(app, host='0.0.0.0', port=8000, debug=True)
-
 # 添加到 app.py
 @app.route('/reset_ranked_match', methods=['POST'])
 @login_required
@@ -1082,26 +1180,13 @@ def reset_ranked_match():
     if not username:
         return jsonify({'error': '用戶未登入'})
     
-    # 檢查用戶是否在某個房間中
-    user_room_id = None
-    for room_id, room in rooms.items():
-        if username in room['players'] and room.get('is_ranked', False):
-            user_room_id = room_id
-            break
-    
-    if not user_room_id:
+    # 檢查用戶是否在某個積分模式房間中
+    user_room_id, room = rooms.room_of(username)
+    if room is None or not room.is_ranked:
         return jsonify({'message': '未找到積分模式匹配'})
     
-    # 清除用戶在該房間的記錄
-    rooms[user_room_id]['players'].remove(username)
-    if username in rooms[user_room_id]['scores']:
-        del rooms[user_room_id]['scores'][username]
-    if username in rooms[user_room_id]['ready']:
-        del rooms[user_room_id]['ready'][username]
-    
-    # 如果房間空了，刪除房間
-    if len(rooms[user_room_id]['players']) == 0:
-        del rooms[user_room_id]
+    # 清除用戶在該房間的記錄，房間空了會一併刪除
+    rooms.remove_player(user_room_id, username)
     
     # 同時從積分隊列中移除
     if username in ranked_queue:
@@ -1109,4 +1194,9 @@ def reset_ranked_match():
     
     session.pop('room_id', None)
     
-    return jsonify({'success': True, 'message': '已重置積分模式匹配狀態'})
\ No newline at end of file
+    return jsonify({'success': True, 'message': '已重置積分模式匹配狀態'})
+
+if __name__ == '__main__':
+    # 由 run_cluster.py 啟動時每個 worker 使用各自的 HOST/PORT，且不能開啟 debug 重新載入
+    socketio.run(app, host=os.environ.get('HOST', '0.0.0.0'), port=int(os.environ.get('PORT', 8000)),
+                 debug=affinity.WORKER_COUNT == 1, allow_unsafe_werkzeug=True)
@@ -0,0 +1,286 @@
+"""
+效能基準測試
+
+    python bench/bench.py                 執行全部
+    python bench/bench.py rank_index room 只執行指定的項目
+
+正確性檢查在 tests/，以 python -m pytest 執行。
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import timeit
+import tracemalloc
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import question_utils
+import room_status
+from affinity import HashRing
+from game_scheduler import GameScheduler
+from matchmaker import Matchmaker
+from rank_index import RankIndex
+from room import Room, RoomState
+from timer_wheel import TimerWheel
+
+
+def bench_affinity():
+    # 分布與換手比例：4 → 5 個 worker 時約 1/5 的房間換手
+    room_ids = [f'{i:06d}' for i in range(100_000)]
+    before = HashRing(range(4))
+    after = HashRing(range(5))
+    print("4 個 worker 的分布:", sorted(Counter(before.node_for(r) for r in room_ids).values()))
+    moved = sum(before.node_for(r) != after.node_for(r) for r in room_ids)
+    print(f"增加到 5 個 worker，換手的房間比例 {moved / len(room_ids):.1%}")
+
+
+def bench_game_scheduler():
+    # 10,000 個房間各排一個 0~2 秒後到期的計時器，其中一半在到期前取消
+    scheduler = GameScheduler()
+    fired = []
+    calls = [scheduler.call_later(random.uniform(0, 2), fired.append, i) for i in range(10_000)]
+    for call in calls[::2]:
+        scheduler.cancel(call)
+    started = time.monotonic()
+    while time.monotonic() - started < 2.2:
+        time.sleep(min(scheduler.run_due(), 0.005) or 0.001)
+    print(f"執行 {len(fired)} 個計時器", scheduler.stats())
+
+
+def bench_matchmaker():
+    # 模擬：一開始 10,000 人同時排隊，之後每秒再加入 ARRIVALS 人，每秒批次配對一次
+    N = 10_000
+    ARRIVALS = 1_000
+    SECONDS = 60
+    rng = random.Random(0)
+
+    def rating():
+        return int(rng.gauss(1500, 250))
+
+    mm = Matchmaker()
+    joined = {}
+    ratings = {}
+
+    def arrive(count, now):
+        for _ in range(count):
+            username = f'user{len(ratings)}'
+            ratings[username] = rating()
+            joined[username] = now
+            mm.add(username, ratings[username], now)
+
+    arrive(N, 0.0)
+    diffs, waits, pass_ms = [], [], []
+    for second in range(SECONDS):
+        now = float(second)
+        if second:
+            arrive(ARRIVALS, now)
+        queued = len(mm)
+        for a, b in mm.match(now):
+            diffs.append(abs(ratings[a] - ratings[b]))
+            waits.extend((now - joined[a], now - joined[b]))
+        pass_ms.append((mm.last_pass_ms, queued))
+        if second in (0, 1, 10, SECONDS - 1):
+            print(f"t={second:>2}s 排隊 {queued:>6}，配對耗時 {mm.last_pass_ms:.1f} ms")
+
+    def pct(values, p):
+        return sorted(values)[min(len(values) - 1, int(len(values) * p))]
+
+    print(f"共配對 {len(diffs)} 組，仍在等待 {len(mm)} 人")
+    print(f"積分差: 平均 {statistics.mean(diffs):.1f}，p50 {pct(diffs, 0.5)}，"
+          f"p95 {pct(diffs, 0.95)}，最大 {max(diffs)}")
+    print(f"等待時間: p50 {pct(waits, 0.5):.0f} 秒，p95 {pct(waits, 0.95):.0f} 秒，最大 {max(waits):.0f} 秒")
+    worst = max(pass_ms)
+    print(f"單次批次配對最長 {worst[0]:.1f} ms（排隊 {worst[1]} 人）")
+
+    # 對照：先來先配對（原本的 FIFO 隊列）
+    fifo = [rating() for _ in range(N)]
+    fifo_diffs = [abs(fifo[i] - fifo[i + 1]) for i in range(0, N - 1, 2)]
+    print(f"FIFO 對照積分差: 平均 {statistics.mean(fifo_diffs):.1f}，p95 {pct(fifo_diffs, 0.95)}")
+
+    # 加入與取消的成本
+    t = time.perf_counter()
+    for i in range(N):
+        mm.add(f'bench{i}', rating(), SECONDS)
+    add_us = (time.perf_counter() - t) / N * 1e6
+    t = time.perf_counter()
+    for i in range(N):
+        mm.remove(f'bench{i}')
+    remove_us = (time.perf_counter() - t) / N * 1e6
+    print(f"加入 {add_us:.2f} µs/次，取消 {remove_us:.2f} µs/次")
+
+
+def bench_question_utils():
+    # 微基準測試：題庫抽樣 vs. 每題重新找質數並計算反元素
+    qu = question_utils
+
+    def generate_question_direct(difficulty):
+        bound = qu.DIFFICULTY_BOUNDS[difficulty]
+        primes = qu.get_primes(qu.MIN_PRIME, bound - 1)
+        p = random.choice(primes)
+        a = random.randint(2, p - 1)
+        return {'p': p, 'a': a, 'answer': qu.mod_inverse(a, p), 'time_started': time.time()}
+
+    N = 20000
+    for difficulty in qu.DIFFICULTY_BOUNDS:
+        direct = timeit.timeit(lambda: generate_question_direct(difficulty), number=N) / N
+        banked = timeit.timeit(lambda: qu.generate_question(difficulty), number=N) / N
+        print(f"{difficulty:>6}: 題庫 {len(qu.QUESTION_BANKS[difficulty]):>5} 題 | "
+              f"逐題計算 {direct * 1e6:7.2f} µs | 題庫抽樣 {banked * 1e6:5.2f} µs | "
+              f"{direct / banked:5.1f}x")
+
+    for difficulty, bits in qu.LARGE_DIFFICULTY_BITS.items():
+        qu.generate_question(difficulty)  # 等待質數池完成
+        banked = timeit.timeit(lambda: qu.generate_question(difficulty), number=N) / N
+        direct = timeit.timeit(lambda: qu.random_prime(bits), number=200) / 200
+        print(f"{difficulty:>7}: {bits} 位元 | 題目抽樣 {banked * 1e6:5.2f} µs | "
+              f"單次產生質數 {direct * 1e6:7.2f} µs")
+
+
+def bench_rank_index():
+    # 100 萬名模擬玩家
+    N = 1_000_000
+    rng = random.Random(0)
+    rows = [(f'user{i}', int(rng.gauss(1500, 200))) for i in range(N)]
+
+    index = RankIndex()
+    t = time.perf_counter()
+    index.load(rows)
+    print(f"載入 {N} 名玩家: {time.perf_counter() - t:.2f} 秒")
+
+    samples = [rows[rng.randrange(N)][0] for _ in range(100_000)]
+    t = time.perf_counter()
+    for username in samples:
+        index.rank(username)
+    elapsed = time.perf_counter() - t
+    print(f"rank 查詢: 每次 {elapsed / len(samples) * 1e6:.2f} µs")
+
+    t = time.perf_counter()
+    for username in samples:
+        index.percentile(username)
+    elapsed = time.perf_counter() - t
+    print(f"percentile 查詢: 每次 {elapsed / len(samples) * 1e6:.2f} µs")
+
+    t = time.perf_counter()
+    for username in samples:
+        index.set(username, rng.randint(1000, 2000))
+    elapsed = time.perf_counter() - t
+    print(f"rating 更新: 每次 {elapsed / len(samples) * 1e6:.2f} µs")
+
+    for k in (10, 100):
+        t = time.perf_counter()
+        for _ in range(1000):
+            index.top(k)
+        elapsed = time.perf_counter() - t
+        print(f"top-{k} 查詢: 每次 {elapsed / 1000 * 1e6:.2f} µs")
+
+
+def bench_room():
+    # 記憶體：100,000 個閒置房間，原本的 dict 與 Room 比較
+    N = 100_000
+
+    def make_dict_room(i):
+        username = f'user{i}'
+        return {
+            'players': [username],
+            'ready': {},
+            'scores': {username: 0},
+            'current_question': None,
+            'question_number': 0,
+            'answers': {},
+            'game_started': False,
+            'question_timer': None,
+            'difficulty': 'easy',
+            'game_mode': 'first',
+            'game_time': '30',
+            'question_count': 7,
+            'correct_order': [],
+            'first_correct_done': False,
+            'is_practice': False
+        }
+
+    def make_room(i):
+        room = Room('easy', 'first', 30, 7)
+        room.add_player(f'user{i}')
+        return room
+
+    for name, factory in (('dict', make_dict_room), ('Room', make_room)):
+        tracemalloc.start()
+        rooms = {str(i): factory(i) for i in range(N)}
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name:>4}: {current / N:7.1f} bytes/房間，共 {current / 2**20:6.1f} MiB")
+        del rooms
+
+
+def bench_room_status():
+    # 10 人房間，每種事件送完整快照與 delta 的大小與序列化時間
+    rs = room_status
+    room = Room('easy', 'speed', 30, 7)
+    ratings = {}
+    for i in range(10):
+        username = f'player_{i:02d}'
+        room.add_player(username)
+        room.ready[username] = True
+        room.scores[username] = i * 3
+        ratings[username] = 1400 + i * 37
+    room.state = RoomState.PLAYING
+
+    events = {
+        '玩家加入': rs.delta(room, rs.joined('player_09', 1733, False)),
+        '分數更新': rs.delta(room, rs.score('player_03', 12)),
+        '準備切換': rs.delta(room, rs.ready('player_05', False)),
+        '比賽結束': rs.delta(room, rs.started(False), *(rs.ready(u, False) for u in room.players)),
+    }
+    full = rs.snapshot(room, ratings)
+
+    def measure(payload, n=20_000):
+        started_at = time.perf_counter()
+        for _ in range(n):
+            encoded = json.dumps(payload, separators=(',', ':'))
+        return len(encoded.encode()), (time.perf_counter() - started_at) / n * 1e6
+
+    full_bytes, full_us = measure(full)
+    print(f"完整快照: {full_bytes} bytes，序列化 {full_us:.2f} µs")
+    for name, payload in events.items():
+        size, us = measure(payload)
+        print(f"{name} delta: {size} bytes（快照的 {size / full_bytes:.0%}），序列化 {us:.2f} µs")
+
+
+def bench_timer_wheel():
+    # 隨機新增 / 取消計時器，量測每個 tick 的成本
+    rng = random.Random(16)
+    wheel = TimerWheel(tick=1.0, now=0.0)
+    timers = {}
+    steps = 300_000
+    started = time.perf_counter()
+    for step in range(steps):
+        if rng.random() < 0.3:
+            delay = rng.choice((rng.randrange(1, 70), rng.randrange(1, 5000), rng.randrange(1, 300_000)))
+            timers[step] = wheel.schedule(delay, step, now=step)
+        if rng.random() < 0.05 and timers:
+            wheel.cancel(timers.popitem()[1])
+        for key in wheel.advance(step + 1):
+            del timers[key]
+    elapsed = time.perf_counter() - started
+    print(f"{steps:,} 個 tick，{elapsed / steps * 1e6:.2f} µs/tick，"
+          f"剩餘 {len(wheel):,} 個計時器，累計 cascade {wheel.cascaded:,} 次")
+
+
+BENCHMARKS = {name[len('bench_'):]: fn for name, fn in globals().items() if name.startswith('bench_')}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="效能基準測試")
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help=f"要執行的項目：{', '.join(BENCHMARKS)}（預設全部）")
+    args = parser.parse_args()
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"未知的項目：{', '.join(sorted(unknown))}")
+    for name in args.names or BENCHMARKS:
+        print(f"== {name}")
+        BENCHMARKS[name]()
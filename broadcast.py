@@ -0,0 +1,81 @@
+"""
+房間廣播合併
+
+一次作答會觸發好幾個房間廣播（player_answered、room_delta、someone_answered_*、換題事件），
+比速度模式下多人幾乎同時作答時，每個事件都要各自序列化並送給房間內每個連線。
+這裡把同一房間在 BROADCAST_TICK 秒內產生的事件暫存起來，tick 結束時合併成一個
+batch 訊框：[[事件, 資料], [事件, 資料, 略過的連線], ...]，前端依序交給原本的處理函式。
+
+同一房間的事件依呼叫順序送出；只有一個事件時直接以原本的事件名稱送出。
+BROADCAST_TICK 設為 0 時不合併，每個事件立即送出。
+"""
+import collections
+import os
+import threading
+import time
+
+BROADCAST_TICK = float(os.environ.get('BROADCAST_TICK', 0.03))   # 合併的時間窗（秒）
+RATE_WINDOW = 10.0           # 計算每秒送出訊框數的時間窗（秒）
+
+
+class BroadcastBatcher:
+    def __init__(self, emit, scheduler, tick=BROADCAST_TICK):
+        self._emit = emit                # emit(event, data, to=..., skip_sid=...)，例如 socketio.emit
+        self.scheduler = scheduler       # 提供 call_later 的排程器，例如 game_scheduler
+        self.tick = tick
+        self._pending = {}               # 房間 → [[事件, 資料(, 略過的連線)], ...]
+        self._lock = threading.Lock()
+        self.events = 0
+        self.frames = 0
+        self._frame_times = collections.deque()
+
+    def emit(self, event, data, room, skip_sid=None):
+        """送出房間廣播；tick 內的事件會合併，skip_sid 的連線不處理該事件"""
+        if self.tick <= 0:
+            self.events += 1
+            self._send(event, data, room, skip_sid)
+            return
+        entry = [event, data, skip_sid] if skip_sid else [event, data]
+        with self._lock:
+            self.events += 1
+            buffer = self._pending.get(room)
+            if buffer is not None:
+                buffer.append(entry)
+                return
+            self._pending[room] = [entry]
+        self.scheduler.call_later(self.tick, self.flush, room)
+
+    def flush(self, room):
+        """立即送出房間暫存的事件"""
+        with self._lock:
+            buffer = self._pending.pop(room, None)
+        if not buffer:
+            return
+        if len(buffer) == 1:
+            event, data, *skip = buffer[0]
+            self._send(event, data, room, skip[0] if skip else None)
+        else:
+            self._send('batch', buffer, room, None)
+
+    def _send(self, event, data, room, skip_sid):
+        self._emit(event, data, to=room, skip_sid=skip_sid)
+        now = time.monotonic()
+        with self._lock:
+            self.frames += 1
+            self._frame_times.append(now)
+            while self._frame_times[0] < now - RATE_WINDOW:
+                self._frame_times.popleft()
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            while self._frame_times and self._frame_times[0] < now - RATE_WINDOW:
+                self._frame_times.popleft()
+            return {
+                'tick_ms': self.tick * 1000,
+                'events': self.events,
+                'frames': self.frames,
+                'events_per_frame': self.events / self.frames if self.frames else 0,
+                'frames_per_sec': len(self._frame_times) / RATE_WINDOW,
+                'pending_rooms': len(self._pending),
+            }
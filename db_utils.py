@@ -1,179 +1,640 @@
 import sqlite3
 import os
-from werkzeug.security import generate_password_hash, check_password_hash
+import queue
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from hash_pool import hash_password, check_password
+from rating_utils import compute_rating_changes, DEFAULT_RATING
+from rank_index import rank_index
 
 # 資料庫檔案路徑
 DB_FILE = os.path.join(os.path.dirname(__file__), 'modular_inverse_game.db')
 
-def init_db():
-    """初始化資料庫，建立必要的資料表"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # 建立使用者資料表
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        pw_hash TEXT NOT NULL,
-        rating INTEGER DEFAULT 1500,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+# 連線池設定
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))   # 每個 worker 最多保留的連線數
+STATEMENT_CACHE_SIZE = 256                           # 每條連線快取的已編譯 SQL 數量
+MMAP_SIZE = 256 * 1024 * 1024                        # 256MB 記憶體映射
+BUSY_TIMEOUT_MS = 5000                               # 遇到鎖時最多等待的毫秒數
+
+# 排行榜分頁設定
+LEADERBOARD_PAGE_SIZE = 50
+LEADERBOARD_MAX_PAGE_SIZE = 200
+
+# 帳號快取設定
+ACCOUNT_CACHE_SIZE = int(os.environ.get('ACCOUNT_CACHE_SIZE', 4096))  # 最多快取的帳號數
+ACCOUNT_CACHE_TTL = float(os.environ.get('ACCOUNT_CACHE_TTL', 300))   # 快取有效秒數
+
+# 排名索引同步：其他 worker 的積分與註冊經由 rating_feed 表傳到每個 worker
+RANK_SYNC_INTERVAL = float(os.environ.get('RANK_SYNC_INTERVAL', 1.0))  # 讀取 rating_feed 的間隔秒數
+RANK_FEED_RETENTION = 3600                                             # rating_feed 保留秒數
+RANK_FEED_PRUNE_INTERVAL = 60                                          # 清除過期紀錄的間隔秒數
+
+
+class ConnectionPool:
+    """
+    長駐的 SQLite 連線池
+
+    以 LIFO 佇列保存閒置連線，最近用過的連線（快取最熱）會優先被取出。
+    佇列使用標準庫 queue，eventlet monkey patch 後會自動變成 greenlet 友善的版本，
+    連線用完即歸還，因此同一條連線可被不同的 greenlet / 執行緒輪流使用。
+    """
+
+    def __init__(self, db_file, size=POOL_SIZE):
+        self.db_file = db_file
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._created = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_file,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row  # 讓查詢結果可以用列名訪問
+        # synchronous / mmap_size / busy_timeout 都是連線層級的設定，每條連線建立時套用一次
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def acquire(self):
+        """取出一條連線，池內沒有閒置連線且未達上限時建立新連線"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        if self._created < self.size:
+            self._created += 1
+            try:
+                return self._connect()
+            except Exception:
+                self._created -= 1
+                raise
+        return self._idle.get()
+
+    def release(self, conn):
+        """歸還連線，若仍有未結束的交易則先回滾"""
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+            self._created -= 1
+
+    def close_all(self):
+        """關閉所有閒置連線"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            self._created -= 1
+
+
+class AccountCache:
+    """
+    帳號資料的 LRU + TTL 快取
+
+    只快取存在的帳號；寫入 rating 時就地更新，新註冊時使舊項目失效。
+    hits / misses 計數可透過 stats() 取得。
+    """
+
+    def __init__(self, maxsize=ACCOUNT_CACHE_SIZE, ttl=ACCOUNT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # username → (expires_at, user dict)
+        self._lock = threading.Lock()
+
+    def get(self, username):
+        """取得快取中的帳號副本，不存在或已過期時回傳 None"""
+        with self._lock:
+            entry = self._data.get(username)
+            if entry is not None:
+                expires_at, user = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(username)
+                    self.hits += 1
+                    return dict(user)
+                del self._data[username]
+            self.misses += 1
+            return None
+
+    def put(self, user):
+        with self._lock:
+            username = user['username']
+            self._data[username] = (time.monotonic() + self.ttl, dict(user))
+            self._data.move_to_end(username)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def update_rating(self, username, rating):
+        """rating 寫入資料庫後就地更新，不影響 LRU 順序與到期時間"""
+        with self._lock:
+            entry = self._data.get(username)
+            if entry is not None:
+                entry[1]['rating'] = rating
+
+    def invalidate(self, username):
+        with self._lock:
+            self._data.pop(username, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0
+            }
+
+
+_pool = ConnectionPool(DB_FILE)
+_account_cache = AccountCache()
+
+@contextmanager
+def get_db():
+    """
+    從連線池借用一條連線
+    用法：
+        with get_db() as conn:
+            conn.execute(...)
+    """
+    conn = _pool.acquire()
+    try:
+        yield conn
+    finally:
+        _pool.release(conn)
+
+@contextmanager
+def transaction():
+    """借用連線並開啟交易，區塊正常結束時 commit，發生例外時 rollback"""
+    with get_db() as conn:
+        try:
+            yield conn
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+
+def _ensure_column(conn, table, column, decl):
+    """資料表缺少欄位時補上"""
+    columns = {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+_ANSWERS_TABLE = '''
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            match_id TEXT NOT NULL,
+            question_number INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            p TEXT NOT NULL,
+            a TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            correct INTEGER NOT NULL,
+            points INTEGER NOT NULL,
+            time_taken REAL NOT NULL,
+            answered_at REAL NOT NULL
+        )
+        '''
+
+def _migrate_answers_to_text(conn):
+    """舊版 answers 表的 p / a / answer 是 INTEGER，重建資料表改為 TEXT"""
+    types = {row['name']: row['type'].upper() for row in conn.execute("PRAGMA table_info(answers)")}
+    if types.get('p') == 'TEXT':
+        return
+    conn.execute("DROP INDEX IF EXISTS idx_answers_match")
+    conn.execute("DROP TABLE IF EXISTS answers_text")     # 上次遷移中斷留下的暫存表
+    conn.execute(_ANSWERS_TABLE.format(name='answers_text'))
+    conn.execute('''
+    INSERT INTO answers_text
+    SELECT id, match_id, question_number, username, CAST(p AS TEXT), CAST(a AS TEXT),
+           CAST(answer AS TEXT), correct, points, time_taken, answered_at
+    FROM answers
+    ''')
+    conn.execute("DROP TABLE answers")
+    conn.execute("ALTER TABLE answers_text RENAME TO answers")
+
+_RATING_FEED_TRIGGERS = ('trg_users_feed_insert', 'trg_users_feed_rating', 'trg_users_feed_delete')
+
+def _create_rating_feed(conn):
+    """
+    rating_feed：users 的新增、積分變更與刪除依提交順序記錄（rating 為 NULL 表示刪除），
+    各 worker 由 sync_rank_index() 套用到自己的排名索引
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS rating_feed (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        rating INTEGER,
+        created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
     )
     ''')
-    
-    conn.commit()
-    conn.close()
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_rating_feed_created ON rating_feed (created_at)"
+    )
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_users_feed_insert AFTER INSERT ON users
+    BEGIN
+        INSERT INTO rating_feed (username, rating) VALUES (NEW.username, NEW.rating);
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_users_feed_rating AFTER UPDATE OF rating ON users
+    WHEN NEW.rating IS NOT OLD.rating
+    BEGIN
+        INSERT INTO rating_feed (username, rating) VALUES (NEW.username, NEW.rating);
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_users_feed_delete AFTER DELETE ON users
+    BEGIN
+        INSERT INTO rating_feed (username, rating) VALUES (OLD.username, NULL);
+    END
+    ''')
+
+@contextmanager
+def bulk_rating_writes():
+    """
+    大量寫入 users 時暫停 rating_feed 的觸發器，結束後讓各 worker 重新載入排名索引
+    逐筆記錄會讓批次寫入慢約 40%，各 worker 逐筆套用也不比重新載入快
+    """
+    with transaction() as conn:
+        for name in _RATING_FEED_TRIGGERS:
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    try:
+        yield
+    finally:
+        with transaction() as conn:
+            _create_rating_feed(conn)
+            # seq 前進但不留下紀錄，sync_rank_index 發現缺漏後會重新載入
+            conn.execute("INSERT INTO rating_feed (username) VALUES ('')")
+            conn.execute("DELETE FROM rating_feed WHERE seq = last_insert_rowid()")
+
+def init_db():
+    """初始化資料庫，建立必要的資料表並設定 WAL 等 PRAGMA"""
+    with get_db() as conn:
+        # WAL 模式會寫入資料庫檔案，只需設定一次；讀寫不再互相阻塞
+        conn.execute("PRAGMA journal_mode=WAL")
+
+        # 建立使用者資料表
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            pw_hash TEXT NOT NULL,
+            rating INTEGER DEFAULT 1500,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+
+        # 排行榜依 rating 由高到低、同分依 id 排序，這個索引讓分頁與 MAX(rating) 不需掃描全表
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_users_rating ON users (rating DESC, id)"
+        )
+        # 排行榜搜尋以不分大小寫的名稱前綴查詢
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users (username COLLATE NOCASE)"
+        )
+
+        # 排行榜統計（人數、rating 總和）由觸發器遞增維護，不必每次重新彙總
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            user_count INTEGER NOT NULL,
+            rating_sum INTEGER NOT NULL
+        )
+        ''')
+        conn.execute('''
+        INSERT OR IGNORE INTO user_stats (id, user_count, rating_sum)
+        SELECT 0, COUNT(*), COALESCE(SUM(rating), 0) FROM users
+        ''')
+        conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_stats_insert AFTER INSERT ON users
+        BEGIN
+            UPDATE user_stats SET user_count = user_count + 1,
+                                  rating_sum = rating_sum + NEW.rating
+            WHERE id = 0;
+        END
+        ''')
+        conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_stats_rating AFTER UPDATE OF rating ON users
+        BEGIN
+            UPDATE user_stats SET rating_sum = rating_sum + NEW.rating - OLD.rating
+            WHERE id = 0;
+        END
+        ''')
+        conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_stats_delete AFTER DELETE ON users
+        BEGIN
+            UPDATE user_stats SET user_count = user_count - 1,
+                                  rating_sum = rating_sum - OLD.rating
+            WHERE id = 0;
+        END
+        ''')
+
+        _create_rating_feed(conn)
+
+        # 對戰紀錄：matches 一場一筆、match_players 每位玩家一筆、answers 每次作答一筆
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS matches (
+            id TEXT PRIMARY KEY,
+            room_id TEXT NOT NULL,
+            game_mode TEXT NOT NULL,
+            difficulty TEXT NOT NULL,
+            question_count INTEGER NOT NULL,
+            is_ranked INTEGER NOT NULL DEFAULT 0,
+            seed INTEGER,
+            started_at REAL NOT NULL,
+            ended_at REAL NOT NULL
+        )
+        ''')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS match_players (
+            match_id TEXT NOT NULL REFERENCES matches (id),
+            username TEXT NOT NULL,
+            score INTEGER NOT NULL,
+            old_rating INTEGER NOT NULL,
+            rating_change INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (match_id, username)
+        )
+        ''')
+        # 舊版 matches 表沒有 seed 欄位
+        _ensure_column(conn, 'matches', 'seed', 'INTEGER')
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_match_players_username ON match_players (username)"
+        )
+        # p / a / answer 在極限難度可達 64 位元，超過 SQLite INTEGER 的範圍，以十進位字串儲存
+        conn.execute(_ANSWERS_TABLE.format(name='answers'))
+        _migrate_answers_to_text(conn)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_answers_match ON answers (match_id, question_number)"
+        )
+
+        conn.commit()
     print("資料庫初始化完成")
 
 def find_account(username):
-    """查詢使用者帳號"""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row  # 讓查詢結果可以用列名訪問
-    cursor = conn.cursor()
+    """查詢使用者帳號（優先從快取讀取）"""
+    user = _account_cache.get(username)
+    if user is not None:
+        return user
     
-    cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-    user = cursor.fetchone()
-    
-    conn.close()
+    with get_db() as conn:
+        user = conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
     
     if user:
-        return dict(user)  # 轉換為字典，與原來的 JSON 格式相容
+        user = dict(user)  # 轉換為字典，與原來的 JSON 格式相容
+        _account_cache.put(user)
+        return dict(user)
     return None
 
+def find_accounts(usernames):
+    """
+    批次查詢多個使用者帳號
+    回傳 dict of username → 帳號資料；不存在的帳號不會出現在結果中
+    快取未命中的帳號以單一 WHERE username IN (...) 查詢取得
+    """
+    result = {}
+    missing = []
+    for username in dict.fromkeys(usernames):  # 去除重複但保留順序
+        user = _account_cache.get(username)
+        if user is not None:
+            result[username] = user
+        else:
+            missing.append(username)
+    
+    if missing:
+        placeholders = ','.join('?' * len(missing))
+        with get_db() as conn:
+            rows = conn.execute(
+                f"SELECT * FROM users WHERE username IN ({placeholders})",
+                missing
+            ).fetchall()
+        for row in rows:
+            user = dict(row)
+            _account_cache.put(user)
+            result[user['username']] = user
+    
+    return result
+
+def get_account_cache_stats():
+    """取得帳號快取的命中統計"""
+    return _account_cache.stats()
+
 def register_account(username, password):
     """註冊新帳號"""
     if find_account(username):
         return False
     
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    # 雜湊在工作池中計算，不佔用資料庫連線
+    pw_hash = hash_password(password)
     
     try:
-        cursor.execute(
-            "INSERT INTO users (username, pw_hash, rating) VALUES (?, ?, ?)",
-            (username, generate_password_hash(password), 1500)
-        )
-        conn.commit()
-        result = True
+        with transaction() as conn:
+            conn.execute(
+                "INSERT INTO users (username, pw_hash, rating) VALUES (?, ?, ?)",
+                (username, pw_hash, 1500)
+            )
+        rank_index.set(username, 1500)
+        return True
     except sqlite3.IntegrityError:
         # 可能是使用者名稱已存在的衝突
-        conn.rollback()
-        result = False
+        return False
     finally:
-        conn.close()
-    
-    return result
+        _account_cache.invalidate(username)
 
 def verify_account(username, password):
     """驗證帳號密碼"""
     user = find_account(username)
-    return user and check_password_hash(user['pw_hash'], password)
+    return user and check_password(user['pw_hash'], password)
 
 def update_user_rating(username, new_rating):
     """更新使用者 rating"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute(
-            "UPDATE users SET rating = ? WHERE username = ?",
-            (new_rating, username)
-        )
-        conn.commit()
-        result = True
-    except:
-        conn.rollback()
-        result = False
-    finally:
-        conn.close()
+        with transaction() as conn:
+            conn.execute(
+                "UPDATE users SET rating = ? WHERE username = ?",
+                (new_rating, username)
+            )
+        _account_cache.update_rating(username, new_rating)
+        if username in rank_index:
+            rank_index.set(username, new_rating)
+        return True
+    except sqlite3.Error:
+        return False
+
+def get_leaderboard(limit=LEADERBOARD_PAGE_SIZE, after_rating=None, after_id=None, prefix=None):
+    """
+    依 rating 由高到低（同分依 id）分頁取得玩家
+    after_rating / after_id: 上一頁最後一筆的 rating 與 id（keyset 分頁）
+    prefix: 只回傳名稱以此開頭的玩家（不分大小寫）
+
+    回傳 (players, next_cursor)；沒有下一頁時 next_cursor 為 None
+    """
+    limit = max(1, min(int(limit), LEADERBOARD_MAX_PAGE_SIZE))
+    conditions = []
+    params = []
     
-    return result
+    if after_rating is not None and after_id is not None:
+        conditions.append("(rating < ? OR (rating = ? AND id > ?))")
+        params += [after_rating, after_rating, after_id]
+    
+    if prefix:
+        # 前綴 LIKE 不分大小寫，可直接使用 username 的 NOCASE 索引做範圍查詢
+        escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        conditions.append("username LIKE ? ESCAPE '\\'")
+        params.append(escaped + '%')
+    
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    
+    with get_db() as conn:
+        rows = conn.execute(f"""
+            SELECT id, username, rating 
+            FROM users 
+            {where}
+            ORDER BY rating DESC, id 
+            LIMIT ?
+        """, params + [limit + 1]).fetchall()
+    
+    players = [dict(row) for row in rows[:limit]]
+    if prefix:
+        # 搜尋結果不是連續的，逐筆附上全域排名（排名索引，每筆 O(log R)）
+        for player in players:
+            player['rank'] = rank_index.rank(player['username'])
+    
+    next_cursor = None
+    if len(rows) > limit:
+        last = players[-1]
+        next_cursor = {'after_rating': last['rating'], 'after_id': last['id']}
+    return players, next_cursor
+
+_rank_feed = {'seq': 0, 'pruned_at': 0.0}   # 已套用到排名索引的 rating_feed 位置
+
+def _rating_feed_head(conn):
+    """rating_feed 目前分配到的最大 seq（含已清除的紀錄）"""
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'rating_feed'").fetchone()
+    return row[0] if row else 0
+
+def load_rank_index():
+    """從 users 表載入排名索引"""
+    with get_db() as conn:
+        # 先記下位置再讀取 users：之後的變更會由 sync_rank_index 依序重新套用
+        seq = _rating_feed_head(conn)
+        rows = conn.execute("SELECT username, rating FROM users")
+        rank_index.load((row['username'], row['rating']) for row in rows)
+    _rank_feed['seq'] = seq
+    print(f"排名索引載入完成，共 {len(rank_index)} 名玩家")
+
+def sync_rank_index():
+    """
+    套用 rating_feed 中尚未處理的變更到排名索引與帳號快取，回傳套用筆數
+    多 worker 時每個行程只會直接更新自己寫入的積分，其他 worker 的變更由這裡補上；
+    落後超過 RANK_FEED_RETENTION、紀錄已被清除時重新載入整個索引
+    """
+    seq = _rank_feed['seq']
+    with get_db() as conn:
+        rows = conn.execute(
+            "SELECT seq, username, rating FROM rating_feed WHERE seq > ? ORDER BY seq", (seq,)
+        ).fetchall()
+        missed = rows[0]['seq'] != seq + 1 if rows else _rating_feed_head(conn) > seq
+    if missed:
+        load_rank_index()
+        _account_cache.clear()
+        return len(rank_index)
+    
+    for row in rows:
+        username, rating = row['username'], row['rating']
+        if rating is None:
+            rank_index.remove(username)
+            _account_cache.invalidate(username)
+        else:
+            rank_index.set(username, rating)
+            _account_cache.update_rating(username, rating)
+    if rows:
+        _rank_feed['seq'] = rows[-1]['seq']
+    
+    now = time.time()
+    if now - _rank_feed['pruned_at'] >= RANK_FEED_PRUNE_INTERVAL:
+        _rank_feed['pruned_at'] = now
+        try:
+            with transaction() as conn:
+                conn.execute("DELETE FROM rating_feed WHERE created_at < ?",
+                             (int(now - RANK_FEED_RETENTION),))
+        except sqlite3.Error:
+            pass    # 其他 worker 正在寫入，下次再清
+    return len(rows)
+
+def get_leaderboard_stats():
+    """取得排行榜統計：總人數、平均 rating、最高 rating"""
+    with get_db() as conn:
+        row = conn.execute(
+            "SELECT user_count, rating_sum FROM user_stats WHERE id = 0"
+        ).fetchone()
+        # 有 rating 索引時 MAX 只需讀取索引的第一筆
+        max_rating = conn.execute("SELECT MAX(rating) FROM users").fetchone()[0]
+    
+    count = row['user_count'] if row else 0
+    return {
+        'count': count,
+        'average': round(row['rating_sum'] / count) if count else None,
+        'max': max_rating
+    }
 
 def update_ratings(score_dict):
     """
     更新多個使用者 rating
     score_dict: dict of username → 得分（比賽中的實際分數）
     
+    回傳 (賽前積分, 積分變化)，與寫入資料庫的結果一致；查無帳號者賽前積分視為預設值
+    賽前積分在寫入交易中從資料庫讀取：多 worker 時各行程的帳號快取可能已過期，
+    以快取計算再寫回絕對值，會蓋掉其他 worker 剛寫入的積分變化
     平手情況下不更新 rating
     """
-    players = list(score_dict.keys())
-    n = len(players)
-    if n < 2:
-        # 少於 2 人不更新
-        return
-    
-    # 檢查是否有平手情況
-    scores = list(score_dict.values())
-    max_score = max(scores)
-    winners = [p for p, s in score_dict.items() if s == max_score]
-    
-    # 如果有多個贏家（平手），則不更新 rating
-    if len(winners) > 1:
-        print(f"遊戲結果平手，玩家 {', '.join(winners)} 的 rating 不變")
-        return
+    usernames = list(score_dict)
+    placeholders = ', '.join('?' * len(usernames))
+    try:
+        with transaction() as conn:
+            # 讀取與寫入之間不讓其他行程修改積分
+            conn.execute("BEGIN IMMEDIATE")
+            old_ratings = dict.fromkeys(usernames, DEFAULT_RATING)
+            old_ratings.update(conn.execute(
+                f"SELECT username, rating FROM users WHERE username IN ({placeholders})", usernames))
+            changes = compute_rating_changes(score_dict, old_ratings)
+            new_ratings = {
+                username: old_ratings[username] + delta
+                for username, delta in changes.items() if delta
+            }
+            # 少於 2 人、平手或積分無變化時不需要寫入
+            if new_ratings:
+                conn.executemany(
+                    "UPDATE users SET rating = ? WHERE username = ?",
+                    [(rating, username) for username, rating in new_ratings.items()]
+                )
+    except sqlite3.Error:
+        accounts = find_accounts(usernames)
+        old_ratings = {u: accounts[u]['rating'] if u in accounts else DEFAULT_RATING for u in usernames}
+        return old_ratings, {username: 0 for username in usernames}
     
-    # 取出每個玩家的資料
-    users = {}
-    for username in players:
-        user = find_account(username)
-        if user:
-            users[username] = user
-    
-    # K 值 — 和雙人一樣
-    K = 32
-    
-    # 1) 準備每人的舊 R
-    R = {username: users[username]['rating'] for username in users}
-    
-    # 2) 計算每人「實際對戰得分總和」Σ s_ij
-    actual = {}
-    for i in players:
-        if i not in users:
-            continue
-        si = score_dict[i]
-        total = 0.0
-        for j in players:
-            if i == j or j not in users:
-                continue
-            sj = score_dict[j]
-            if si > sj:
-                total += 1
-            elif si == sj:
-                total += 0.5
-        actual[i] = total
-    
-    # 3) 計算每人「期望得分總和」Σ E_ij
-    expected = {}
-    for i in players:
-        if i not in users:
-            continue
-        Ri = R[i]
-        esum = 0.0
-        for j in players:
-            if i == j or j not in users:
-                continue
-            Rj = R[j]
-            esum += 1 / (1 + 10 ** ((Rj - Ri) / 400))
-        expected[i] = esum
-    
-    # 4) 更新：先正規化，再按 Elo 公式改變 rating
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    # 交易成功後才同步快取
+    for username, rating in new_ratings.items():
+        _account_cache.update_rating(username, rating)
+        if username in rank_index:
+            rank_index.set(username, rating)
     
-    try:
-        for username in users:
-            S_norm = actual[username] / (n - 1)
-            E_norm = expected[username] / (n - 1)
-            delta = K * (S_norm - E_norm)
-            new_R = round(R[username] + delta)
-            
-            cursor.execute(
-                "UPDATE users SET rating = ? WHERE username = ?",
-                (new_R, username)
-            )
-        
-        conn.commit()
-    except:
-        conn.rollback()
-    finally:
-        conn.close()
\ No newline at end of file
+    return old_ratings, changes
@@ -0,0 +1,140 @@
+"""
+遊戲計時排程器
+
+所有房間的倒數、答題逾時與換題都排進同一個以到期時間排序的 heap，
+由單一背景任務依序執行，不再為每一題各開一個 sleep 中的背景任務。
+取消的計時器不會被執行；被取消的項目過多時整理 heap，避免殘留項目堆積。
+執行時記錄實際執行時間與預定時間的落差（lag），供 /api/metrics 觀察。
+"""
+import collections
+import heapq
+import itertools
+import threading
+import time
+
+MAX_WAIT = 1.0               # 沒有計時器時，最多等待多久重新檢查
+
+
+class ScheduledCall:
+    __slots__ = ('deadline', 'fn', 'args', 'cancelled', 'done', '_queued')
+
+    def __init__(self, deadline, fn, args):
+        self.deadline = deadline
+        self.fn = fn
+        self.args = args
+        self.cancelled = False
+        self.done = False
+        self._queued = True     # 仍在 heap 中
+
+    @property
+    def active(self):
+        return not (self.cancelled or self.done)
+
+
+class GameScheduler:
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()   # 同一時間到期時依加入順序執行
+        self._lock = threading.Lock()
+        self._wakeup = None
+        self._started = False
+        self._cancelled_in_heap = 0
+        self.executed = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.max_lag = 0.0
+        self._total_lag = 0.0
+        self._recent_lags = collections.deque(maxlen=1000)
+
+    def call_later(self, delay, fn, *args):
+        """delay 秒後在排程任務中執行 fn(*args)，回傳可取消的 ScheduledCall"""
+        call = ScheduledCall(time.monotonic() + delay, fn, args)
+        with self._lock:
+            heapq.heappush(self._heap, (call.deadline, next(self._seq), call))
+            earliest = self._heap[0][2] is call
+        if earliest and self._wakeup is not None:
+            self._wakeup.set()
+        return call
+
+    def cancel(self, call):
+        """取消尚未執行的計時器；回傳是否真的取消"""
+        if call is None or not call.active:
+            return False
+        with self._lock:
+            call.cancelled = True
+            self.cancelled += 1
+            if not call._queued:
+                return True     # 已取出等待執行，執行前會再檢查 cancelled
+            self._cancelled_in_heap += 1
+            # 與 asyncio 相同：取消的項目超過一半時重建 heap
+            if self._cancelled_in_heap > 64 and self._cancelled_in_heap * 2 > len(self._heap):
+                self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+                heapq.heapify(self._heap)
+                self._cancelled_in_heap = 0
+        return True
+
+    def _pop_due(self, now):
+        """取出所有已到期且未取消的計時器，並回傳距離下一個到期的秒數"""
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                call = heapq.heappop(self._heap)[2]
+                call._queued = False
+                if call.cancelled:
+                    self._cancelled_in_heap -= 1
+                else:
+                    due.append(call)
+            wait = self._heap[0][0] - now if self._heap else MAX_WAIT
+        return due, min(max(wait, 0), MAX_WAIT)
+
+    def run_due(self, now=None):
+        """執行所有到期的計時器，回傳下一次應在幾秒後再檢查"""
+        due, wait = self._pop_due(time.monotonic() if now is None else now)
+        for call in due:
+            if call.cancelled:          # 同一批中較早的計時器可能取消了後面的
+                continue
+            lag = time.monotonic() - call.deadline
+            self._total_lag += lag
+            self._recent_lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            call.done = True
+            try:
+                call.fn(*call.args)
+            except Exception as e:
+                self.failed += 1
+                print(f"排程任務執行失敗: {e}")
+            self.executed += 1
+        return wait if not due else 0
+
+    def run(self, create_event):
+        """背景迴圈；create_event 由呼叫端提供（例如 socketio.server.eio.create_event）"""
+        self._wakeup = create_event()
+        while True:
+            wait = self.run_due()
+            if wait > 0:
+                self._wakeup.wait(wait)
+            self._wakeup.clear()
+
+    def start(self, start_background_task, create_event):
+        """啟動排程任務（重複呼叫無效）"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        start_background_task(self.run, create_event)
+
+    def stats(self):
+        lags = sorted(self._recent_lags)
+        return {
+            'pending': len(self._heap) - self._cancelled_in_heap,
+            'executed': self.executed,
+            'cancelled': self.cancelled,
+            'failed': self.failed,
+            'avg_lag_ms': self._total_lag / self.executed * 1000 if self.executed else 0,
+            'p99_lag_ms': lags[int(len(lags) * 0.99)] * 1000 if lags else 0,
+            'max_lag_ms': self.max_lag * 1000,
+        }
+
+
+# 全域排程器
+game_scheduler = GameScheduler()
@@ -0,0 +1,117 @@
+"""
+密碼雜湊工作池
+
+werkzeug 的 generate_password_hash / check_password_hash 刻意設計得很慢，
+直接在 eventlet hub 上執行會卡住所有 greenlet（包含遊戲計時器）。
+這裡把雜湊運算丟到真正的 OS 執行緒執行（hashlib 計算時會釋放 GIL），
+並限制排隊中的工作數量，同時記錄佇列深度與延遲。
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', 4))          # 執行雜湊的執行緒數
+HASH_MAX_PENDING = int(os.environ.get('HASH_MAX_PENDING', 64))  # 排隊 + 執行中的上限
+# 雜湊方法與成本，例如 'scrypt:32768:8:1' 或 'pbkdf2:sha256:600000'；未設定時使用 werkzeug 預設值
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or None
+
+
+class HashPoolBusy(Exception):
+    """排隊中的雜湊工作已達上限"""
+
+
+class HashPool:
+    """
+    有上限的雜湊執行緒池
+
+    在 eventlet 模式下使用 eventlet.tpool（OS 執行緒，等待時只讓出目前的 greenlet），
+    其他模式下使用 ThreadPoolExecutor。
+    """
+
+    def __init__(self, workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._use_eventlet = False
+        self._executor = None
+        self._lock = threading.Lock()
+        self.pending = 0       # 已提交尚未完成（排隊 + 執行中）
+        self.running = 0       # 執行中
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0     # 排隊時間總和（秒）
+        self.total_latency = 0.0  # 提交到完成的時間總和（秒）
+        self.max_latency = 0.0
+
+    def configure(self, use_eventlet):
+        """依 Socket.IO 的 async_mode 選擇執行方式，需在第一次使用前呼叫"""
+        self._use_eventlet = use_eventlet
+        if use_eventlet:
+            from eventlet import tpool
+            tpool.set_num_threads(self.workers)
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                thread_name_prefix='hash')
+        return self._executor
+
+    def run(self, fn, *args):
+        """在工作池中執行 fn(*args) 並等待結果"""
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HashPoolBusy()
+            self.pending += 1
+        submitted = time.perf_counter()
+
+        def task():
+            started = time.perf_counter()
+            with self._lock:
+                self.running += 1
+                self.total_wait += started - submitted
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+
+        try:
+            if self._use_eventlet:
+                from eventlet import tpool
+                return tpool.execute(task)
+            return self._get_executor().submit(task).result()
+        finally:
+            latency = time.perf_counter() - submitted
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_depth': self.pending - self.running,
+                'running': self.running,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'avg_wait_ms': self.total_wait / self.completed * 1000 if self.completed else 0.0,
+                'avg_latency_ms': self.total_latency / self.completed * 1000 if self.completed else 0.0,
+                'max_latency_ms': self.max_latency * 1000
+            }
+
+
+hash_pool = HashPool()
+
+def hash_password(password):
+    """在工作池中產生密碼雜湊"""
+    if PASSWORD_HASH_METHOD:
+        return hash_pool.run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+    return hash_pool.run(generate_password_hash, password)
+
+def check_password(pw_hash, password):
+    """在工作池中驗證密碼"""
+    return hash_pool.run(check_password_hash, pw_hash, password)
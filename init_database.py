@@ -15,6 +15,10 @@ if os.path.exists(DB_FILE):
         print("取消操作")
         exit()
     os.remove(DB_FILE)
+    # WAL 模式會額外產生 -wal / -shm 檔案，一併清除
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(DB_FILE + suffix):
+            os.remove(DB_FILE + suffix)
     print(f"已刪除舊資料庫檔案")
 
 # 初始化資料庫
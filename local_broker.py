@@ -0,0 +1,160 @@
+"""
+單機用的訊息佇列替身
+
+多 worker 模式下，socketio.emit(..., room=room_id) 需要經由訊息佇列轉給其他 worker，
+由持有該房間連線的 worker 送出。正式部署可以用 Redis（SOCKETIO_MESSAGE_QUEUE=redis://...）；
+這裡提供一個不需要額外服務的替身：broker 只把收到的每個訊框轉送給所有連線中的 worker。
+
+訊框格式：4 位元組大端序長度 + JSON 內容。
+連線後第一個訊框為 SUBSCRIBE 的是訂閱者，只接收；其餘連線送出的訊框轉給所有訂閱者。
+
+用法：
+    python local_broker.py --port 6399
+    SOCKETIO_MESSAGE_QUEUE=local://127.0.0.1:6399 python app.py
+"""
+import argparse
+import socket
+import socketserver
+import struct
+import threading
+
+from socketio import PubSubManager
+
+DEFAULT_PORT = 6399
+_LENGTH = struct.Struct('>I')
+SUBSCRIBE = b'\x00SUBSCRIBE'
+
+
+def parse_url(url):
+    """local://host:port → (host, port)"""
+    address = url[len('local://'):].rstrip('/')
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port or DEFAULT_PORT)
+
+
+def read_frame(sock):
+    """讀取一個訊框，連線關閉時回傳 None"""
+    header = _read_exact(sock, _LENGTH.size)
+    if header is None:
+        return None
+    return _read_exact(sock, _LENGTH.unpack(header)[0])
+
+
+def _read_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def write_frame(sock, payload):
+    sock.sendall(_LENGTH.pack(len(payload)) + payload)
+
+
+class _BrokerHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.lock = threading.Lock()
+
+    def handle(self):
+        payload = read_frame(self.request)
+        if payload == SUBSCRIBE:
+            with self.server.clients_lock:
+                self.server.clients.add(self)
+            # 訂閱者不會再送資料，等到對方斷線為止
+            while self.request.recv(4096):
+                pass
+            return
+        while payload is not None:
+            with self.server.clients_lock:
+                clients = list(self.server.clients)
+            for client in clients:
+                try:
+                    with client.lock:
+                        write_frame(client.request, payload)
+                except OSError:
+                    pass    # 對方已斷線，由其 finish() 移除
+            payload = read_frame(self.request)
+
+    def finish(self):
+        with self.server.clients_lock:
+            self.server.clients.discard(self)
+
+
+class Broker(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT):
+        super().__init__((host, port), _BrokerHandler)
+        self.clients = set()
+        self.clients_lock = threading.Lock()
+
+
+class LocalBrokerManager(PubSubManager):
+    """python-socketio 的 client manager，透過 Broker 在 worker 之間轉送訊息"""
+
+    name = 'localbroker'
+
+    def __init__(self, url='local://127.0.0.1:6399', channel='socketio', write_only=False,
+                 logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.address = parse_url(url)
+        self._socket_module = socket
+        self._publisher = None
+        self._publish_lock = threading.Lock()
+
+    def initialize(self):
+        # eventlet 模式下使用綠色 socket，避免等待訊息時卡住整個 hub
+        if getattr(self.server, 'async_mode', None) == 'eventlet':
+            from eventlet.green import socket as green_socket
+            from eventlet.semaphore import Semaphore
+            self._socket_module = green_socket
+            self._publish_lock = Semaphore()
+        super().initialize()
+
+    def _connect(self):
+        return self._socket_module.create_connection(self.address)
+
+    def _publish(self, data):
+        payload = self.json.dumps(data).encode()
+        with self._publish_lock:
+            for retries_left in (1, 0):
+                try:
+                    if self._publisher is None:
+                        self._publisher = self._connect()
+                    write_frame(self._publisher, payload)
+                    return
+                except OSError:
+                    self._publisher = None
+                    if not retries_left:
+                        self._get_logger().error('無法送出訊息到 local broker')
+
+    def _listen(self):
+        while True:
+            try:
+                sock = self._connect()
+            except OSError:
+                self._get_logger().error('無法連線到 local broker，稍後重試')
+                self.server.sleep(1)
+                continue
+            write_frame(sock, SUBSCRIBE)
+            while True:
+                payload = read_frame(sock)
+                if payload is None:
+                    break
+                yield payload.decode()
+            sock.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="單機用的 Socket.IO 訊息佇列替身")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+    with Broker(args.host, args.port) as broker:
+        print(f"local broker 監聽 {args.host}:{args.port}")
+        broker.serve_forever()
@@ -0,0 +1,168 @@
+"""
+對戰紀錄的非同步批次寫入
+
+handle_answer / end_game 只把紀錄放進有上限的佇列，
+背景執行緒每累積一批或每隔一段時間，以單一交易 executemany 寫入資料庫。
+程式結束時會先把佇列中剩下的紀錄全部寫完。
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+
+from db_utils import transaction
+
+MATCH_LOG_QUEUE_SIZE = int(os.environ.get('MATCH_LOG_QUEUE_SIZE', 10000))  # 佇列上限
+MATCH_LOG_BATCH_SIZE = 500       # 每次交易最多寫入的紀錄數
+MATCH_LOG_FLUSH_INTERVAL = 0.5   # 佇列未滿一批時，最多等待的秒數
+MATCH_LOG_PUT_TIMEOUT = 0.05     # 佇列已滿時最多等待的秒數，逾時則丟棄並計數
+
+_SQL = {
+    'match': """INSERT OR REPLACE INTO matches
+                (id, room_id, game_mode, difficulty, question_count, is_ranked, seed, started_at, ended_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+    'player': """INSERT OR REPLACE INTO match_players
+                 (match_id, username, score, old_rating, rating_change)
+                 VALUES (?, ?, ?, ?, ?)""",
+    'answer': """INSERT INTO answers
+                 (match_id, question_number, username, p, a, answer, correct, points, time_taken, answered_at)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+}
+# 同一批內依此順序寫入，確保 matches 先於 match_players
+_ORDER = ('match', 'player', 'answer')
+
+_STOP = object()
+
+
+class MatchLogWriter:
+    """有上限佇列 + 背景批次寫入"""
+
+    def __init__(self, maxsize=MATCH_LOG_QUEUE_SIZE, batch_size=MATCH_LOG_BATCH_SIZE,
+                 flush_interval=MATCH_LOG_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='match-log', daemon=True)
+                    self._thread.start()
+
+    def put(self, kind, row):
+        """放入一筆紀錄；佇列已滿時短暫等待，仍滿則丟棄"""
+        if self._closed:
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put((kind, row), timeout=MATCH_LOG_PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        while True:
+            batch = []
+            stop = False
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._flush(batch)
+            if stop:
+                # 把停止訊號之後仍在佇列中的紀錄寫完
+                rest = []
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        rest.append(item)
+                if rest:
+                    self._flush(rest)
+                return
+
+    def _flush(self, batch):
+        grouped = {kind: [] for kind in _ORDER}
+        for kind, row in batch:
+            grouped[kind].append(row)
+        try:
+            with transaction() as conn:
+                for kind in _ORDER:
+                    if grouped[kind]:
+                        conn.executemany(_SQL[kind], grouped[kind])
+            self.written += len(batch)
+            self.batches += 1
+        except Exception as e:
+            # 任何錯誤都只丟棄這一批，寫入執行緒必須繼續處理之後的紀錄
+            self.failed += len(batch)
+            print(f"對戰紀錄寫入失敗（{len(batch)} 筆）: {e!r}")
+
+    def close(self, timeout=10):
+        """停止接收新紀錄，並等待佇列中的紀錄寫入完成"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            started = time.monotonic()
+            try:
+                # 寫入執行緒已停止且佇列已滿時不能無限等待，否則程式結束時會卡住
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                print(f"對戰紀錄佇列已滿，放棄等待剩餘的 {self._queue.qsize()} 筆紀錄")
+                return
+            self._thread.join(max(timeout - (time.monotonic() - started), 0))
+
+    def stats(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'batches': self.batches
+        }
+
+
+match_log = MatchLogWriter()
+atexit.register(match_log.close)
+
+def log_answer(match_id, question_number, username, p, a, answer, correct, points, time_taken):
+    """記錄一次作答"""
+    # p / a / answer 可能超過 64 位元有號整數，answers 表以字串儲存
+    match_log.put('answer', (match_id, question_number, username, str(p), str(a), str(answer),
+                             int(correct), points, time_taken, time.time()))
+
+def log_match(match_id, room_id, room, started_at, scores, old_ratings, rating_changes):
+    """記錄一場結束的比賽及每位玩家的結果"""
+    match_log.put('match', (match_id, room_id, room.game_mode, room.difficulty,
+                            room.question_count, int(room.is_ranked),
+                            room.seed, started_at, time.time()))
+    for username, score in scores.items():
+        match_log.put('player', (match_id, username, score,
+                                 old_ratings.get(username, 1500),
+                                 rating_changes.get(username, 0)))
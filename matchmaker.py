@@ -0,0 +1,280 @@
+"""
+積分配對引擎
+
+等待中的玩家依 rating 分桶，以 Fenwick tree 統計每個桶子的人數（與 rank_index 相同），
+加入、取消與尋找積分最接近的對手都只需 O(log R)，R 為 rating 範圍大小。
+
+每次配對依等待時間由久到短處理：找積分最接近的對手，積分差不超過雙方中較寬的
+搜尋範圍就配對。搜尋範圍從 MATCH_BASE_WINDOW 開始，每等待一秒放寬
+MATCH_WINDOW_GROWTH，最多到 MATCH_MAX_WINDOW。
+
+RankedQueue 把儲存層中的隊列（多個 worker 共用）與本行程的配對引擎接在一起；
+共用儲存層時只有負責配對的 worker 執行配對，每次配對前先與儲存層同步。
+"""
+import os
+import threading
+import time
+
+from rank_index import MIN_RATING, MAX_RATING
+
+MATCH_BASE_WINDOW = float(os.environ.get('MATCH_BASE_WINDOW', 50))      # 剛加入時可接受的積分差
+MATCH_WINDOW_GROWTH = float(os.environ.get('MATCH_WINDOW_GROWTH', 10))  # 每等待一秒放寬的積分差
+MATCH_MAX_WINDOW = float(os.environ.get('MATCH_MAX_WINDOW', 400))       # 積分差上限
+MATCH_INTERVAL = 1.0         # 批次配對的間隔秒數
+QUEUE_STATUS_INTERVAL = 5    # 每隔幾次批次配對推送一次排隊狀態
+
+
+def search_window(waited):
+    """等待 waited 秒後可接受的積分差"""
+    return min(MATCH_MAX_WINDOW, MATCH_BASE_WINDOW + MATCH_WINDOW_GROWTH * max(waited, 0))
+
+
+class Matchmaker:
+    """
+    rating 桶子 → 等待人數 的 Fenwick tree，加上每個桶子內依加入順序排列的玩家
+    """
+
+    def __init__(self, min_rating=MIN_RATING, max_rating=MAX_RATING):
+        self.min_rating = min_rating
+        self.max_rating = max_rating
+        self._size = max_rating - min_rating + 1
+        self._tree = [0] * (self._size + 1)
+        self._top_step = 1 << (self._size.bit_length() - 1)
+        self._buckets = {}   # 桶子編號 → {username: None}，dict 保留加入順序
+        self._entries = {}   # username → (rating, joined_at)，依加入順序
+        self._lock = threading.Lock()
+        self.matched_pairs = 0
+        self.total_rating_diff = 0
+        self.total_wait = 0.0
+        self.last_pass_ms = 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, username):
+        return username in self._entries
+
+    def _bucket(self, rating):
+        """rating 轉成 1-based 的桶子編號"""
+        rating = min(max(int(rating), self.min_rating), self.max_rating)
+        return rating - self.min_rating + 1
+
+    def _add(self, i, delta):
+        while i <= self._size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, i):
+        """桶子 1..i 的總人數"""
+        total = 0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _find(self, k):
+        """第 k 位（1-based，依 rating 由低到高）玩家所在的桶子"""
+        pos = 0
+        step = self._top_step
+        while step:
+            if pos + step <= self._size and self._tree[pos + step] < k:
+                pos += step
+                k -= self._tree[pos]
+            step >>= 1
+        return pos + 1
+
+    def _link(self, username, rating, joined_at):
+        b = self._bucket(rating)
+        self._entries[username] = (rating, joined_at)
+        self._buckets.setdefault(b, {})[username] = None
+        self._add(b, 1)
+
+    def _unlink(self, username):
+        rating, _ = self._entries.pop(username)
+        b = self._bucket(rating)
+        members = self._buckets[b]
+        del members[username]
+        if not members:
+            del self._buckets[b]
+        self._add(b, -1)
+
+    def add(self, username, rating, joined_at=None):
+        """加入等待；已在等待中時回傳 False"""
+        with self._lock:
+            if username in self._entries:
+                return False
+            self._link(username, rating, time.time() if joined_at is None else joined_at)
+            return True
+
+    def remove(self, username):
+        with self._lock:
+            if username not in self._entries:
+                return False
+            self._unlink(username)
+            return True
+
+    def sync(self, entries):
+        """以儲存層的 (username, rating, joined_at) 清單為準，補上新加入的、移除已離開的"""
+        entries = {username: (rating, joined_at) for username, rating, joined_at in entries}
+        with self._lock:
+            for username in [u for u in self._entries if u not in entries]:
+                self._unlink(username)
+            for username, (rating, joined_at) in entries.items():
+                if username not in self._entries:
+                    self._link(username, rating, joined_at)
+
+    def _oldest_in(self, b, exclude):
+        for username in self._buckets[b]:
+            if username != exclude:
+                return username
+        return None
+
+    def _nearest(self, username):
+        """積分最接近的其他等待者；一樣接近時選等待較久的"""
+        rating, _ = self._entries[username]
+        b = self._bucket(rating)
+        opponent = self._oldest_in(b, username)
+        if opponent is not None:
+            return opponent
+        candidates = []
+        below = self._prefix(b - 1)
+        if below:
+            candidates.append(self._oldest_in(self._find(below), None))
+        if below + 1 < len(self._entries):
+            candidates.append(self._oldest_in(self._find(below + 2), None))
+        if not candidates:
+            return None
+        return min(candidates, key=lambda u: (abs(self._entries[u][0] - rating), self._entries[u][1]))
+
+    def _try_pair(self, username, now):
+        opponent = self._nearest(username)
+        if opponent is None:
+            return None
+        rating, joined_at = self._entries[username]
+        opponent_rating, opponent_joined_at = self._entries[opponent]
+        diff = abs(rating - opponent_rating)
+        if diff > max(search_window(now - joined_at), search_window(now - opponent_joined_at)):
+            return None
+        self._unlink(username)
+        self._unlink(opponent)
+        self.matched_pairs += 1
+        self.total_rating_diff += diff
+        self.total_wait += (now - joined_at) + (now - opponent_joined_at)
+        return username, opponent
+
+    def match_player(self, username, now=None):
+        """只為剛加入的玩家尋找對手，回傳配對或 None"""
+        now = time.time() if now is None else now
+        with self._lock:
+            if username not in self._entries:
+                return None
+            return self._try_pair(username, now)
+
+    def match(self, now=None):
+        """批次配對：依等待時間由久到短處理所有等待者，回傳配對清單"""
+        now = time.time() if now is None else now
+        started = time.perf_counter()
+        pairs = []
+        with self._lock:
+            for username in list(self._entries):
+                if username in self._entries:
+                    pair = self._try_pair(username, now)
+                    if pair:
+                        pairs.append(pair)
+        self.last_pass_ms = (time.perf_counter() - started) * 1000
+        return pairs
+
+    def waiting(self, now=None):
+        """所有等待者的 (username, 已等待秒數, 目前可接受的積分差)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            return [(username, now - joined_at, search_window(now - joined_at))
+                    for username, (_, joined_at) in self._entries.items()]
+
+    def stats(self):
+        return {
+            'waiting': len(self._entries),
+            'matched_pairs': self.matched_pairs,
+            'avg_rating_diff': self.total_rating_diff / self.matched_pairs if self.matched_pairs else 0,
+            'avg_wait_seconds': self.total_wait / (2 * self.matched_pairs) if self.matched_pairs else 0,
+            'last_pass_ms': self.last_pass_ms,
+        }
+
+
+class RankedQueue:
+    """儲存層中的積分配對隊列，加上本行程的配對引擎"""
+
+    def __init__(self, store, matchmaker=None, interval=MATCH_INTERVAL):
+        self.store = store
+        self.matchmaker = matchmaker if matchmaker is not None else Matchmaker()
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._started = False
+
+    def __contains__(self, username):
+        return self.store.queue_contains(username)
+
+    def __len__(self):
+        return self.store.queue_len()
+
+    def append(self, username, rating):
+        with self._lock:
+            joined_at = time.time()
+            if self.store.queue_push(username, rating, joined_at) and not self.store.shared:
+                self.matchmaker.add(username, rating, joined_at)
+
+    def remove(self, username):
+        with self._lock:
+            self.store.queue_remove(username)
+            self.matchmaker.remove(username)
+
+    def try_match(self, username):
+        """
+        立即為剛加入的玩家配對，回傳配對或 None
+        共用儲存層時本行程的引擎不是最新狀態，一律交給批次配對
+        """
+        if self.store.shared:
+            return None
+        with self._lock:
+            pair = self.matchmaker.match_player(username)
+            if pair and self.store.queue_take(pair):
+                return pair
+        return None
+
+    def match_pass(self):
+        """執行一次批次配對，回傳已從儲存層取出的配對"""
+        with self._lock:
+            if self.store.shared:
+                self.matchmaker.sync(self.store.queue_entries())
+            # 共用儲存層時玩家可能剛在其他 worker 取消；取出失敗的配對留待下次同步
+            return [pair for pair in self.matchmaker.match() if self.store.queue_take(pair)]
+
+    def run(self, on_match, sleep, on_waiting=None):
+        """
+        背景迴圈；on_match(player1, player2) 負責建立房間，
+        on_waiting(username, 已等待秒數, 積分差範圍, 等待人數) 定期通知仍在等待的玩家
+        """
+        passes = 0
+        while True:
+            sleep(self.interval)
+            try:
+                for player1, player2 in self.match_pass():
+                    on_match(player1, player2)
+                passes += 1
+                if on_waiting and passes % QUEUE_STATUS_INTERVAL == 0:
+                    waiting = self.matchmaker.waiting()
+                    for username, waited, window in waiting:
+                        on_waiting(username, waited, window, len(waiting))
+            except Exception as e:
+                print(f"積分配對失敗: {e}")
+
+    def start(self, on_match, start_background_task, sleep, on_waiting=None):
+        """啟動批次配對任務（重複呼叫無效）"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        start_background_task(self.run, on_match, sleep, on_waiting)
+
+    def stats(self):
+        return dict(self.matchmaker.stats(), queued=len(self))
@@ -1,90 +1,203 @@
 #!/usr/bin/env python3
 """
 將現有的 JSON 格式使用者資料遷移到 SQLite 資料庫
+
+以串流方式逐筆解析 accounts.json（頂層為帳號物件的陣列），
+每累積一批就以 INSERT ... ON CONFLICT DO UPDATE 批次寫入並提交，
+同時記錄檢查點，中斷後可以從上次完成的位置繼續。
+
+用法：
+    python migrate_json_to_sqlite.py                 # 互動確認後開始
+    python migrate_json_to_sqlite.py --yes           # 非互動模式
+    python migrate_json_to_sqlite.py --no-resume     # 忽略檢查點，從頭開始
 """
 
+import argparse
 import json
 import os
 import sqlite3
-from db_utils import init_db, register_account, find_account, update_user_rating
+import sys
+import time
+from db_utils import init_db, transaction, bulk_rating_writes
 
 # JSON 檔案路徑
 JSON_FILE = os.path.join(os.path.dirname(__file__), 'accounts.json')
 DB_FILE = os.path.join(os.path.dirname(__file__), 'modular_inverse_game.db')
 
-def load_json_accounts():
-    """從 JSON 檔案載入帳號資料"""
-    if not os.path.exists(JSON_FILE):
-        print(f"找不到 JSON 檔案 '{JSON_FILE}'")
-        return []
-    
-    try:
-        with open(JSON_FILE, 'r', encoding='utf-8') as f:
-            accounts = json.load(f)
-        return accounts
-    except json.JSONDecodeError:
-        print(f"JSON 檔案 '{JSON_FILE}' 格式錯誤")
-        return []
-
-def migrate_accounts():
+CHUNK_SIZE = 5000            # 每次交易寫入的帳號數
+READ_SIZE = 1 << 20          # 每次從檔案讀取的字元數
+PROGRESS_INTERVAL = 2.0      # 進度輸出間隔（秒）
+
+UPSERT_SQL = """
+    INSERT INTO users (username, pw_hash, rating) VALUES (?, ?, ?)
+    ON CONFLICT(username) DO UPDATE SET rating = excluded.rating
+"""
+
+def iter_json_accounts(path, read_size=READ_SIZE):
+    """
+    串流解析頂層為陣列的 JSON 檔案，逐一產生陣列中的元素
+    記憶體用量只與單筆資料及讀取區塊大小有關
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buf = ''
+        pos = 0
+        eof = False
+
+        def fill():
+            nonlocal buf, pos, eof
+            chunk = f.read(read_size)
+            if not chunk:
+                eof = True
+            buf = buf[pos:] + chunk
+            pos = 0
+
+        def skip(chars):
+            """跳過空白及指定字元，必要時讀入更多資料"""
+            nonlocal pos
+            while True:
+                while pos < len(buf) and (buf[pos].isspace() or buf[pos] in chars):
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                fill()
+
+        skip('')
+        if pos >= len(buf) or buf[pos] != '[':
+            raise ValueError("JSON 檔案的頂層必須是陣列")
+        pos += 1
+
+        while True:
+            skip(',')
+            if pos >= len(buf):
+                raise ValueError("JSON 陣列未正確結束")
+            if buf[pos] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            # 數字等純量在讀取邊界被截斷時仍能解析（1500 只讀到 15、-1.5 只讀到 -1.），
+            # 要看到後面的 , 或 ] 才能確定這個元素已經完整
+            follow = end
+            while follow < len(buf) and buf[follow].isspace():
+                follow += 1
+            if follow == len(buf) or buf[follow] not in ',]':
+                if eof:
+                    raise ValueError("JSON 陣列元素之後應為 , 或 ]")
+                fill()
+                continue
+            pos = end
+            yield item
+
+def checkpoint_path(json_file):
+    return json_file + '.checkpoint'
+
+def load_checkpoint(json_file):
+    """讀取檢查點，回傳已完成的帳號筆數"""
+    path = checkpoint_path(json_file)
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f).get('processed', 0)
+
+def save_checkpoint(json_file, processed):
+    """原子地寫入檢查點"""
+    path = checkpoint_path(json_file)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'processed': processed}, f)
+    os.replace(tmp, path)
+
+def migrate_accounts(json_file=JSON_FILE, chunk_size=CHUNK_SIZE, resume=True, verbose=False):
     """將帳號資料從 JSON 遷移到 SQLite"""
     # 確保資料庫已初始化
     init_db()
-    
-    # 載入 JSON 帳號資料
-    accounts = load_json_accounts()
-    if not accounts:
-        print("沒有找到有效的 JSON 帳號資料")
-        return
-    
-    print(f"找到 {len(accounts)} 個帳號資料")
-    
-    # 連接資料庫
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
+
+    start_at = load_checkpoint(json_file) if resume else 0
+    if start_at:
+        print(f"從檢查點繼續，略過前 {start_at} 筆帳號")
+
+    processed = 0      # 已讀取的帳號筆數（含略過與無效）
     migrated = 0
     skipped = 0
-    
-    # 開始遷移
-    for account in accounts:
-        username = account.get('username')
-        pw_hash = account.get('pw_hash')
-        rating = account.get('rating', 1500)
-        
-        if not username or not pw_hash:
-            print(f"跳過無效帳號: {account}")
-            skipped += 1
-            continue
-        
-        # 檢查帳號是否已存在
-        cursor.execute("SELECT username FROM users WHERE username = ?", (username,))
-        if cursor.fetchone():
-            print(f"帳號 '{username}' 已存在，更新其 rating")
-            cursor.execute("UPDATE users SET rating = ? WHERE username = ?", (rating, username))
-            migrated += 1
-        else:
-            print(f"新增帳號 '{username}'")
-            cursor.execute(
-                "INSERT INTO users (username, pw_hash, rating) VALUES (?, ?, ?)",
-                (username, pw_hash, rating)
-            )
-            migrated += 1
-    
-    conn.commit()
-    conn.close()
-    
-    print(f"遷移完成: {migrated} 個帳號已遷移，{skipped} 個帳號已跳過")
-    print(f"建議備份原始 JSON 檔案，然後可以刪除 '{JSON_FILE}'")
+    batch = []
+    started = time.monotonic()
+    last_report = started
+
+    def flush():
+        nonlocal batch, migrated, last_report
+        if batch:
+            with transaction() as conn:
+                conn.executemany(UPSERT_SQL, batch)
+            migrated += len(batch)
+            batch = []
+        save_checkpoint(json_file, processed)
+        now = time.monotonic()
+        if now - last_report >= PROGRESS_INTERVAL:
+            rate = (processed - start_at) / (now - started) if now > started else 0
+            print(f"已處理 {processed} 筆，已遷移 {migrated} 筆，速度 {rate:,.0f} 筆/秒")
+            last_report = now
+
+    try:
+        # 批次寫入期間不逐筆記錄 rating_feed，結束後各 worker 重新載入排名索引
+        with bulk_rating_writes():
+            for account in iter_json_accounts(json_file):
+                processed += 1
+                if processed <= start_at:
+                    continue
+
+                username = account.get('username') if isinstance(account, dict) else None
+                pw_hash = account.get('pw_hash') if isinstance(account, dict) else None
+                rating = account.get('rating', 1500) if isinstance(account, dict) else None
+
+                if not username or not pw_hash:
+                    if verbose:
+                        print(f"跳過無效帳號: {account}")
+                    skipped += 1
+                    continue
+
+                batch.append((username, pw_hash, rating))
+                if len(batch) >= chunk_size:
+                    flush()
+            flush()
+    except (ValueError, sqlite3.Error) as e:
+        # 檢查點只記錄已提交的批次，修正問題後可直接重新執行
+        print(f"遷移中斷: {e}")
+        print(f"已提交的進度已記錄於 '{checkpoint_path(json_file)}'")
+        return False
+
+    elapsed = time.monotonic() - started
+    os.remove(checkpoint_path(json_file))
+    print(f"遷移完成: {migrated} 個帳號已遷移，{skipped} 個帳號已跳過，耗時 {elapsed:.1f} 秒")
+    print(f"建議備份原始 JSON 檔案，然後可以刪除 '{json_file}'")
+    return True
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="將 JSON 帳號資料遷移到 SQLite")
+    parser.add_argument('--json-file', default=JSON_FILE, help="來源 JSON 檔案")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="每次交易寫入的帳號數")
+    parser.add_argument('-y', '--yes', action='store_true', help="不詢問，直接開始遷移")
+    parser.add_argument('--no-resume', action='store_true', help="忽略檢查點，從頭開始")
+    parser.add_argument('-v', '--verbose', action='store_true', help="列出被跳過的無效帳號")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    if not os.path.exists(JSON_FILE):
-        print(f"找不到 JSON 檔案 '{JSON_FILE}'")
-        exit(1)
-    
-    proceed = input(f"確認將帳號資料從 '{JSON_FILE}' 遷移到 '{DB_FILE}'? (y/n): ")
-    if proceed.lower() != 'y':
-        print("取消操作")
-        exit()
-    
-    migrate_accounts()
\ No newline at end of file
+    args = parse_args()
+
+    if not os.path.exists(args.json_file):
+        print(f"找不到 JSON 檔案 '{args.json_file}'")
+        sys.exit(1)
+
+    if not args.yes:
+        proceed = input(f"確認將帳號資料從 '{args.json_file}' 遷移到 '{DB_FILE}'? (y/n): ")
+        if proceed.lower() != 'y':
+            print("取消操作")
+            sys.exit()
+
+    ok = migrate_accounts(args.json_file, args.chunk_size,
+                          resume=not args.no_resume, verbose=args.verbose)
+    sys.exit(0 if ok else 1)
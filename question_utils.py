@@ -0,0 +1,187 @@
+"""
+模反元素題目產生
+
+每種難度的 (p, a, a⁻¹) 組合是固定且數量不多的，
+因此在 import 時一次建好題庫，出題時只需 O(1) 抽樣。
+
+大模數難度（32 / 64 位元）無法列舉範圍內的質數，改由背景執行緒
+以 Miller–Rabin 預先產生一批固定的質數池，出題時從池中抽出 p。
+質數池由固定種子產生，因此以種子重播比賽時會得到相同的題目。
+"""
+import random
+import threading
+import time
+from array import array
+
+DIFFICULTY_BOUNDS = {
+    'easy':    50,  # a,b < 50
+    'medium':  100, # a,b < 100
+    'hard':    200  # a,b < 200
+}
+# 大模數難度：難度 → 質數的位元數
+LARGE_DIFFICULTY_BITS = {
+    'expert':  32,
+    'extreme': 64
+}
+DIFFICULTIES = list(DIFFICULTY_BOUNDS) + list(LARGE_DIFFICULTY_BITS)
+MIN_PRIME = 11
+PRIME_POOL_SIZE = 512   # 每個大模數難度預先產生的質數數量
+
+# 試除用的小質數，先過濾掉大部分合數再做 Miller–Rabin
+_SMALL_PRIMES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47,
+                 53, 59, 61, 67, 71, 73, 79, 83, 89, 97)
+# 以前 13 個質數（2 ~ 41）為底的 Miller–Rabin 對 n < 3.3 × 10^24 是確定性的
+# （只用到 37 的 12 個底時界限是 3.2 × 10^23，318665857834031151167461 即是反例）
+_MR_BASES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+_MR_DETERMINISTIC_LIMIT = 3317044064679887385961981
+
+def is_prime(n):
+    """檢查一個數是否為質數"""
+    if n <= 1:
+        return False
+    if n <= 3:
+        return True
+    if n % 2 == 0 or n % 3 == 0:
+        return False
+    i = 5
+    while i * i <= n:
+        if n % i == 0 or n % (i + 2) == 0:
+            return False
+        i += 6
+    return True
+
+def is_probable_prime(n, rounds=40, rng=random):
+    """
+    Miller–Rabin 質數測試
+    n < 3.3 × 10^24（涵蓋 64 位元）時為確定性結果；更大的數使用 rounds 個隨機底
+    """
+    if n < 2:
+        return False
+    for q in _SMALL_PRIMES:
+        if n % q == 0:
+            return n == q
+    
+    d = n - 1
+    r = 0
+    while d % 2 == 0:
+        d //= 2
+        r += 1
+    
+    if n < _MR_DETERMINISTIC_LIMIT:
+        bases = _MR_BASES
+    else:
+        bases = [rng.randrange(2, n - 1) for _ in range(rounds)]
+    
+    for b in bases:
+        x = pow(b, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(r - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+def random_prime(bits, rng=random):
+    """隨機產生一個恰好 bits 位元的質數"""
+    while True:
+        # 最高位設為 1 確保位元數，最低位設為 1 確保是奇數
+        n = rng.getrandbits(bits) | (1 << (bits - 1)) | 1
+        if is_probable_prime(n, rng=rng):
+            return n
+
+def get_primes(start, end):
+    """獲取指定範圍內的所有質數"""
+    return [num for num in range(start, end + 1) if is_prime(num)]
+
+def mod_inverse(a, m):
+    return pow(a, -1, m)
+
+
+class QuestionBank:
+    """
+    單一難度的題庫
+
+    所有 (p, a, a⁻¹) 依 p 分段存放在連續的 array 中。
+    抽樣時先等機率選 p，再在該段中等機率選 a，與逐題計算的機率分布相同。
+    """
+
+    __slots__ = ('primes', 'offsets', 'a_values', 'inverses')
+
+    def __init__(self, bound):
+        self.primes = array('I', get_primes(MIN_PRIME, bound - 1))
+        self.offsets = array('I')
+        self.a_values = array('I')
+        self.inverses = array('I')
+        for p in self.primes:
+            self.offsets.append(len(self.a_values))
+            for a in range(2, p):
+                self.a_values.append(a)
+                self.inverses.append(mod_inverse(a, p))
+
+    def __len__(self):
+        return len(self.a_values)
+
+    def sample(self, rng=random):
+        """隨機取出一題，回傳 (p, a, answer)"""
+        i = rng.randrange(len(self.primes))
+        p = self.primes[i]
+        j = self.offsets[i] + rng.randrange(p - 2)  # a ∈ [2, p-1]
+        return p, self.a_values[j], self.inverses[j]
+
+
+class PrimePool:
+    """
+    單一大模數難度的質數池
+
+    由背景執行緒以固定種子產生 PRIME_POOL_SIZE 個質數；
+    抽樣時先等機率選 p，再隨機選 a，反元素當場以 pow 計算（64 位元只需數微秒）。
+    """
+
+    def __init__(self, bits, size=PRIME_POOL_SIZE):
+        self.bits = bits
+        self.size = size
+        self.primes = []
+        self._ready = threading.Event()
+        threading.Thread(target=self._fill, name=f'prime-pool-{bits}', daemon=True).start()
+
+    def _fill(self):
+        rng = random.Random(f'prime-pool-{self.bits}')
+        primes = [random_prime(self.bits, rng) for _ in range(self.size)]
+        self.primes = primes
+        self._ready.set()
+
+    def __len__(self):
+        return len(self.primes)
+
+    def sample(self, rng=random):
+        """隨機取出一題，回傳 (p, a, answer)；質數池尚未完成時等待"""
+        self._ready.wait()
+        p = self.primes[rng.randrange(self.size)]
+        a = rng.randrange(2, p)
+        return p, a, mod_inverse(a, p)
+
+
+QUESTION_BANKS = {difficulty: QuestionBank(bound) for difficulty, bound in DIFFICULTY_BOUNDS.items()}
+QUESTION_BANKS.update({difficulty: PrimePool(bits) for difficulty, bits in LARGE_DIFFICULTY_BITS.items()})
+
+def generate_question(difficulty: str, rng=random):
+    """生成一個有關模反元素的問題，rng 可傳入自訂的 random.Random"""
+    p, a, answer = QUESTION_BANKS[difficulty].sample(rng)
+    return {
+        'p': p,
+        'a': a,
+        'answer': answer,
+        'time_started': time.time()  # 記錄問題開始時間
+    }
+
+def generate_schedule(seed, difficulty, question_count):
+    """
+    由種子一次產生整場比賽的題目，回傳 [(p, a, answer), ...]
+    相同的 (seed, difficulty, question_count) 一定得到相同的題目，可用於重播與稽核
+    """
+    rng = random.Random(seed)
+    bank = QUESTION_BANKS[difficulty]
+    return [bank.sample(rng) for _ in range(question_count)]
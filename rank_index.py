@@ -0,0 +1,154 @@
+"""
+記憶體內的排名索引
+
+以 Fenwick tree（樹狀陣列）統計每個 rating 的人數，
+查詢排名、百分位數都只需 O(log R)，R 為 rating 範圍大小；
+top-K 由最高分往下逐桶以樹上二分找出下一個非空桶子，O(K log R)。
+"""
+import heapq
+import threading
+
+MIN_RATING = 0
+MAX_RATING = 5000  # 超出範圍的 rating 會被歸到邊界的桶子
+
+
+class RankIndex:
+    """
+    rating → 人數 的 Fenwick tree，加上 username → rating 的對照表
+
+    排名採用競賽排名：rank = 積分比自己高的人數 + 1
+    """
+
+    def __init__(self, min_rating=MIN_RATING, max_rating=MAX_RATING):
+        self.min_rating = min_rating
+        self.max_rating = max_rating
+        self._size = max_rating - min_rating + 1
+        self._tree = [0] * (self._size + 1)
+        self._ratings = {}   # username → rating
+        self._members = {}   # 桶子編號 → set of username，用於 top-K
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ratings)
+
+    def __contains__(self, username):
+        return username in self._ratings
+
+    def _bucket(self, rating):
+        """rating 轉成 1-based 的桶子編號"""
+        rating = min(max(int(rating), self.min_rating), self.max_rating)
+        return rating - self.min_rating + 1
+
+    def _add(self, i, delta):
+        while i <= self._size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, i):
+        """桶子 1..i 的總人數"""
+        total = 0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _find(self, count):
+        """前綴人數達到 count 的最小桶子編號：由樹根往下二分，O(log R)"""
+        pos = 0
+        step = 1 << (self._size.bit_length() - 1)
+        while step:
+            nxt = pos + step
+            if nxt <= self._size and self._tree[nxt] < count:
+                pos = nxt
+                count -= self._tree[nxt]
+            step >>= 1
+        return pos + 1
+
+    def load(self, rows):
+        """從 (username, rating) 序列一次建立索引，O(n + R)"""
+        with self._lock:
+            self._tree = [0] * (self._size + 1)
+            self._ratings = {}
+            self._members = {}
+            for username, rating in rows:
+                b = self._bucket(rating)
+                self._ratings[username] = rating
+                self._members.setdefault(b, set()).add(username)
+                self._tree[b] += 1
+            # 線性時間建樹：把每個節點的值往父節點累加
+            for i in range(1, self._size + 1):
+                parent = i + (i & -i)
+                if parent <= self._size:
+                    self._tree[parent] += self._tree[i]
+
+    def set(self, username, rating):
+        """新增玩家或更新其 rating"""
+        with self._lock:
+            old = self._ratings.get(username)
+            if old is not None:
+                old_b = self._bucket(old)
+                self._add(old_b, -1)
+                members = self._members[old_b]
+                members.discard(username)
+                if not members:
+                    del self._members[old_b]
+            b = self._bucket(rating)
+            self._ratings[username] = rating
+            self._members.setdefault(b, set()).add(username)
+            self._add(b, 1)
+
+    def remove(self, username):
+        with self._lock:
+            rating = self._ratings.pop(username, None)
+            if rating is None:
+                return
+            b = self._bucket(rating)
+            self._add(b, -1)
+            members = self._members[b]
+            members.discard(username)
+            if not members:
+                del self._members[b]
+
+    def rank(self, username):
+        """玩家的名次，不存在時回傳 None"""
+        with self._lock:
+            rating = self._ratings.get(username)
+            if rating is None:
+                return None
+            return len(self._ratings) - self._prefix(self._bucket(rating)) + 1
+
+    def percentile(self, username):
+        """積分嚴格低於該玩家的人數百分比（0~100），不存在時回傳 None"""
+        with self._lock:
+            rating = self._ratings.get(username)
+            if rating is None:
+                return None
+            total = len(self._ratings)
+            below = self._prefix(self._bucket(rating) - 1)
+            return round(below * 100 / total, 2)
+
+    def top(self, k):
+        """積分最高的 k 位玩家，回傳 [(username, rating, rank), ...]"""
+        result = []
+        with self._lock:
+            rank = 1
+            remaining = len(self._ratings)   # 目前桶子（含）以下的人數
+            while remaining and len(result) < k:
+                # 前綴人數恰好達到 remaining 的桶子，就是尚未走訪的最高非空桶子
+                b = self._find(remaining)
+                members = self._members[b]
+                remaining -= len(members)
+                # 邊界桶子可能混有不同 rating；人數多於還需要的數量時只取出前幾名
+                need = k - len(result)
+                key = lambda u: (-self._ratings[u], u)
+                ordered = sorted(members, key=key) if len(members) <= need else heapq.nsmallest(need, members, key=key)
+                for username in ordered:
+                    rating = self._ratings[username]
+                    # 同分同名次
+                    if result and result[-1][1] != rating:
+                        rank = len(result) + 1
+                    result.append((username, rating, rank))
+        return result
+
+
+rank_index = RankIndex()
@@ -0,0 +1,52 @@
+"""
+Elo 積分計算
+
+end_game 與 update_ratings 共用的多人 Elo 公式：
+每位玩家與其他每位玩家各視為一場對局，實際得分與期望得分總和正規化後乘上 K。
+"""
+from collections import Counter
+
+K_FACTOR = 32
+DEFAULT_RATING = 1500
+
+def compute_rating_changes(scores, ratings, k=K_FACTOR):
+    """
+    根據比賽分數與賽前積分快照計算每位玩家的積分變化
+    scores:  dict of username → 得分
+    ratings: dict of username → 賽前積分（缺少者視為 DEFAULT_RATING）
+
+    回傳 dict of username → 積分變化（整數）
+    少於 2 人時回傳空 dict；最高分平手時所有人變化為 0
+    """
+    players = list(scores)
+    n = len(players)
+    if n < 2:
+        return {}
+    
+    # 檢查是否有平手情況
+    max_score = max(scores.values())
+    if sum(1 for s in scores.values() if s == max_score) > 1:
+        return {player: 0 for player in players}
+    
+    # 實際得分 Σ s_ij：贏過的人數 + 0.5 × 同分的人數（不含自己）
+    # 先依分數排序並統計同分人數，避免逐對比較
+    count = Counter(scores.values())
+    below = {}
+    seen = 0
+    for score in sorted(count):
+        below[score] = seen
+        seen += count[score]
+    
+    # 期望得分 Σ E_ij：E_ij = q_i / (q_i + q_j)，其中 q = 10^(R/400)
+    # 10 的次方對每位玩家只算一次
+    q = [10 ** (ratings.get(p, DEFAULT_RATING) / 400) for p in players]
+    
+    changes = {}
+    for i, player in enumerate(players):
+        si = scores[player]
+        actual = below[si] + 0.5 * (count[si] - 1)
+        qi = q[i]
+        expected = sum(qi / (qi + qj) for qj in q) - 0.5  # 扣掉與自己比較的 0.5
+        changes[player] = round(k * (actual - expected) / (n - 1))
+    
+    return changes
@@ -0,0 +1,517 @@
+"""
+遊戲房間資料結構
+
+Room 使用 __slots__ 固定屬性，比原本約 16 個字串鍵的 dict 更省記憶體，
+屬性存取也不需要再對鍵做雜湊。
+players 以 dict（username → 座位編號）保存，兼具插入順序與 O(1) 的成員檢查與移除。
+
+RoomRegistry 保存 room_id → Room，並同時維護 username → room_id 的反向索引，
+查詢某位玩家所在的房間不必再逐一掃描所有房間。
+系統分配的房間ID由 RoomIdAllocator 產生，不需要重試，也不會重複。
+"""
+import collections
+import enum
+import secrets
+import sys
+import threading
+import time
+
+
+class RoomState(enum.Enum):
+    """房間狀態"""
+    WAITING = 'waiting'      # 等待玩家加入 / 準備
+    STARTING = 'starting'    # 全員準備完成，開始前倒數
+    PLAYING = 'playing'      # 比賽進行中
+
+
+class Room:
+    __slots__ = (
+        'players', 'ready', 'scores', 'answers', 'correct_order',
+        'state', 'current_question', 'question_number', 'question_timer',
+        'first_correct_done',
+        'difficulty', 'game_mode', 'game_time', 'question_count',
+        'is_practice', 'is_ranked', 'auto_start', 'match_time',
+        'match_id', 'match_started_at', 'seed', 'schedule',
+        'last_active', 'games_played', '_next_seat', 'version', 'status_version',
+    )
+
+    # 寫入儲存層的欄位；question_timer 與 last_active 只在本行程有意義，不保存
+    STORED_FIELDS = (
+        'players', 'ready', 'scores', 'answers', 'correct_order',
+        'current_question', 'question_number', 'first_correct_done',
+        'difficulty', 'game_mode', 'game_time', 'question_count',
+        'is_practice', 'is_ranked', 'auto_start', 'match_time',
+        'match_id', 'match_started_at', 'seed', 'schedule',
+        'games_played', '_next_seat', 'status_version',
+    )
+
+    def __init__(self, difficulty, game_mode, game_time, question_count,
+                 is_practice=False, is_ranked=False, auto_start=False, match_time=None):
+        self.players = {}            # username → 座位編號（依加入順序遞增）
+        self.ready = {}              # username → 是否已準備
+        self.scores = {}             # username → 分數
+        self.answers = {}            # 本題 username → 答案
+        self.correct_order = []      # 比速度用
+        self.state = RoomState.WAITING
+        self.current_question = None
+        self.question_number = 0
+        self.question_timer = None
+        self.first_correct_done = False  # 搶快用
+        self.difficulty = difficulty
+        self.game_mode = game_mode
+        self.game_time = game_time   # 每題秒數（整數）
+        self.question_count = question_count
+        self.is_practice = is_practice   # 練習模式只允許一人
+        self.is_ranked = is_ranked       # 積分模式
+        self.auto_start = auto_start     # 積分模式自動開始
+        self.match_time = match_time     # 積分模式配對時間
+        self.match_id = None             # 對戰紀錄編號
+        self.match_started_at = None
+        self.seed = None                 # 題目種子
+        self.schedule = None             # 整場比賽的題目 [(p, a, answer), ...]
+        self.last_active = time.monotonic()  # 最後一次有玩家活動的時間，閒置回收用
+        self.games_played = 0
+        self._next_seat = 0
+        self.version = 0                 # 儲存層中的版本，0 代表尚未寫入
+        self.status_version = 0          # 廣播給前端的房間狀態版本，每次 room_delta 加一
+
+    @property
+    def game_started(self):
+        return self.state is not RoomState.WAITING
+
+    def __len__(self):
+        return len(self.players)
+
+    def __contains__(self, username):
+        return username in self.players
+
+    def player_list(self):
+        """依加入順序列出玩家"""
+        return list(self.players)
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def add_player(self, username):
+        if username in self.players:
+            return
+        self.players[username] = self._next_seat
+        self._next_seat += 1
+        self.scores[username] = 0
+        self.touch()
+
+    def remove_player(self, username):
+        """移除玩家及其分數、準備狀態；玩家不在房間時回傳 False"""
+        if self.players.pop(username, None) is None:
+            return False
+        self.scores.pop(username, None)
+        self.ready.pop(username, None)
+        return True
+
+    def all_answered(self):
+        return len(self.answers) == len(self.players)
+
+    def all_ready(self):
+        return len(self.ready) == len(self.players)
+
+    def reset_after_game(self):
+        """比賽結束後回到等待狀態"""
+        self.state = RoomState.WAITING
+        self.ready = {}
+        self.current_question = None
+        self.question_number = 0
+        self.match_id = None
+        self.schedule = None
+        self.games_played += 1
+        self.touch()
+
+    def to_dict(self):
+        data = {name: getattr(self, name) for name in self.STORED_FIELDS}
+        data['state'] = self.state.value
+        return data
+
+    def load_state(self, data, version):
+        """以儲存層的內容覆寫目前狀態，保留物件本身（其他地方持有的參考仍然有效）"""
+        for name in self.STORED_FIELDS:
+            setattr(self, name, data[name])
+        self.state = RoomState(data['state'])
+        if self.schedule is not None:
+            self.schedule = [tuple(question) for question in self.schedule]
+        self.version = version
+        self.touch()
+
+    @classmethod
+    def from_dict(cls, data, version):
+        room = cls(data['difficulty'], data['game_mode'], data['game_time'], data['question_count'])
+        room.load_state(data, version)
+        return room
+
+    def approx_size(self):
+        """估計房間佔用的記憶體位元組數（物件本身與其容器，不含共用的字串與整數）"""
+        size = sys.getsizeof(self)
+        for value in (self.players, self.ready, self.scores, self.answers,
+                      self.correct_order, self.current_question, self.schedule):
+            if value is not None:
+                size += sys.getsizeof(value)
+        if self.schedule:
+            size += sum(sys.getsizeof(question) for question in self.schedule)
+        return size
+
+
+class RoomIdAllocator:
+    """
+    系統房間ID分配器
+
+    6 位數字（000000–999999）保留給系統分配，自訂房間ID不可使用這個命名空間。
+    以遞增計數器經過 Feistel 置換得到看似隨機但不重複的ID，計數器用完後
+    再依釋放先後順序（FIFO）重複使用已刪除房間的ID，分配與釋放都是 O(1)。
+    先用計數器是為了讓剛刪除的房間ID盡量晚一點才被重用，避免舊連結誤入新房間。
+    """
+
+    DIGITS = 6
+    HALF = 1000             # 兩半各 3 位數，10^3 × 10^3 = 10^6
+    ROUNDS = 4
+
+    def __init__(self, key=None):
+        self.size = self.HALF * self.HALF
+        key = secrets.randbits(64) if key is None else key
+        self._keys = [(key >> (16 * i)) & 0xFFFF for i in range(self.ROUNDS)]
+        self._counter = 0
+        self._free = collections.deque()
+        self._in_use = set()
+
+    def _permute(self, n):
+        """平衡 Feistel 網路：[0, 10^6) 上的一對一置換"""
+        left, right = divmod(n, self.HALF)
+        for k in self._keys:
+            left, right = right, (left + (right * 7919 + k) * 2654435761 % 1000003) % self.HALF
+        return left * self.HALF + right
+
+    def is_reserved(self, room_id):
+        """判斷是否屬於系統分配的命名空間"""
+        return len(room_id) == self.DIGITS and room_id.isascii() and room_id.isdigit()
+
+    def allocate(self):
+        """分配一個未使用的房間ID，ID 全部用完時丟出 RuntimeError"""
+        if self._counter < self.size:
+            room_id = f'{self._permute(self._counter):0{self.DIGITS}d}'
+            self._counter += 1
+        elif self._free:
+            room_id = self._free.popleft()
+        else:
+            raise RuntimeError('房間ID已全部分配')
+        self._in_use.add(room_id)
+        return room_id
+
+    def release(self, room_id):
+        """歸還房間ID；非系統分配的ID直接忽略"""
+        if room_id in self._in_use:
+            self._in_use.remove(room_id)
+            self._free.append(room_id)
+
+    def discard(self, room_id):
+        """放棄分配到、但已被其他 worker 使用的ID；不放回可用佇列，避免一再分配到同一個ID"""
+        self._in_use.discard(room_id)
+
+    def stats(self):
+        return {
+            'in_use': len(self._in_use),
+            'free': len(self._free) + self.size - self._counter,
+        }
+
+
+class RoomConflict(Exception):
+    """compare-and-set 重試多次仍被其他 worker 搶先寫入"""
+
+
+class RoomExists(Exception):
+    """自訂的房間ID已被其他房間使用"""
+
+
+class RoomInconsistent(Exception):
+    """房間、反向索引與儲存層的內容互相矛盾"""
+
+
+class RoomRegistry:
+    """
+    所有房間的登錄表
+
+    玩家進出房間一律透過 add_player / remove_player，
+    房間與反向索引 user_room 在同一把鎖內一起更新，兩者不會不一致。
+    每位玩家同時只屬於一個房間。
+
+    房間狀態寫入 store（見 room_store），本地保留 Room 物件作為快取。
+    所有修改都以 update() 讀取、修改、compare-and-set，版本衝突時重新讀取再套用，
+    不會蓋掉其他 worker 的修改，也不會遺失自己的修改。
+    """
+
+    CAS_RETRIES = 8
+
+    def __init__(self, id_allocator=None, store=None):
+        if store is None:
+            from room_store import MemoryRoomStore
+            store = MemoryRoomStore()
+        self._rooms = {}        # room_id → Room（本地快取）
+        self._user_room = {}    # username → room_id
+        self._lock = threading.RLock()
+        self.ids = id_allocator or RoomIdAllocator()
+        self.store = store
+        self.conflicts = 0      # compare-and-set 失敗次數
+        self.on_load = None     # on_load(room_id, room)：從儲存層載入其他 worker 建立的房間後呼叫
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def __contains__(self, room_id):
+        return self.get(room_id) is not None
+
+    def __getitem__(self, room_id):
+        room = self.get(room_id)
+        if room is None:
+            raise KeyError(room_id)
+        return room
+
+    def __iter__(self):
+        return iter(list(self._rooms))
+
+    def get(self, room_id, default=None):
+        """
+        取得房間；共用儲存層時先與儲存層同步，
+        其他 worker 的修改（例如比賽已開始、玩家已離開）會立即反映在回傳的 Room 上
+        """
+        room = self._rooms.get(room_id)
+        if room_id is not None and self.store.shared:
+            if room is None:
+                room = self._load(room_id)
+            elif not self.refresh(room_id, room):
+                room = None
+        return default if room is None else room
+
+    def items(self):
+        return list(self._rooms.items())
+
+    def _index(self, room_id, room):
+        for username in room.players:
+            self._user_room[username] = room_id
+
+    def _unindex(self, room_id, room):
+        for username in room.players:
+            if self._user_room.get(username) == room_id:
+                del self._user_room[username]
+
+    def _load(self, room_id):
+        """從儲存層載入其他 worker 建立的房間"""
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is not None:
+                return room
+            version, data = self.store.load(room_id)
+            if data is None:
+                return None
+            room = Room.from_dict(data, version)
+            self._rooms[room_id] = room
+            self._index(room_id, room)
+        if self.on_load:
+            self.on_load(room_id, room)
+        return room
+
+    def _previous_room(self, username):
+        """玩家目前所在的房間ID；共用儲存層時以儲存層為準，本地索引可能已過期"""
+        if self.store.shared:
+            return self.store.get_user_room(username)
+        return self._user_room.get(username)
+
+    def _refresh(self, room_id, room):
+        """以儲存層的最新內容覆寫本地 Room；房間已被刪除時回傳 False"""
+        version, data = self.store.load(room_id)
+        if version == room.version:
+            return True
+        self._unindex(room_id, room)
+        if data is None:
+            self._rooms.pop(room_id, None)
+            return False
+        room.load_state(data, version)
+        self._index(room_id, room)
+        return True
+
+    def refresh(self, room_id, room):
+        """與儲存層同步本地 Room；房間已被其他 worker 刪除時回傳 False"""
+        with self._lock:
+            if self._rooms.get(room_id) is not room:
+                return False
+            return self._refresh(room_id, room)
+
+    def _write(self, room_id, room):
+        """以 compare-and-set 寫入目前狀態，空房間直接刪除；回傳是否成功"""
+        if len(room) == 0:
+            if not self.store.compare_and_set(room_id, room.version, None):
+                return False
+            self._rooms.pop(room_id, None)
+            self.ids.release(room_id)
+            return True
+        if not self.store.compare_and_set(room_id, room.version, room.to_dict()):
+            return False
+        room.version += 1
+        return True
+
+    def update(self, room_id, fn):
+        """
+        讀取 → fn(room) → compare-and-set，衝突時重新讀取後再執行 fn
+        fn 可能被呼叫多次，只應修改 room；回傳 fn 的結果，房間不存在時回傳 None
+        """
+        with self._lock:
+            for _ in range(self.CAS_RETRIES):
+                room = self.get(room_id)        # 共用儲存層時 get() 會先同步
+                if room is None:
+                    return None
+                before = set(room.players)
+                result = fn(room)
+                if self._write(room_id, room):
+                    for username in before - set(room.players):
+                        if self._user_room.get(username) == room_id:
+                            del self._user_room[username]
+                    for username in set(room.players) - before:
+                        self._user_room[username] = room_id
+                    return result
+                self.conflicts += 1
+                if not self._refresh(room_id, room):
+                    return None
+            raise RoomConflict(room_id)
+
+    def _claim(self, room_id, username):
+        """
+        以 compare-and-set 把儲存層中玩家的對應改為 room_id
+        回傳玩家原本所在的房間ID（沒有或相同時回傳 None）
+        兩個 worker 同時移動同一位玩家時，後寫入的一方會看到前者的結果再移出
+        """
+        while True:
+            current = self.store.get_user_room(username)
+            if current == room_id:
+                return None
+            if self.store.claim_user_room(username, current, room_id):
+                return current
+
+    def _leave_previous(self, room_id, username):
+        """玩家已登錄到 room_id 後，將其移出原本的房間；回傳 (username, 原房間ID) 或 None"""
+        previous = self._claim(room_id, username)
+        if self.store.shared:
+            # 登錄與取得對應之間玩家可能已被其他 worker 移出，此時撤銷對應
+            room = self._rooms.get(room_id)
+            if room is None or not self._refresh(room_id, room) or username not in room:
+                self.store.clear_user_room(username, room_id)
+        if previous is None:
+            return None
+        if self.update(previous, lambda room: room.remove_player(username)):
+            return username, previous
+        return None
+
+    def create(self, room_id, room, usernames=()):
+        """
+        登錄新房間並放入玩家；room_id 為 None 時由系統分配
+        回傳 (room_id, [(username, 原房間ID)])，後者列出被移出其他房間的玩家
+        自訂的 room_id 已被使用時丟出 RoomExists
+        """
+        with self._lock:
+            for username in usernames:
+                room.add_player(username)
+            while True:
+                allocated = room_id is None
+                new_id = self.ids.allocate() if allocated else room_id
+                if self.store.compare_and_set(new_id, 0, room.to_dict()):
+                    break
+                # 其他 worker 已使用這個 ID：自訂ID直接回報，系統ID放棄後改用下一個
+                if not allocated:
+                    raise RoomExists(room_id)
+                self.ids.discard(new_id)
+            room.version = 1
+            self._rooms[new_id] = room
+            self._index(new_id, room)
+            moved = [m for m in (self._leave_previous(new_id, u) for u in usernames) if m]
+            return new_id, moved
+
+    def add_player(self, room_id, username):
+        """
+        將玩家加入房間；玩家原本在其他房間時會一併移出
+        回傳 (username, 原房間ID)，沒有移動時回傳 None
+        """
+        with self._lock:
+            if self.update(room_id, lambda room: room.add_player(username) or True) is None:
+                raise KeyError(room_id)
+            return self._leave_previous(room_id, username)
+
+    def remove_player(self, room_id, username):
+        """
+        將玩家移出房間，房間空了就一併刪除
+        回傳 True 表示玩家原本在此房間
+        """
+        with self._lock:
+            removed = self.update(room_id, lambda room: room.remove_player(username))
+            if self._user_room.get(username) == room_id:
+                del self._user_room[username]
+            self.store.clear_user_room(username, room_id)
+            if self.store.shared:
+                # 清除對應前玩家可能已被其他 worker 重新加入，此時補回對應
+                room = self._rooms.get(room_id)
+                if room is not None and self._refresh(room_id, room) and username in room:
+                    self.store.claim_user_room(username, None, room_id)
+            return bool(removed)
+
+    def delete(self, room_id, room=None):
+        """
+        刪除房間並清除房內所有玩家的索引
+        指定 room 時只有在 room_id 仍對應到同一個 Room 才刪除；回傳是否有刪除
+        """
+        with self._lock:
+            current = self.get(room_id)
+            if current is None or (room is not None and current is not room):
+                return False
+            players = list(current.players)
+            while not self.store.compare_and_set(room_id, current.version, None):
+                self.conflicts += 1
+                if not self._refresh(room_id, current):
+                    break
+                players = list(current.players)
+            self._rooms.pop(room_id, None)
+            for username in players:
+                if self._user_room.get(username) == room_id:
+                    del self._user_room[username]
+                self.store.clear_user_room(username, room_id)
+            self.ids.release(room_id)
+            return True
+
+    def room_of(self, username):
+        """回傳 (room_id, Room)，玩家不在任何房間時回傳 (None, None)"""
+        room_id = self._user_room.get(username)
+        if room_id is None and self.store.shared:
+            room_id = self.store.get_user_room(username)
+        if room_id is None:
+            return None, None
+        room = self.get(room_id)
+        if room is None or username not in room:
+            return None, None
+        return room_id, room
+
+    def check_consistency(self):
+        """檢查反向索引與各房間的玩家名單完全一致，不一致時丟出 RoomInconsistent"""
+        with self._lock:
+            expected = {}
+            for room_id, room in self._rooms.items():
+                if len(room) == 0:
+                    raise RoomInconsistent(f"房間 {room_id} 沒有玩家卻未刪除")
+                for username in room.players:
+                    if username in expected:
+                        raise RoomInconsistent(f"{username} 同時在 {expected[username]} 與 {room_id}")
+                    expected[username] = room_id
+                stored_version, data = self.store.load(room_id)
+                if stored_version != room.version:
+                    raise RoomInconsistent(f"房間 {room_id} 的版本與儲存層不一致")
+                if data['players'] != room.players:
+                    raise RoomInconsistent(f"房間 {room_id} 的玩家與儲存層不一致")
+            if expected != self._user_room:
+                raise RoomInconsistent("user_room 索引與房間玩家名單不一致")
+            for username, room_id in expected.items():
+                if self.store.get_user_room(username) != room_id:
+                    raise RoomInconsistent(f"{username} 的儲存層對應不一致")
+            allocated = {room_id for room_id in self._rooms if room_id in self.ids._in_use}
+            if allocated != self.ids._in_use:
+                raise RoomInconsistent("已分配的房間ID與現有房間不一致")
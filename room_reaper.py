@@ -0,0 +1,108 @@
+"""
+閒置房間回收
+
+積分配對會在雙方連線前就建立房間；玩家沒有開啟遊戲頁面、或中途關閉分頁卻沒有
+觸發 disconnect 時，房間會永遠留在 rooms 裡。這裡為每個房間在時間輪上排一個計時器，
+到期時依房間狀態檢查是否已超過對應的閒置期限：
+    - 積分房間沒有任何玩家連線：RANKED_CONNECT_TIMEOUT
+    - 等待中、尚未開始過比賽：LOBBY_IDLE_TIMEOUT
+    - 比賽結束後回到等待：POST_GAME_TIMEOUT
+    - 倒數或比賽進行中：PLAYING_IDLE_TIMEOUT
+還沒到期的房間依新的期限重新排程，玩家活動不需要碰觸時間輪。
+"""
+import os
+import threading
+import time
+
+from room import RoomState
+from timer_wheel import TimerWheel
+
+RANKED_CONNECT_TIMEOUT = float(os.environ.get('ROOM_RANKED_CONNECT_TIMEOUT', 60))
+LOBBY_IDLE_TIMEOUT = float(os.environ.get('ROOM_LOBBY_IDLE_TIMEOUT', 1800))
+POST_GAME_TIMEOUT = float(os.environ.get('ROOM_POST_GAME_TIMEOUT', 600))
+PLAYING_IDLE_TIMEOUT = float(os.environ.get('ROOM_PLAYING_IDLE_TIMEOUT', 600))
+REAPER_INTERVAL = 1.0        # 時間輪每個 tick 的秒數
+
+
+def idle_deadline(room):
+    """回傳 (原因, 期限)，期限以 time.monotonic() 為基準"""
+    if room.state is not RoomState.WAITING:
+        return 'playing_idle', room.last_active + PLAYING_IDLE_TIMEOUT
+    if room.is_ranked and not room.ready and room.games_played == 0:
+        # 積分房間在玩家連線時才會登錄到 ready
+        return 'ranked_unconnected', room.last_active + RANKED_CONNECT_TIMEOUT
+    if room.games_played:
+        return 'post_game', room.last_active + POST_GAME_TIMEOUT
+    return 'lobby_idle', room.last_active + LOBBY_IDLE_TIMEOUT
+
+
+class RoomReaper:
+    def __init__(self, rooms, on_reap=None, interval=REAPER_INTERVAL):
+        self.rooms = rooms
+        self.on_reap = on_reap          # on_reap(room_id, room, reason)，房間刪除後呼叫
+        self.interval = interval
+        self.wheel = TimerWheel(tick=interval)
+        self._lock = threading.Lock()
+        self._started = False
+        self.reaped = {}                # 原因 → 回收房間數
+        self.bytes_reclaimed = 0
+        self.rescheduled = 0
+
+    def watch(self, room_id, room):
+        """開始追蹤新建立的房間"""
+        _, deadline = idle_deadline(room)
+        with self._lock:
+            self.wheel.schedule(deadline - time.monotonic(), (room_id, room))
+
+    def tick(self, now=None):
+        """處理到期的計時器，回傳本次回收的房間數"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            expired = self.wheel.advance(now)
+        count = 0
+        for room_id, room in expired:
+            if self.rooms.get(room_id) is not room:
+                continue                # 房間已被正常刪除，計時器自然作廢
+            if self.rooms.store.shared and not self.rooms.refresh(room_id, room):
+                continue                # 已被其他 worker 刪除；有變動的房間在同步時會更新活動時間
+            reason, deadline = idle_deadline(room)
+            if deadline > now:
+                with self._lock:
+                    self.wheel.schedule(deadline - now, (room_id, room), now=now)
+                    self.rescheduled += 1
+                continue
+            size = room.approx_size()
+            if not self.rooms.delete(room_id, room):
+                continue
+            self.reaped[reason] = self.reaped.get(reason, 0) + 1
+            self.bytes_reclaimed += size
+            count += 1
+            if self.on_reap:
+                self.on_reap(room_id, room, reason)
+        return count
+
+    def run(self, sleep):
+        """背景迴圈；sleep 由呼叫端提供（例如 socketio.sleep）"""
+        while True:
+            sleep(self.interval)
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"房間回收失敗: {e}")
+
+    def start(self, start_background_task, sleep):
+        """啟動背景回收任務（重複呼叫無效）"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        start_background_task(self.run, sleep)
+
+    def stats(self):
+        return {
+            'pending_timers': len(self.wheel),
+            'reaped': dict(self.reaped),
+            'reaped_total': sum(self.reaped.values()),
+            'bytes_reclaimed': self.bytes_reclaimed,
+            'rescheduled': self.rescheduled,
+        }
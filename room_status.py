@@ -0,0 +1,53 @@
+"""
+房間狀態廣播
+
+room_status 是完整快照，只在玩家連線、或前端發現版本不連續時送給單一連線；
+其餘變化以 room_delta 廣播給整個房間，內容為版本號與一串變更：
+    ['join', username, rating, ready]   玩家加入（重新連線時覆寫原本的資料）
+    ['leave', username]                 玩家離開
+    ['ready', username, ready]          準備狀態切換
+    ['score', username, score]          分數改為 score
+    ['started', game_started]           比賽開始 / 回到等待
+每個 room_delta 的版本比上一個多一；前端收到的版本不是目前版本加一時，
+送出 sync_room_status 取得完整快照。
+"""
+
+
+def snapshot(room, ratings, **extra):
+    """完整的房間狀態，額外欄位以關鍵字參數附加"""
+    status = {
+        'version':      room.status_version,
+        'players':      room.player_list(),
+        'scores':       room.scores,
+        'ready':        room.ready,
+        'game_started': room.game_started,
+        'ratings':      ratings,
+    }
+    status.update(extra)
+    return status
+
+
+def delta(room, *changes):
+    """房間已套用 changes 後呼叫：版本加一並回傳 room_delta 內容，呼叫端負責儲存房間"""
+    room.status_version += 1
+    return {'version': room.status_version, 'changes': list(changes)}
+
+
+def joined(username, rating, ready=False):
+    return ['join', username, rating, bool(ready)]
+
+
+def left(username):
+    return ['leave', username]
+
+
+def ready(username, is_ready):
+    return ['ready', username, bool(is_ready)]
+
+
+def score(username, value):
+    return ['score', username, value]
+
+
+def started(game_started):
+    return ['started', bool(game_started)]
@@ -0,0 +1,591 @@
+"""
+房間狀態儲存層
+
+房間與積分配對隊列可以放在：
+    - 行程記憶體（預設，單一 worker）
+    - 共用的 SQLite 檔案（同一台機器上的多個 worker）
+    - Redis 協定的伺服器（多台機器）
+所有寫入都以版本號做 compare-and-set：寫入時帶上讀到的版本，
+版本不符代表其他 worker 已經改過，呼叫端需要重新讀取後再套用一次修改。
+
+共用的儲存層以 Room.to_dict() 的 JSON 字串保存房間內容，版本 0 代表房間不存在。
+"""
+import abc
+import json
+import os
+import sqlite3
+import threading
+
+ROOM_STORE = os.environ.get('ROOM_STORE', 'memory')
+ROOM_STORE_TIMEOUT = 5.0     # SQLite 等待鎖的秒數
+
+
+class RoomStore(abc.ABC):
+    """儲存層介面"""
+
+    # 是否可能被其他行程修改；為 False 時登錄表可以完全信任本地快取
+    shared = False
+
+    @abc.abstractmethod
+    def load(self, room_id):
+        """回傳 (版本, 房間內容 dict)；房間不存在時回傳 (0, None)"""
+
+    @abc.abstractmethod
+    def compare_and_set(self, room_id, expected_version, data):
+        """
+        目前版本等於 expected_version 時寫入 data（None 代表刪除），版本加一
+        回傳是否寫入成功
+        """
+
+    @abc.abstractmethod
+    def room_ids(self):
+        ...
+
+    @abc.abstractmethod
+    def get_user_room(self, username):
+        ...
+
+    @abc.abstractmethod
+    def claim_user_room(self, username, expected_room_id, room_id):
+        """玩家目前對應到 expected_room_id（None 代表沒有）時改為 room_id，回傳是否成功"""
+
+    @abc.abstractmethod
+    def clear_user_room(self, username, room_id):
+        """只有在玩家仍對應到 room_id 時才清除"""
+
+    @abc.abstractmethod
+    def queue_push(self, username, rating, joined_at):
+        """加入積分配對隊列；已在隊列中時回傳 False"""
+
+    @abc.abstractmethod
+    def queue_remove(self, username):
+        ...
+
+    @abc.abstractmethod
+    def queue_contains(self, username):
+        ...
+
+    @abc.abstractmethod
+    def queue_len(self):
+        ...
+
+    @abc.abstractmethod
+    def queue_entries(self):
+        """隊列中所有玩家的 (username, rating, joined_at)，依加入順序"""
+
+    @abc.abstractmethod
+    def queue_take(self, usernames):
+        """所有玩家都還在隊列中時原子地一起取出，回傳是否成功"""
+
+
+class MemoryRoomStore(RoomStore):
+    """行程內的儲存層"""
+
+    def __init__(self):
+        # room_id → (版本, 內容 dict)；不會被其他行程讀取，不必序列化
+        self._rooms = {}
+        self._user_room = {}
+        self._queue = {}             # username → (rating, joined_at)，dict 保留加入順序
+        self._lock = threading.Lock()
+
+    def load(self, room_id):
+        return self._rooms.get(room_id, (0, None))
+
+    def compare_and_set(self, room_id, expected_version, data):
+        with self._lock:
+            version = self._rooms.get(room_id, (0, None))[0]
+            if version != expected_version:
+                return False
+            if data is None:
+                del self._rooms[room_id]
+            else:
+                self._rooms[room_id] = (version + 1, data)
+            return True
+
+    def room_ids(self):
+        return list(self._rooms)
+
+    def get_user_room(self, username):
+        return self._user_room.get(username)
+
+    def claim_user_room(self, username, expected_room_id, room_id):
+        with self._lock:
+            if self._user_room.get(username) != expected_room_id:
+                return False
+            self._user_room[username] = room_id
+            return True
+
+    def clear_user_room(self, username, room_id):
+        with self._lock:
+            if self._user_room.get(username) == room_id:
+                del self._user_room[username]
+
+    def queue_push(self, username, rating, joined_at):
+        with self._lock:
+            if username in self._queue:
+                return False
+            self._queue[username] = (rating, joined_at)
+            return True
+
+    def queue_remove(self, username):
+        with self._lock:
+            return self._queue.pop(username, None) is not None
+
+    def queue_contains(self, username):
+        return username in self._queue
+
+    def queue_len(self):
+        return len(self._queue)
+
+    def queue_entries(self):
+        with self._lock:
+            return [(username, rating, joined_at) for username, (rating, joined_at) in self._queue.items()]
+
+    def queue_take(self, usernames):
+        with self._lock:
+            if not all(username in self._queue for username in usernames):
+                return False
+            for username in usernames:
+                del self._queue[username]
+            return True
+
+
+class SQLiteRoomStore(RoomStore):
+    """同一台機器上多個 worker 共用的 SQLite 檔案"""
+
+    shared = True
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS room_state (
+                    room_id TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    data    TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS user_room (
+                    username TEXT PRIMARY KEY,
+                    room_id  TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS ranked_queue (
+                    seq       INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username  TEXT UNIQUE NOT NULL,
+                    rating    INTEGER NOT NULL DEFAULT 1500,
+                    joined_at REAL NOT NULL DEFAULT 0
+                );
+            """)
+            # 舊版的隊列表沒有 rating / joined_at 欄位
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(ranked_queue)')}
+            if 'rating' not in columns:
+                conn.execute('ALTER TABLE ranked_queue ADD COLUMN rating INTEGER NOT NULL DEFAULT 1500')
+                conn.execute('ALTER TABLE ranked_queue ADD COLUMN joined_at REAL NOT NULL DEFAULT 0')
+
+    def _conn(self):
+        """每個執行緒一條連線，autocommit 模式，需要原子性時自行 BEGIN IMMEDIATE"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=ROOM_STORE_TIMEOUT,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def load(self, room_id):
+        row = self._conn().execute(
+            'SELECT version, data FROM room_state WHERE room_id = ?', (room_id,)).fetchone()
+        if row is None:
+            return 0, None
+        return row[0], json.loads(row[1])
+
+    def compare_and_set(self, room_id, expected_version, data):
+        conn = self._conn()
+        if data is None:
+            cur = conn.execute('DELETE FROM room_state WHERE room_id = ? AND version = ?',
+                               (room_id, expected_version))
+        elif expected_version == 0:
+            cur = conn.execute('INSERT OR IGNORE INTO room_state (room_id, version, data) VALUES (?, 1, ?)',
+                               (room_id, json.dumps(data)))
+        else:
+            cur = conn.execute(
+                'UPDATE room_state SET version = version + 1, data = ? WHERE room_id = ? AND version = ?',
+                (json.dumps(data), room_id, expected_version))
+        return cur.rowcount == 1
+
+    def room_ids(self):
+        return [row[0] for row in self._conn().execute('SELECT room_id FROM room_state')]
+
+    def get_user_room(self, username):
+        row = self._conn().execute('SELECT room_id FROM user_room WHERE username = ?', (username,)).fetchone()
+        return row[0] if row else None
+
+    def claim_user_room(self, username, expected_room_id, room_id):
+        conn = self._conn()
+        if expected_room_id is None:
+            cur = conn.execute('INSERT OR IGNORE INTO user_room (username, room_id) VALUES (?, ?)',
+                               (username, room_id))
+        else:
+            cur = conn.execute('UPDATE user_room SET room_id = ? WHERE username = ? AND room_id = ?',
+                               (room_id, username, expected_room_id))
+        return cur.rowcount == 1
+
+    def clear_user_room(self, username, room_id):
+        self._conn().execute('DELETE FROM user_room WHERE username = ? AND room_id = ?', (username, room_id))
+
+    def queue_push(self, username, rating, joined_at):
+        cur = self._conn().execute(
+            'INSERT OR IGNORE INTO ranked_queue (username, rating, joined_at) VALUES (?, ?, ?)',
+            (username, rating, joined_at))
+        return cur.rowcount == 1
+
+    def queue_remove(self, username):
+        return self._conn().execute('DELETE FROM ranked_queue WHERE username = ?', (username,)).rowcount == 1
+
+    def queue_contains(self, username):
+        return self._conn().execute(
+            'SELECT 1 FROM ranked_queue WHERE username = ?', (username,)).fetchone() is not None
+
+    def queue_len(self):
+        return self._conn().execute('SELECT COUNT(*) FROM ranked_queue').fetchone()[0]
+
+    def queue_entries(self):
+        return self._conn().execute(
+            'SELECT username, rating, joined_at FROM ranked_queue ORDER BY seq').fetchall()
+
+    def queue_take(self, usernames):
+        conn = self._conn()
+        placeholders = ', '.join('?' * len(usernames))
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            count = conn.execute(f'SELECT COUNT(*) FROM ranked_queue WHERE username IN ({placeholders})',
+                                 tuple(usernames)).fetchone()[0]
+            if count == len(usernames):
+                conn.execute(f'DELETE FROM ranked_queue WHERE username IN ({placeholders})', tuple(usernames))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return count == len(usernames)
+
+
+class RedisRoomStore(RoomStore):
+    """
+    Redis 協定伺服器上的儲存層
+
+    client 需提供 redis-py 的介面（或 LocalRedis）。
+    compare-and-set 以 WATCH / MULTI / EXEC 完成，被監看的鍵在 EXEC 前被改過就放棄寫入。
+    """
+
+    shared = True
+
+    def __init__(self, client, prefix='modinv:'):
+        self.client = client
+        self.prefix = prefix
+        self._rooms_key = prefix + 'rooms'
+        self._queue_key = prefix + 'ranked_queue'
+        self._queue_ratings_key = prefix + 'ranked_queue_ratings'
+        self._watch_error = getattr(client, 'WatchError', None)
+        if self._watch_error is None:
+            from redis.exceptions import WatchError
+            self._watch_error = WatchError
+
+    def _room_key(self, room_id):
+        return f'{self.prefix}room:{room_id}'
+
+    def _user_key(self, username):
+        return f'{self.prefix}user_room:{username}'
+
+    @staticmethod
+    def _text(value):
+        return value.decode() if isinstance(value, bytes) else value
+
+    def load(self, room_id):
+        entry = self.client.hgetall(self._room_key(room_id))
+        if not entry:
+            return 0, None
+        entry = {self._text(k): self._text(v) for k, v in entry.items()}
+        return int(entry['version']), json.loads(entry['data'])
+
+    def compare_and_set(self, room_id, expected_version, data):
+        key = self._room_key(room_id)
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                version = int(self._text(pipe.hget(key, 'version')) or 0)
+                if version != expected_version:
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                if data is None:
+                    pipe.delete(key)
+                    pipe.srem(self._rooms_key, room_id)
+                else:
+                    pipe.hset(key, mapping={'version': version + 1, 'data': json.dumps(data)})
+                    pipe.sadd(self._rooms_key, room_id)
+                pipe.execute()
+                return True
+            except self._watch_error:
+                return False
+
+    def room_ids(self):
+        return [self._text(room_id) for room_id in self.client.smembers(self._rooms_key)]
+
+    def get_user_room(self, username):
+        return self._text(self.client.get(self._user_key(username)))
+
+    def _swap_user_room(self, username, expected_room_id, room_id):
+        """WATCH 玩家的對應，符合預期時改為 room_id（None 代表刪除）"""
+        key = self._user_key(username)
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if self._text(pipe.get(key)) != expected_room_id:
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                if room_id is None:
+                    pipe.delete(key)
+                else:
+                    pipe.set(key, room_id)
+                pipe.execute()
+                return True
+            except self._watch_error:
+                return False
+
+    def claim_user_room(self, username, expected_room_id, room_id):
+        return self._swap_user_room(username, expected_room_id, room_id)
+
+    def clear_user_room(self, username, room_id):
+        # 失敗代表其他 worker 已改寫對應，不需清除
+        self._swap_user_room(username, room_id, None)
+
+    def queue_push(self, username, rating, joined_at):
+        # 有序集合以加入時間為分數，rating 另存在雜湊中
+        if not self.client.zadd(self._queue_key, {username: joined_at}, nx=True):
+            return False
+        self.client.hset(self._queue_ratings_key, mapping={username: rating})
+        return True
+
+    def queue_remove(self, username):
+        removed = bool(self.client.zrem(self._queue_key, username))
+        self.client.hdel(self._queue_ratings_key, username)
+        return removed
+
+    def queue_contains(self, username):
+        return self.client.zscore(self._queue_key, username) is not None
+
+    def queue_len(self):
+        return self.client.zcard(self._queue_key)
+
+    def queue_entries(self):
+        members = self.client.zrange(self._queue_key, 0, -1, withscores=True)
+        ratings = {self._text(k): int(v) for k, v in self.client.hgetall(self._queue_ratings_key).items()}
+        entries = []
+        for username, joined_at in members:
+            username = self._text(username)
+            if username in ratings:      # 加入到一半（尚未寫入 rating）的玩家留待下次
+                entries.append((username, ratings[username], joined_at))
+        return entries
+
+    def queue_take(self, usernames):
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self._queue_key)
+                    if any(pipe.zscore(self._queue_key, username) is None for username in usernames):
+                        pipe.unwatch()
+                        return False
+                    pipe.multi()
+                    pipe.zrem(self._queue_key, *usernames)
+                    pipe.hdel(self._queue_ratings_key, *usernames)
+                    pipe.execute()
+                    return True
+                except self._watch_error:
+                    continue
+
+
+class LocalRedis:
+    """
+    行程內的 Redis 替身，只實作 RedisRoomStore 用到的指令，供測試與單機開發使用
+    WATCH 以每個鍵的修改次數判斷是否被改過，語意與 Redis 相同
+    """
+
+    class WatchError(Exception):
+        pass
+
+    def __init__(self):
+        self._data = {}
+        self._revisions = {}         # 鍵 → 修改次數
+        self._lock = threading.RLock()
+
+    def _touch(self, key):
+        self._revisions[key] = self._revisions.get(key, 0) + 1
+
+    def get(self, key):
+        return self._data.get(key)
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = str(value)
+            self._touch(key)
+
+    def delete(self, *keys):
+        with self._lock:
+            removed = 0
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    removed += 1
+                    self._touch(key)
+            return removed
+
+    def incr(self, key):
+        with self._lock:
+            value = int(self._data.get(key, 0)) + 1
+            self._data[key] = str(value)
+            self._touch(key)
+            return value
+
+    def hget(self, key, field):
+        return self._data.get(key, {}).get(field)
+
+    def hgetall(self, key):
+        return dict(self._data.get(key, {}))
+
+    def hset(self, key, mapping):
+        with self._lock:
+            self._data.setdefault(key, {}).update({k: str(v) for k, v in mapping.items()})
+            self._touch(key)
+            return len(mapping)
+
+    def hdel(self, key, *fields):
+        with self._lock:
+            mapping = self._data.get(key, {})
+            removed = sum(1 for f in fields if mapping.pop(f, None) is not None)
+            self._touch(key)
+            return removed
+
+    def sadd(self, key, *members):
+        with self._lock:
+            members_set = self._data.setdefault(key, set())
+            added = len(set(members) - members_set)
+            members_set.update(members)
+            self._touch(key)
+            return added
+
+    def srem(self, key, *members):
+        with self._lock:
+            members_set = self._data.get(key, set())
+            removed = len(members_set & set(members))
+            members_set.difference_update(members)
+            self._touch(key)
+            return removed
+
+    def smembers(self, key):
+        return set(self._data.get(key, set()))
+
+    def zadd(self, key, mapping, nx=False):
+        with self._lock:
+            zset = self._data.setdefault(key, {})
+            added = 0
+            for member, score in mapping.items():
+                if member in zset:
+                    if nx:
+                        continue
+                else:
+                    added += 1
+                zset[member] = float(score)
+            self._touch(key)
+            return added
+
+    def zrem(self, key, *members):
+        with self._lock:
+            zset = self._data.get(key, {})
+            removed = sum(1 for m in members if zset.pop(m, None) is not None)
+            self._touch(key)
+            return removed
+
+    def zscore(self, key, member):
+        return self._data.get(key, {}).get(member)
+
+    def zcard(self, key):
+        return len(self._data.get(key, {}))
+
+    def zrange(self, key, start, end, withscores=False):
+        members = sorted(self._data.get(key, {}).items(), key=lambda item: item[1])
+        members = members[start:end + 1 if end >= 0 else None]
+        return members if withscores else [member for member, _ in members]
+
+    def pipeline(self):
+        return LocalRedisPipeline(self)
+
+
+class LocalRedisPipeline:
+    """redis-py Pipeline 的子集：WATCH 之後立即執行，MULTI 之後暫存到 EXEC"""
+
+    def __init__(self, redis):
+        self._redis = redis
+        self._watched = {}
+        self._queued = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.reset()
+
+    def reset(self):
+        self._watched = {}
+        self._queued = None
+
+    def watch(self, *keys):
+        for key in keys:
+            self._watched[key] = self._redis._revisions.get(key, 0)
+
+    def unwatch(self):
+        self._watched = {}
+
+    def multi(self):
+        self._queued = []
+
+    def execute(self):
+        with self._redis._lock:
+            try:
+                for key, revision in self._watched.items():
+                    if self._redis._revisions.get(key, 0) != revision:
+                        raise LocalRedis.WatchError(key)
+                return [getattr(self._redis, name)(*args, **kwargs)
+                        for name, args, kwargs in self._queued or ()]
+            finally:
+                self.reset()
+
+    def __getattr__(self, name):
+        command = getattr(self._redis, name)
+        if self._queued is None:
+            return command
+
+        def queue(*args, **kwargs):
+            self._queued.append((name, args, kwargs))
+            return self
+        return queue
+
+
+def create_store(url=ROOM_STORE):
+    """
+    依設定建立儲存層：
+        memory                      行程記憶體
+        sqlite:///path/to/rooms.db  共用 SQLite 檔案
+        redis://host:6379/0         Redis 協定伺服器（需要安裝 redis 套件）
+        local-redis                 行程內的 Redis 替身
+    """
+    if url == 'memory':
+        return MemoryRoomStore()
+    if url.startswith('sqlite:///'):
+        return SQLiteRoomStore(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        import redis
+        return RedisRoomStore(redis.Redis.from_url(url))
+    if url == 'local-redis':
+        return RedisRoomStore(LocalRedis())
+    raise ValueError(f"不支援的 ROOM_STORE 設定: {url}")
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+多 worker 啟動器
+
+在同一個對外埠啟動 N 個 app.py worker：
+    - 每個 worker 監聽 127.0.0.1 上各自的內部埠
+    - 對外埠由這裡的轉發層接收連線：帶有 room 參數的 /socket.io/ 請求依一致性雜湊
+      送到負責該房間的 worker，其餘 HTTP 請求輪流分配
+    - worker 之間的廣播經由訊息佇列轉送；未指定時啟動 local_broker.py 的 broker
+    - 房間狀態必須放在共用的儲存層；未指定時使用 rooms.db（SQLite）
+
+轉發層對一般請求改寫成 Connection: close，每條 TCP 連線只承載一個請求，
+之後的請求會重新選擇 worker；WebSocket 升級後的連線則維持在同一個 worker。
+
+用法：
+    python run_cluster.py --workers 4 --port 8000
+"""
+import argparse
+import itertools
+import os
+import secrets
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+
+from affinity import HashRing
+from local_broker import Broker
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MAX_HEADER_SIZE = 64 * 1024
+
+
+class AffinityProxy:
+    """依房間把 Socket.IO 連線轉給負責的 worker 的 TCP 轉發層"""
+
+    def __init__(self, backends, host='0.0.0.0', port=8000):
+        self.backends = backends                 # worker 編號 → (host, port)
+        self.ring = HashRing(range(len(backends)))
+        self._round_robin = itertools.cycle(range(len(backends)))
+        self.listener = socket.create_server((host, port), reuse_port=False)
+
+    def choose(self, target):
+        """依請求路徑選擇 worker"""
+        parts = urlsplit(target)
+        if parts.path.startswith('/socket.io'):
+            room = parse_qs(parts.query).get('room', [''])[0]
+            if room:
+                return self.ring.node_for(room)
+        return next(self._round_robin)
+
+    def serve_forever(self):
+        while True:
+            client, _ = self.listener.accept()
+            threading.Thread(target=self._handle, args=(client,), daemon=True).start()
+
+    def _handle(self, client):
+        try:
+            head, rest = self._read_head(client)
+            if head is None:
+                return
+            lines = head.split(b'\r\n')
+            request_line = lines[0].decode('latin-1')
+            target = request_line.split(' ')[1] if ' ' in request_line else '/'
+            headers = [line for line in lines[1:] if line]
+            upgrade = any(line.lower().startswith(b'upgrade:') for line in headers)
+            if not upgrade:
+                headers = [line for line in headers
+                           if not line.lower().startswith((b'connection:', b'keep-alive:'))]
+                headers.append(b'Connection: close')
+            upstream = socket.create_connection(self.backends[self.choose(target)])
+        except (OSError, IndexError):
+            client.close()
+            return
+        upstream.sendall(b'\r\n'.join([lines[0]] + headers) + b'\r\n\r\n' + rest)
+        threading.Thread(target=self._pipe, args=(upstream, client), daemon=True).start()
+        self._pipe(client, upstream)
+
+    @staticmethod
+    def _read_head(sock):
+        data = b''
+        while b'\r\n\r\n' not in data:
+            chunk = sock.recv(65536)
+            if not chunk or len(data) > MAX_HEADER_SIZE:
+                sock.close()
+                return None, b''
+            data += chunk
+        head, _, rest = data.partition(b'\r\n\r\n')
+        return head, rest
+
+    @staticmethod
+    def _pipe(source, destination):
+        try:
+            while True:
+                chunk = source.recv(65536)
+                if not chunk:
+                    break
+                destination.sendall(chunk)
+        except OSError:
+            pass
+        finally:
+            for sock in (source, destination):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                sock.close()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="以多個 worker 啟動遊戲伺服器")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help="worker 數量")
+    parser.add_argument('--host', default='0.0.0.0', help="對外監聽位址")
+    parser.add_argument('--port', type=int, default=8000, help="對外埠")
+    parser.add_argument('--message-queue', default=os.environ.get('SOCKETIO_MESSAGE_QUEUE'),
+                        help="訊息佇列，例如 redis://localhost:6379/0；未指定時啟動本機 broker")
+    parser.add_argument('--room-store', default=os.environ.get('ROOM_STORE'),
+                        help="共用的房間儲存層，未指定時使用 sqlite:///rooms.db")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    message_queue = args.message_queue
+    if not message_queue:
+        broker = Broker('127.0.0.1', free_port())
+        threading.Thread(target=broker.serve_forever, daemon=True).start()
+        message_queue = 'local://%s:%d' % broker.server_address
+        print(f"已啟動 local broker: {message_queue}")
+
+    room_store = args.room_store or 'sqlite:///' + os.path.join(BASE_DIR, 'rooms.db')
+    if room_store == 'memory':
+        sys.exit("多 worker 模式需要共用的 ROOM_STORE（sqlite:/// 或 redis://）")
+
+    env = dict(os.environ,
+               SOCKETIO_MESSAGE_QUEUE=message_queue,
+               ROOM_STORE=room_store,
+               WORKER_COUNT=str(args.workers),
+               # 所有 worker 必須使用相同的金鑰，session 才能在 worker 之間通用
+               SECRET_KEY=os.environ.get('SECRET_KEY') or secrets.token_hex(32),
+               HOST='127.0.0.1')
+
+    backends = {}
+    workers = []
+    for worker_id in range(args.workers):
+        port = free_port()
+        backends[worker_id] = ('127.0.0.1', port)
+        workers.append(subprocess.Popen(
+            [sys.executable, os.path.join(BASE_DIR, 'app.py')], cwd=BASE_DIR,
+            env=dict(env, WORKER_ID=str(worker_id), PORT=str(port))))
+        print(f"worker {worker_id} 啟動於 127.0.0.1:{port}（pid {workers[-1].pid}）")
+
+    def shutdown(*_):
+        for process in workers:
+            process.terminate()
+        for process in workers:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    proxy = AffinityProxy(backends, args.host, args.port)
+    print(f"對外監聽 {args.host}:{args.port}，共 {args.workers} 個 worker")
+    try:
+        threading.Thread(target=proxy.serve_forever, daemon=True).start()
+        while all(process.poll() is None for process in workers):
+            time.sleep(1)
+        print("有 worker 意外結束，關閉所有 worker")
+    except KeyboardInterrupt:
+        pass
+    shutdown()
+
+
+if __name__ == '__main__':
+    main()
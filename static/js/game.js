@@ -1,5 +1,6 @@
 let gameMode = 'first';
-const socket = io();
+// 帶上房間ID，多 worker 部署時轉發層依此把連線送到負責該房間的 worker
+const socket = io({ query: { room: document.body.dataset.roomId } });
 let myUsername = '';
 let isAnswered = false;
 let countdownInterval = null;
@@ -7,7 +8,7 @@ let timeLeft = 100;
 let gameInProgress = false;
 let correctAnswerUsername = null;
 let redirectTimer = null;
-let currentPValue = 0;  // 用於存儲當前題目的模數 p
+let currentPValue = 0n;  // 用於存儲當前題目的模數 p（BigInt，支援大模數）
 
 // 定義一個函數來根據 rating 設定對應的 class
 function getRatingClass(rating) {
@@ -22,40 +23,49 @@ function getRatingClass(rating) {
 socket.on('connect', function() {
     console.log('已連接到服務器');
     fetchRoomInfo();
-    
-    // 檢查是否為積分模式，如果是則開始檢查倒數
-    fetch('/get_room_info')
-        .then(response => response.json())
-        .then(data => {
-            if (data.error) return;
-            
-            if (data.is_ranked || data.game_mode === 'ranked') {
-                // 啟動積分模式倒數檢查
-                rankedCountdownInterval = setInterval(function() {
-                    socket.emit('check_ranked_countdown');
-                }, 1000);
-            }
-        })
-        .catch(error => {
-            console.error('獲取房間信息出錯:', error);
+    // 積分模式的倒數由服務器在連線時推送 ranked_countdown_update，遊戲也由服務器開始
+});
+
+// 服務器把短時間內的房間廣播合併成一個 batch：[[事件, 資料, 略過的連線?], ...]
+// 依序交給原本的事件處理函式，略過的連線是自己時跳過（例如自己送出的 player_answered）
+socket.on('batch', function(events) {
+    events.forEach(function([name, data, skipSid]) {
+        if (skipSid && skipSid === socket.id) return;
+        socket.listeners(name).forEach(function(handler) {
+            handler(data);
         });
+    });
 });
 
-// 添加倒數更新事件處理
+// 積分模式倒數：服務器只推送剩餘秒數，前端自行倒數顯示
 socket.on('ranked_countdown_update', function(data) {
-    const countdown = data.countdown;
+    let countdown = data.countdown;
     const waitingMessage = document.querySelector('.waiting-message');
     
-    if (countdown > 0) {
-        waitingMessage.innerHTML = `積分模式：遊戲將在 ${countdown} 秒後開始（${data.connected_players}/${data.total_players} 人已連接）`;
-    } else {
-        waitingMessage.innerHTML = '積分模式：遊戲即將開始...';
-        
-        // 清除倒數計時器
-        if (rankedCountdownInterval) {
-            clearInterval(rankedCountdownInterval);
+    function render() {
+        if (countdown > 0) {
+            waitingMessage.innerHTML = `積分模式：遊戲將在 ${countdown} 秒後開始（${data.connected_players}/${data.total_players} 人已連接）`;
+        } else {
+            waitingMessage.innerHTML = '積分模式：遊戲即將開始...';
+            
+            // 清除倒數計時器
+            if (rankedCountdownInterval) {
+                clearInterval(rankedCountdownInterval);
+                rankedCountdownInterval = null;
+            }
         }
     }
+    
+    if (rankedCountdownInterval) {
+        clearInterval(rankedCountdownInterval);
+    }
+    render();
+    if (countdown > 0) {
+        rankedCountdownInterval = setInterval(function() {
+            countdown--;
+            render();
+        }, 1000);
+    }
 });
 
 // 在全局變數區域添加
@@ -93,10 +103,79 @@ socket.on('user_joined', function(data) {
     console.log('用戶加入:', data.username);
 });
 
-// 房間狀態更新
+// 房間因閒置過久被伺服器回收
+socket.on('room_closed', function(data) {
+    console.log('房間已關閉:', data.reason);
+    alert('房間閒置過久，已被關閉');
+    window.location.href = '/';
+});
+
+// 房間狀態：room_status 為完整快照，room_delta 為依版本號依序套用的變更
+let roomState = null;
+
+function renderRoomState() {
+    updatePlayerList(roomState.players, roomState.scores, roomState.ready, roomState.ratings, roomState.game_started);
+}
+
+// 房間狀態更新（完整快照，連線時或要求同步時收到）
 socket.on('room_status', function(data) {
     console.log('房間狀態:', data);
-    updatePlayerList(data.players, data.scores, data.ready || {}, data.ratings, data.game_started);
+    roomState = {
+        version: data.version,
+        players: data.players.slice(),
+        scores: Object.assign({}, data.scores),
+        ready: Object.assign({}, data.ready || {}),
+        ratings: Object.assign({}, data.ratings),
+        game_started: data.game_started
+    };
+});
+
+// 房間狀態變更
+socket.on('room_delta', function(data) {
+    // 尚未收到快照時忽略，快照隨後就到；重複或過期的版本也忽略
+    if (!roomState || data.version <= roomState.version) {
+        return;
+    }
+    // 版本不連續代表漏收了變更，要求完整快照
+    if (data.version !== roomState.version + 1) {
+        socket.emit('sync_room_status');
+        return;
+    }
+    roomState.version = data.version;
+    
+    let onlyScores = true;
+    data.changes.forEach(change => {
+        const [type, name, value, extra] = change;
+        if (type === 'score') {
+            roomState.scores[name] = value;
+            return;
+        }
+        onlyScores = false;
+        if (type === 'join') {
+            if (!roomState.players.includes(name)) {
+                roomState.players.push(name);
+            }
+            roomState.ratings[name] = value;
+            roomState.scores[name] = roomState.scores[name] || 0;
+            roomState.ready[name] = extra;
+        } else if (type === 'leave') {
+            roomState.players = roomState.players.filter(player => player !== name);
+            delete roomState.scores[name];
+            delete roomState.ready[name];
+            delete roomState.ratings[name];
+        } else if (type === 'ready') {
+            roomState.ready[name] = value;
+        } else if (type === 'started') {
+            roomState.game_started = name;
+        }
+    });
+    
+    // 只有分數變化時不重建玩家卡片，保留答題狀態的標記
+    if (onlyScores) {
+        updatePlayerScores(roomState.scores);
+    } else {
+        renderRoomState();
+    }
 });
 
 // 玩家準備狀態
@@ -146,7 +225,7 @@ socket.on('new_question', function(data) {
     document.getElementById('answer-input').focus();
     
     // 將當前的 p 值保存到全局變量，用於答題驗證 - 新增這一行
-    currentPValue = data.p;
+    currentPValue = BigInt(data.p);
     
     // 重置UI
     document.getElementById('opponent-answered').style.display = 'none';
@@ -350,12 +429,6 @@ socket.on('answer_result', function(data) {
     document.getElementById('submit-button').disabled = true;
 });
 
-// 更新分數
-socket.on('update_scores', function(data) {
-    console.log('更新分數:', data);
-    updatePlayerScores(data.scores);
-});
-
 // 遊戲結束
 // 修改 socket.on('game_over') 事件處理函數
 // 在 static/js/game.js 中找到此函數並替換
@@ -380,6 +453,7 @@ socket.on('game_over', function(data) {
     const isRanked = data.is_ranked;
     const ratingChanges = data.rating_changes || {};
     const oldRatings = data.old_ratings || {};
+    const ranks = data.ranks || {};
     
     if (data.tie) {
         contentHTML = `
@@ -396,8 +470,9 @@ socket.on('game_over', function(data) {
                         const changeClass = ratingChange > 0 ? 'positive' : (ratingChange < 0 ? 'negative' : '');
                         const changePrefix = ratingChange > 0 ? '+' : '';
                         
+                        const rank = ranks[player] ? ` #${ranks[player]}` : '';
                         ratingHTML = `<span class="rating-change ${changeClass}">${changePrefix}${ratingChange}</span>
-                                     <span class="new-rating">(${oldRating} → ${newRating})</span>`;
+                                     <span class="new-rating">(${oldRating} → ${newRating})${rank}</span>`;
                     }
                     
                     return `<div>${player}: ${score}分 ${ratingHTML}</div>`;
@@ -423,8 +498,9 @@ socket.on('game_over', function(data) {
                         const changeClass = ratingChange > 0 ? 'positive' : (ratingChange < 0 ? 'negative' : '');
                         const changePrefix = ratingChange > 0 ? '+' : '';
                         
+                        const rank = ranks[player] ? ` #${ranks[player]}` : '';
                         ratingHTML = `<span class="rating-change ${changeClass}">${changePrefix}${ratingChange}</span>
-                                     <span class="new-rating">(${oldRating} → ${newRating})</span>`;
+                                     <span class="new-rating">(${oldRating} → ${newRating})${rank}</span>`;
                     }
                     
                     return `<div>${player}: ${score}分 ${ratingHTML}</div>`;
@@ -606,9 +682,10 @@ function submitAnswer() {
     }
 
     // 轉換為數字並驗證範圍 (0 ≤ answer < p) - 新增這部分
-    const numAnswer = parseInt(answer, 10);
-    if (numAnswer < 0 || numAnswer >= currentPValue) {
-        alert(`請輸入 0 到 ${currentPValue-1} 之間的整數`);
+    // 使用 BigInt 避免大模數超出 Number 的精確範圍
+    const numAnswer = BigInt(answer);
+    if (numAnswer < 0n || numAnswer >= currentPValue) {
+        alert(`請輸入 0 到 ${currentPValue - 1n} 之間的整數`);
         return;
     }
 
@@ -150,6 +150,54 @@ function updateGameModeInfo(mode) {
 // 全局變數
 let rankedQueueInterval = null;
 let rankedQueueStatus = 'none'; // 'none', 'waiting', 'matched'
+let rankedQueueTicks = 0;
+let lobbySocket = null;
+const FALLBACK_POLL_EVERY = 10; // 大廳連線正常時，每 10 秒才以 HTTP 確認一次
+
+// 大廳的 Socket.IO 連線：配對結果與排隊狀態由伺服器推送，HTTP 輪詢只作為備援
+function connectLobbySocket() {
+    if (lobbySocket || typeof io === 'undefined') {
+        return;
+    }
+    
+    // 只使用 WebSocket，單一連線不需要多 worker 轉發層固定 worker
+    lobbySocket = io({ query: { lobby: 1 }, transports: ['websocket'] });
+    
+    lobbySocket.on('connect', function() {
+        // 連線建立前可能已經配對成功
+        if (rankedQueueStatus === 'waiting') {
+            checkMatchStatus();
+        }
+    });
+    
+    lobbySocket.on('matched', function(data) {
+        console.log('收到配對結果:', data);
+        // 以 check_match_status 取得房間並設定會話
+        if (rankedQueueStatus === 'waiting') {
+            checkMatchStatus();
+        }
+    });
+    
+    lobbySocket.on('queue_position', function(data) {
+        if (rankedQueueStatus !== 'waiting') {
+            return;
+        }
+        let text = `正在等待對手中（${data.waiting} 人排隊中`;
+        if (data.waited !== undefined) {
+            text += `，已等待 ${data.waited} 秒，積分差範圍 ±${data.window}`;
+        }
+        document.getElementById('ranked-status').innerHTML = text + '） <span class="waiting-animation">...</span>';
+    });
+}
+
+// 每秒檢查一次；大廳連線正常時改由推送通知，只偶爾以 HTTP 確認
+function pollMatchStatus() {
+    rankedQueueTicks++;
+    if (lobbySocket && lobbySocket.connected && rankedQueueTicks % FALLBACK_POLL_EVERY !== 0) {
+        return;
+    }
+    checkMatchStatus();
+}
 
 // 重置隊列狀態
 function resetQueueStatus() {
@@ -179,6 +227,9 @@ function joinRankedQueue() {
     document.getElementById('join-ranked-button').style.display = 'none';
     document.getElementById('cancel-ranked-button').style.display = 'inline-block';
     
+    // 訂閱配對推送
+    connectLobbySocket();
+    
     // 發送加入隊列請求
     fetch('/join_ranked_queue', {
         method: 'POST'
@@ -193,9 +244,10 @@ function joinRankedQueue() {
         console.log('Join queue response:', data);
         
         if (data.status === 'waiting') {
-            // 啟動輪詢
+            // 啟動備援輪詢
             if (!rankedQueueInterval) {
-                rankedQueueInterval = setInterval(checkMatchStatus, 1000);
+                rankedQueueTicks = 0;
+                rankedQueueInterval = setInterval(pollMatchStatus, 1000);
             }
         } else if (data.status === 'matched') {
             // 匹配成功，處理匹配結果
@@ -276,6 +328,10 @@ function handleMatchSuccess(data) {
         difficultyText = '簡單';
     } else if (data.difficulty === 'medium') {
         difficultyText = '中等';
+    } else if (data.difficulty === 'expert') {
+        difficultyText = '專家';
+    } else if (data.difficulty === 'extreme') {
+        difficultyText = '極限';
     } else {
         difficultyText = '困難';
     }
@@ -9,9 +9,25 @@ function getRatingClass(rating) {
     return 'normal';
 }
 
-// 載入排行榜數據
-function loadLeaderboard() {
-    fetch('/api/leaderboard')
+// 分頁狀態
+let nextCursor = null;      // 下一頁的 keyset 游標
+let loadedCount = 0;        // 已顯示的列數，用於計算排名
+let searchTerm = '';        // 目前的搜尋字串
+let requestSeq = 0;         // 用於丟棄過期的回應
+
+// 載入排行榜數據（reset 為 true 時重新從第一頁開始）
+function loadLeaderboard(reset = true) {
+    const params = new URLSearchParams();
+    if (searchTerm) {
+        params.set('q', searchTerm);
+    }
+    if (!reset && nextCursor) {
+        params.set('after_rating', nextCursor.after_rating);
+        params.set('after_id', nextCursor.after_id);
+    }
+    const seq = ++requestSeq;
+    
+    fetch('/api/leaderboard?' + params.toString())
         .then(response => {
             if (!response.ok) {
                 throw new Error('網路連接異常');
@@ -19,8 +35,15 @@ function loadLeaderboard() {
             return response.json();
         })
         .then(data => {
-            displayLeaderboard(data.players);
-            updateStatistics(data.players);
+            if (seq !== requestSeq) return;  // 已有較新的請求
+            if (reset) {
+                loadedCount = 0;
+                document.getElementById('leaderboard-body').innerHTML = '';
+            }
+            nextCursor = data.next;
+            displayLeaderboard(data.players, reset);
+            updateStatistics(data.stats);
+            updateLoadMoreButton();
         })
         .catch(error => {
             console.error('載入排行榜失敗:', error);
@@ -34,24 +57,25 @@ function loadLeaderboard() {
         });
 }
 
-// 顯示排行榜數據
-function displayLeaderboard(players) {
+// 顯示排行榜數據（附加在目前列表之後）
+function displayLeaderboard(players, reset) {
     const tableBody = document.getElementById('leaderboard-body');
-    tableBody.innerHTML = '';
     
-    if (players.length === 0) {
-        tableBody.innerHTML = '<tr><td colspan="3" style="text-align: center;">目前沒有玩家資料</td></tr>';
+    if (reset && players.length === 0) {
+        const message = searchTerm ? '找不到符合的玩家' : '目前沒有玩家資料';
+        tableBody.innerHTML = `<tr><td colspan="3" style="text-align: center;">${message}</td></tr>`;
         return;
     }
     
-    players.forEach((player, index) => {
+    players.forEach(player => {
         const row = document.createElement('tr');
         const rankCell = document.createElement('td');
         const usernameCell = document.createElement('td');
         const ratingCell = document.createElement('td');
         
-        // 設定排名
-        const rank = index + 1;
+        // 設定排名（搜尋時由伺服器提供全域排名）
+        loadedCount++;
+        const rank = player.rank || loadedCount;
         rankCell.textContent = rank;
         if (rank <= 3) {
             rankCell.classList.add(`rank-${rank}`);
@@ -59,7 +83,10 @@ function displayLeaderboard(players) {
         
         // 設定用戶名及樣式
         const ratingClass = getRatingClass(player.rating);
-        usernameCell.innerHTML = `<span class="${ratingClass}">${player.username}</span>`;
+        const nameSpan = document.createElement('span');
+        nameSpan.className = ratingClass;
+        nameSpan.textContent = player.username;
+        usernameCell.appendChild(nameSpan);
         
         // 設定 rating
         ratingCell.textContent = player.rating;
@@ -76,41 +103,37 @@ function displayLeaderboard(players) {
     });
 }
 
-// 更新統計資料
-function updateStatistics(players) {
-    const totalPlayers = players.length;
-    document.getElementById('total-players').textContent = totalPlayers;
-    
-    if (totalPlayers > 0) {
-        // 計算平均 rating
-        const totalRating = players.reduce((sum, player) => sum + player.rating, 0);
-        const averageRating = Math.round(totalRating / totalPlayers);
-        document.getElementById('average-rating').textContent = averageRating;
-        
-        // 最高 rating
-        const highestRating = players[0].rating;
-        document.getElementById('highest-rating').textContent = highestRating;
-    } else {
-        document.getElementById('average-rating').textContent = 'N/A';
-        document.getElementById('highest-rating').textContent = 'N/A';
+// 更新統計資料（由伺服器維護，不再從列表計算）
+function updateStatistics(stats) {
+    document.getElementById('total-players').textContent = stats.count;
+    document.getElementById('average-rating').textContent = stats.average ?? 'N/A';
+    document.getElementById('highest-rating').textContent = stats.max ?? 'N/A';
+}
+
+// 顯示或隱藏「載入更多」按鈕
+function updateLoadMoreButton() {
+    let button = document.getElementById('load-more-button');
+    if (!button) {
+        button = document.createElement('button');
+        button.id = 'load-more-button';
+        button.className = 'load-more-button';
+        button.textContent = '載入更多';
+        button.addEventListener('click', () => loadLeaderboard(false));
+        document.querySelector('.leaderboard-table-container').after(button);
     }
+    button.style.display = nextCursor ? 'block' : 'none';
 }
 
-// 搜尋過濾功能
+// 搜尋功能：交由伺服器依名稱前綴查詢
 function setupSearchFilter() {
     const searchInput = document.getElementById('search-input');
+    let debounceTimer = null;
     searchInput.addEventListener('input', function() {
-        const searchTerm = this.value.toLowerCase();
-        const rows = document.querySelectorAll('#leaderboard-body tr');
-        
-        rows.forEach(row => {
-            const username = row.querySelector('td:nth-child(2)').textContent.toLowerCase();
-            if (username.includes(searchTerm)) {
-                row.style.display = '';
-            } else {
-                row.style.display = 'none';
-            }
-        });
+        clearTimeout(debounceTimer);
+        debounceTimer = setTimeout(() => {
+            searchTerm = this.value.trim();
+            loadLeaderboard(true);
+        }, 250);
     });
 }
 
@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+# 專案的模組都在根目錄，直接執行 pytest 時也要能匯入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """db_utils 改用暫存資料庫，排名索引與帳號快取從空的開始"""
+    import db_utils
+
+    pool = db_utils.ConnectionPool(str(tmp_path / 'game.db'))
+    monkeypatch.setattr(db_utils, '_pool', pool)
+    monkeypatch.setattr(db_utils, '_rank_feed', {'seq': 0, 'pruned_at': 0.0})
+    db_utils._account_cache.clear()
+    db_utils.rank_index.load([])
+    db_utils.init_db()
+    yield db_utils
+    pool.close_all()
+    db_utils._account_cache.clear()
+    db_utils.rank_index.load([])
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """匯入 app（使用暫存資料庫），廣播不合併，每個事件立即送出"""
+    import db_utils
+
+    db_utils._pool = db_utils.ConnectionPool(str(tmp_path_factory.mktemp('app') / 'game.db'))
+    import app
+
+    app.broadcaster.tick = 0
+    return app
@@ -0,0 +1,11 @@
+from affinity import HashRing
+
+
+def test_adding_worker_moves_about_one_fifth_of_rooms():
+    """4 → 5 個 worker 時約 1/5 的房間換手，其他房間留在原本的 worker"""
+    room_ids = [f'{i:06d}' for i in range(20_000)]
+    before = HashRing(range(4))
+    after = HashRing(range(5))
+    moved = [r for r in room_ids if before.node_for(r) != after.node_for(r)]
+    assert 0.15 < len(moved) / len(room_ids) < 0.25
+    assert all(after.node_for(r) == 4 for r in moved)
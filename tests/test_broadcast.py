@@ -0,0 +1,94 @@
+from broadcast import BroadcastBatcher
+
+
+class FakeScheduler:
+    """記錄 call_later，由測試決定何時執行"""
+
+    def __init__(self):
+        self.calls = []
+
+    def call_later(self, delay, fn, *args):
+        self.calls.append((delay, fn, args))
+
+    def run_all(self):
+        calls, self.calls = self.calls, []
+        for _, fn, args in calls:
+            fn(*args)
+
+
+def make_batcher(tick=0.03):
+    sent = []
+    scheduler = FakeScheduler()
+
+    def emit(event, data, to=None, skip_sid=None):
+        sent.append((event, data, to, skip_sid))
+
+    return BroadcastBatcher(emit, scheduler, tick=tick), scheduler, sent
+
+
+def test_tick_zero_sends_each_event_immediately():
+    batcher, scheduler, sent = make_batcher(tick=0)
+    batcher.emit('a', 1, 'r1')
+    batcher.emit('b', 2, 'r1', skip_sid='sid1')
+    assert sent == [('a', 1, 'r1', None), ('b', 2, 'r1', 'sid1')]
+    assert scheduler.calls == []
+
+
+def test_single_event_keeps_its_name_and_skip_sid():
+    batcher, scheduler, sent = make_batcher()
+    batcher.emit('player_answered', {'x': 1}, 'r1', skip_sid='sid1')
+    assert sent == []
+    assert len(scheduler.calls) == 1 and scheduler.calls[0][0] == 0.03
+    scheduler.run_all()
+    assert sent == [('player_answered', {'x': 1}, 'r1', 'sid1')]
+
+
+def test_events_in_one_tick_become_one_ordered_batch():
+    batcher, scheduler, sent = make_batcher()
+    batcher.emit('a', 1, 'r1')
+    batcher.emit('b', 2, 'r1', skip_sid='sid1')
+    batcher.emit('c', 3, 'r1')
+    assert len(scheduler.calls) == 1          # 每個房間每個 tick 只排一次
+    scheduler.run_all()
+    assert sent == [('batch', [['a', 1], ['b', 2, 'sid1'], ['c', 3]], 'r1', None)]
+    assert batcher.stats()['events'] == 3 and batcher.stats()['frames'] == 1
+
+
+def test_rooms_are_batched_separately():
+    batcher, scheduler, sent = make_batcher()
+    for i in range(3):
+        batcher.emit('e', i, 'r1')
+        batcher.emit('e', i, 'r2')
+    scheduler.run_all()
+    assert sent == [
+        ('batch', [['e', 0], ['e', 1], ['e', 2]], 'r1', None),
+        ('batch', [['e', 0], ['e', 1], ['e', 2]], 'r2', None),
+    ]
+
+
+def test_flush_sends_pending_events_now():
+    batcher, scheduler, sent = make_batcher()
+    batcher.emit('a', 1, 'r1')
+    batcher.emit('b', 2, 'r1')
+    batcher.flush('r1')
+    assert sent == [('batch', [['a', 1], ['b', 2]], 'r1', None)]
+    scheduler.run_all()                       # 原本排定的 flush 已無事可做
+    assert len(sent) == 1
+    batcher.emit('c', 3, 'r1')                # 之後的事件開始新的 tick
+    scheduler.run_all()
+    assert sent[-1] == ('c', 3, 'r1', None)
+    assert batcher.stats()['pending_rooms'] == 0
+
+
+def test_reaped_room_flushes_before_room_closed(app_module, monkeypatch):
+    A = app_module
+    sent = []
+    monkeypatch.setattr(A.broadcaster, 'tick', 60)
+    monkeypatch.setattr(A.broadcaster, '_emit',
+                        lambda event, data, to=None, skip_sid=None: sent.append((event, to)))
+    monkeypatch.setattr(A.socketio, 'emit', lambda event, data, room=None, **kw: sent.append((event, room)))
+    monkeypatch.setattr(A.socketio, 'close_room', lambda room_id: sent.append(('close', room_id)))
+    A.room_emit('r-reaped', 'user_left', {'username': 'x'})
+    A.room_emit('r-reaped', 'room_delta', {'version': 2, 'changes': []})
+    A.on_room_reaped('r-reaped', None, 'lobby_idle')
+    assert sent == [('batch', 'r-reaped'), ('room_closed', 'r-reaped'), ('close', 'r-reaped')]
@@ -0,0 +1,144 @@
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def other_worker(db):
+    """另一個 worker 的資料庫連線：寫入不會經過這個行程的排名索引"""
+    conn = sqlite3.connect(db._pool.db_file)
+    yield conn
+    conn.close()
+
+
+def add_user(conn, username, rating=1500):
+    conn.execute("INSERT INTO users (username, pw_hash, rating) VALUES (?, 'x', ?)", (username, rating))
+
+
+def test_sync_applies_other_workers_writes(db, other_worker):
+    add_user(other_worker, 'amy')
+    other_worker.commit()
+    db.load_rank_index()
+    add_user(other_worker, 'zed', 1700)
+    other_worker.execute("UPDATE users SET rating = 1450 WHERE username = 'amy'")
+    other_worker.commit()
+    assert db.rank_index.rank('zed') is None
+
+    assert db.sync_rank_index() == 2
+    assert db.rank_index.rank('zed') == 1
+    assert db.rank_index.rank('amy') == 2
+    assert db.sync_rank_index() == 0
+
+    other_worker.execute("UPDATE users SET rating = 1400 WHERE username = 'zed'")
+    other_worker.execute("DELETE FROM users WHERE username = 'amy'")
+    other_worker.commit()
+    db.sync_rank_index()
+    assert 'amy' not in db.rank_index
+    assert db.rank_index.top(5) == [('zed', 1400, 1)]
+
+
+def test_sync_refreshes_cached_rating(db, other_worker):
+    add_user(other_worker, 'amy')
+    other_worker.commit()
+    db.load_rank_index()
+    assert db.find_account('amy')['rating'] == 1500
+    other_worker.execute("UPDATE users SET rating = 1620 WHERE username = 'amy'")
+    other_worker.commit()
+    db.sync_rank_index()
+    assert db.find_account('amy')['rating'] == 1620
+
+
+def test_sync_reloads_when_feed_was_pruned(db, other_worker):
+    db.load_rank_index()
+    add_user(other_worker, 'zed', 1700)
+    other_worker.execute("DELETE FROM rating_feed")
+    other_worker.commit()
+    db.sync_rank_index()
+    assert db.rank_index.rank('zed') == 1
+
+
+def test_update_ratings_reads_ratings_in_transaction(db, other_worker):
+    add_user(other_worker, 'amy')
+    add_user(other_worker, 'bob')
+    other_worker.commit()
+    db.load_rank_index()
+    assert db.find_account('amy')['rating'] == 1500
+    # 其他 worker 已改寫積分，本行程的快取還是舊值
+    other_worker.execute("UPDATE users SET rating = 1600 WHERE username = 'amy'")
+    other_worker.commit()
+
+    old_ratings, changes = db.update_ratings({'amy': 3, 'bob': 0})
+    assert old_ratings == {'amy': 1600, 'bob': 1500}
+    rows = dict(other_worker.execute("SELECT username, rating FROM users"))
+    assert rows == {'amy': 1600 + changes['amy'], 'bob': 1500 + changes['bob']}
+
+
+def test_bulk_writes_make_workers_reload(db, other_worker):
+    db.load_rank_index()
+    with db.bulk_rating_writes():
+        with db.transaction() as conn:
+            add_user(conn, 'zed', 1700)
+    assert other_worker.execute("SELECT COUNT(*) FROM rating_feed").fetchone()[0] == 0
+    db.sync_rank_index()
+    assert db.rank_index.rank('zed') == 1
+    # 觸發器恢復後照常逐筆記錄
+    add_user(other_worker, 'amy', 1800)
+    other_worker.commit()
+    assert db.sync_rank_index() == 1
+    assert db.rank_index.rank('amy') == 1
+
+
+def test_leaderboard_keyset_paging_across_ties(db, other_worker):
+    ratings = [1500, 1600, 1500, 1400, 1600, 1500, 1500, 1700, 1400, 1500, 1600]
+    for i, rating in enumerate(ratings):
+        add_user(other_worker, f'u{i:02d}', rating)
+    other_worker.commit()
+    expected = [row[0] for row in other_worker.execute("SELECT username FROM users ORDER BY rating DESC, id")]
+
+    seen, cursor = [], {}
+    while True:
+        players, cursor = db.get_leaderboard(limit=3, **cursor)
+        seen += [player['username'] for player in players]
+        if cursor is None:
+            break
+    assert seen == expected
+
+
+def test_leaderboard_search_is_case_insensitive_prefix(db, other_worker):
+    for username, rating in (('Alice', 1600), ('alicia', 1700), ('malice', 1800),
+                             ('al_x', 1500), ('alxx', 1500), ('al%y', 1500)):
+        add_user(other_worker, username, rating)
+    other_worker.commit()
+    db.load_rank_index()
+
+    players, _ = db.get_leaderboard(prefix='ALI')
+    assert [(p['username'], p['rank']) for p in players] == [('alicia', 2), ('Alice', 3)]
+    assert [p['username'] for p in db.get_leaderboard(prefix='al_')[0]] == ['al_x']
+    assert [p['username'] for p in db.get_leaderboard(prefix='al%')[0]] == ['al%y']
+
+
+def test_user_stats_follow_every_write(db, other_worker):
+    from migrate_json_to_sqlite import UPSERT_SQL
+
+    def check():
+        stats = db.get_leaderboard_stats()
+        count, total, top = other_worker.execute(
+            "SELECT COUNT(*), COALESCE(SUM(rating), 0), MAX(rating) FROM users").fetchone()
+        assert stats == {'count': count, 'average': round(total / count) if count else None, 'max': top}
+
+    check()
+    add_user(other_worker, 'amy', 1500)
+    add_user(other_worker, 'bob', 1700)
+    other_worker.commit()
+    check()
+    db.update_ratings({'amy': 3, 'bob': 1})
+    check()
+    other_worker.executemany(UPSERT_SQL, [('bob', 'h', 1900), ('cat', 'h', 1200)])
+    other_worker.commit()
+    check()
+    other_worker.execute("DELETE FROM users WHERE username = 'amy'")
+    other_worker.commit()
+    check()
+    other_worker.execute("DELETE FROM users")
+    other_worker.commit()
+    check()
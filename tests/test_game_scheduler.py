@@ -0,0 +1,18 @@
+import random
+import time
+
+from game_scheduler import GameScheduler
+
+
+def test_cancelled_calls_never_run():
+    """2,000 個 0~0.2 秒後到期的計時器，其中一半在到期前取消"""
+    rng = random.Random(0)
+    scheduler = GameScheduler()
+    fired = []
+    calls = [scheduler.call_later(rng.uniform(0, 0.2), fired.append, i) for i in range(2_000)]
+    for call in calls[::2]:
+        scheduler.cancel(call)
+    started = time.monotonic()
+    while time.monotonic() - started < 0.4:
+        time.sleep(min(scheduler.run_due(), 0.005) or 0.001)
+    assert sorted(fired) == list(range(1, 2_000, 2))
@@ -0,0 +1,87 @@
+import sqlite3
+import time
+
+import pytest
+
+import match_log
+from match_log import MatchLogWriter
+
+
+def match_row(match_id):
+    return (match_id, '100', 'first', 'easy', 3, 0, 1, time.time(), time.time())
+
+
+def match_ids(db):
+    with db.get_db() as conn:
+        return {row[0] for row in conn.execute("SELECT id FROM matches")}
+
+
+@pytest.fixture
+def db_lock(db):
+    """另一條連線持有寫入鎖，寫入執行緒的交易會卡住直到 release()"""
+    conn = sqlite3.connect(db._pool.db_file, isolation_level=None)
+    conn.execute("BEGIN IMMEDIATE")
+    yield conn
+    if conn.in_transaction:
+        conn.rollback()
+    conn.close()
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "逾時"
+        time.sleep(0.01)
+
+
+def test_full_queue_drops_and_close_drains(db, db_lock, monkeypatch):
+    monkeypatch.setattr(match_log, 'MATCH_LOG_PUT_TIMEOUT', 0.01)
+    writer = MatchLogWriter(maxsize=2, batch_size=1, flush_interval=0.01)
+    assert writer.put('match', match_row('m0'))
+    wait_for(lambda: writer._queue.qsize() == 0)     # m0 已取出，寫入卡在資料庫鎖
+    assert writer.put('match', match_row('m1'))
+    assert writer.put('match', match_row('m2'))
+    assert not writer.put('match', match_row('m3'))
+    assert writer.stats()['dropped'] == 1
+
+    db_lock.rollback()
+    writer.close(timeout=10)
+    assert match_ids(db) == {'m0', 'm1', 'm2'}
+    assert writer.stats()['written'] == 3
+    assert not writer.put('match', match_row('m4'))
+
+
+def test_rows_queued_after_stop_are_written(db, db_lock):
+    writer = MatchLogWriter(batch_size=1, flush_interval=0.01)
+    writer.put('match', match_row('m0'))
+    wait_for(lambda: writer._queue.qsize() == 0)
+    # close() 送出停止訊號時，其他執行緒仍可能剛好放入紀錄
+    writer._closed = True
+    writer._queue.put(match_log._STOP)
+    writer._queue.put(('match', match_row('m1')))
+    db_lock.rollback()
+    writer._thread.join(10)
+    assert not writer._thread.is_alive()
+    assert match_ids(db) == {'m0', 'm1'}
+
+
+def test_bad_batch_does_not_stop_writer(db):
+    writer = MatchLogWriter(batch_size=1, flush_interval=0.01)
+    bad = match_row('bad')[:-1] + (2 ** 70,)          # 超出 SQLite INTEGER，executemany 丟出 OverflowError
+    writer.put('match', bad)
+    wait_for(lambda: writer.stats()['failed'] == 1)
+    assert writer._thread.is_alive()
+    writer.put('match', match_row('m1'))
+    writer.close(timeout=10)
+    assert match_ids(db) == {'m1'}
+    assert writer.stats()['written'] == 1
+
+
+def test_close_gives_up_when_queue_is_full_and_writer_is_stuck(db, db_lock):
+    writer = MatchLogWriter(maxsize=1, batch_size=1, flush_interval=0.01)
+    writer.put('match', match_row('m0'))
+    wait_for(lambda: writer._queue.qsize() == 0)
+    writer.put('match', match_row('m1'))
+    started = time.monotonic()
+    writer.close(timeout=0.2)
+    assert time.monotonic() - started < 1
@@ -0,0 +1,26 @@
+import random
+
+from matchmaker import Matchmaker
+
+
+def test_nearest_matches_brute_force():
+    """最接近對手的積分差與暴力搜尋一致"""
+    rng = random.Random(0)
+    for _ in range(200):
+        mm = Matchmaker()
+        players = {f'p{i}': int(rng.gauss(1500, 250)) for i in range(rng.randint(2, 50))}
+        for username, rating in players.items():
+            mm.add(username, rating, 0.0)
+        for username, rating in players.items():
+            best = min(abs(rating - other) for u, other in players.items() if u != username)
+            assert abs(players[mm._nearest(username)] - rating) == best
+
+
+def test_match_pairs_each_player_once():
+    rng = random.Random(1)
+    mm = Matchmaker()
+    for i in range(1_000):
+        mm.add(f'p{i}', int(rng.gauss(1500, 250)), 0.0)
+    paired = [u for pair in mm.match(60.0) for u in pair]
+    assert len(paired) == len(set(paired))
+    assert len(paired) + len(mm) == 1_000
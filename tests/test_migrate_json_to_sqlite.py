@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+import migrate_json_to_sqlite as migrate
+
+
+def write_json(tmp_path, text):
+    path = tmp_path / 'accounts.json'
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+@pytest.mark.parametrize('items', [
+    [1500, 2],
+    [True, None, -1.5e3, 'a,]b', [1, [2]], {}],
+    [{'username': f'使用者{i}', 'pw_hash': 'h$' + 'x' * i, 'rating': 1500 + i} for i in range(12)],
+])
+def test_every_chunk_boundary_yields_the_same_items(tmp_path, items):
+    text = json.dumps(items, ensure_ascii=False, indent=1)
+    path = write_json(tmp_path, text)
+    for read_size in range(1, len(text) + 2):
+        assert list(migrate.iter_json_accounts(path, read_size=read_size)) == items, read_size
+
+
+@pytest.mark.parametrize('text', ['{"a": 1}', '[1, 2', '[1 2]', '[{"a": 1}'])
+def test_malformed_files_raise(tmp_path, text):
+    path = write_json(tmp_path, text)
+    for read_size in (1, 3, 100):
+        with pytest.raises(ValueError):
+            list(migrate.iter_json_accounts(path, read_size=read_size))
+
+
+def accounts(n):
+    return [{'username': f'u{i}', 'pw_hash': f'h{i}', 'rating': 1000 + i} for i in range(n)]
+
+
+def users(db):
+    with db.get_db() as conn:
+        return dict(conn.execute("SELECT username, rating FROM users"))
+
+
+def test_resume_after_interrupted_migration(db, tmp_path):
+    full = json.dumps(accounts(10))
+    # 檔案在第 8 筆中途截斷：前兩批（6 筆）已提交並記錄檢查點
+    path = write_json(tmp_path, full[:full.index('"u7"') + 3])
+    assert not migrate.migrate_accounts(path, chunk_size=3)
+    assert json.load(open(migrate.checkpoint_path(path)))['processed'] == 6
+    assert users(db) == {f'u{i}': 1000 + i for i in range(6)}
+
+    write_json(tmp_path, full)
+    assert migrate.migrate_accounts(path, chunk_size=3)
+    assert users(db) == {f'u{i}': 1000 + i for i in range(10)}
+    assert not (tmp_path / 'accounts.json.checkpoint').exists()
+
+
+def test_resume_skips_checkpointed_accounts(db, tmp_path):
+    path = write_json(tmp_path, json.dumps(accounts(10)))
+    migrate.save_checkpoint(path, 4)
+    assert migrate.migrate_accounts(path, chunk_size=3)
+    assert set(users(db)) == {f'u{i}' for i in range(4, 10)}
+
+
+def test_rerun_upserts_ratings(db, tmp_path):
+    path = write_json(tmp_path, json.dumps(accounts(3)))
+    assert migrate.migrate_accounts(path)
+    changed = accounts(3)
+    changed[1]['rating'] = 1800
+    write_json(tmp_path, json.dumps(changed))
+    assert migrate.migrate_accounts(path, resume=False)
+    assert users(db) == {'u0': 1000, 'u1': 1800, 'u2': 1002}
@@ -0,0 +1,20 @@
+import random
+
+from question_utils import generate_question, is_prime, is_probable_prime
+
+
+def test_probable_prime_agrees_with_trial_division():
+    assert all(is_probable_prime(n) == is_prime(n) for n in range(100_000))
+
+
+def test_rejects_strong_pseudoprime_to_first_twelve_bases():
+    # 以 2 ~ 37 為底的強偽質數
+    assert not is_probable_prime(318665857834031151167461)
+
+
+def test_generated_answer_is_inverse():
+    rng = random.Random(12)
+    for _ in range(1_000):
+        q = generate_question('easy', rng=rng)
+        assert 0 < q['answer'] < q['p']
+        assert q['a'] * q['answer'] % q['p'] == 1
@@ -0,0 +1,38 @@
+import random
+
+from rank_index import RankIndex
+
+
+def expected_top(ratings, k):
+    ordered = sorted(ratings.items(), key=lambda item: (-item[1], item[0]))[:k]
+    result = []
+    for i, (username, rating) in enumerate(ordered):
+        rank = result[-1][2] if result and result[-1][1] == rating else i + 1
+        result.append((username, rating, rank))
+    return result
+
+
+def test_rank_and_top_match_sorting():
+    rng = random.Random(6)
+    for _ in range(200):
+        ratings = {f'u{i}': rng.choice((rng.randint(0, 5000), rng.randint(1400, 1420)))
+                   for i in range(rng.randrange(300))}
+        index = RankIndex()
+        index.load(ratings.items())
+        for _ in range(20):
+            username = f'u{rng.randrange(len(ratings) + 5)}'
+            ratings[username] = rng.randint(0, 5000)
+            index.set(username, ratings[username])
+        for username, rating in ratings.items():
+            assert index.rank(username) == 1 + sum(other > rating for other in ratings.values())
+        for k in (0, 1, 5, 50, 400):
+            assert index.top(k) == expected_top(ratings, k)
+
+
+def test_removed_player_has_no_rank():
+    index = RankIndex()
+    index.load([('alice', 1500), ('bob', 1600)])
+    index.remove('bob')
+    assert index.rank('bob') is None
+    assert index.rank('alice') == 1
+    assert index.top(5) == [('alice', 1500, 1)]
@@ -0,0 +1,55 @@
+import random
+
+from rating_utils import DEFAULT_RATING, compute_rating_changes
+
+
+def reference_rating_changes(scores, old_ratings, k=32):
+    """改寫前 app.calculate_rating_changes 的逐對計算"""
+    players = list(scores)
+    n = len(players)
+    if n < 2:
+        return {}
+    max_score = max(scores.values())
+    if sum(1 for s in scores.values() if s == max_score) > 1:
+        return {player: 0 for player in players}
+    changes = {}
+    for i in players:
+        actual = 0.0
+        expected = 0.0
+        for j in players:
+            if i == j:
+                continue
+            if scores[i] > scores[j]:
+                actual += 1
+            elif scores[i] == scores[j]:
+                actual += 0.5
+            expected += 1 / (1 + 10 ** ((old_ratings[j] - old_ratings[i]) / 400))
+        changes[i] = round(k * (actual / (n - 1) - expected / (n - 1)))
+    return changes
+
+
+def test_matches_pairwise_reference():
+    rng = random.Random(4)
+    for _ in range(20_000):
+        players = [f'p{i}' for i in range(rng.randint(1, 8))]
+        scores = {p: rng.randint(0, 5) for p in players}
+        ratings = {p: rng.randint(800, 2400) for p in players}
+        assert compute_rating_changes(scores, ratings) == reference_rating_changes(scores, ratings), (scores, ratings)
+
+
+def test_fewer_than_two_players_changes_nothing():
+    assert compute_rating_changes({}, {}) == {}
+    assert compute_rating_changes({'alice': 3}, {'alice': 1500}) == {}
+
+
+def test_tied_winners_change_nothing():
+    scores = {'alice': 3, 'bob': 3, 'carol': 1}
+    assert compute_rating_changes(scores, {'alice': 1200, 'bob': 1800, 'carol': 1500}) == \
+        {'alice': 0, 'bob': 0, 'carol': 0}
+
+
+def test_missing_rating_uses_default():
+    scores = {'alice': 2, 'bob': 1}
+    assert compute_rating_changes(scores, {'alice': DEFAULT_RATING}) == \
+        compute_rating_changes(scores, {'alice': DEFAULT_RATING, 'bob': DEFAULT_RATING}) == \
+        {'alice': 16, 'bob': -16}
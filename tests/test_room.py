@@ -0,0 +1,130 @@
+import random
+import threading
+
+import pytest
+
+from room import Room, RoomExists, RoomIdAllocator, RoomInconsistent, RoomRegistry
+from room_store import LocalRedis, RedisRoomStore, SQLiteRoomStore
+
+
+def test_random_ops_keep_index_consistent():
+    """隨機進出房間，每一步都檢查反向索引的一致性"""
+    rng = random.Random(14)
+    registry = RoomRegistry()
+    users = [f'user{i}' for i in range(200)]
+    for _ in range(20_000):
+        username = rng.choice(users)
+        op = rng.random()
+        if op < 0.1:
+            room_id = str(rng.randrange(100))
+            if room_id not in registry:
+                registry.create(room_id, Room('easy', 'first', 30, 7), [username])
+        elif op < 0.2:
+            registry.create(None, Room('easy', 'first', 30, 7), [username])
+        elif op < 0.6 and len(registry):
+            registry.add_player(rng.choice(registry.items())[0], username)
+        elif op < 0.9:
+            room_id, _ = registry.room_of(username)
+            if room_id is not None:
+                assert registry.remove_player(room_id, username)
+        elif len(registry):
+            registry.delete(rng.choice(registry.items())[0])
+        registry.check_consistency()
+
+
+def test_check_consistency_detects_stale_index():
+    registry = RoomRegistry()
+    registry.create('100', Room('easy', 'first', 30, 7), ['alice'])
+    registry._user_room['bob'] = '100'
+    with pytest.raises(RoomInconsistent):
+        registry.check_consistency()
+
+
+def test_create_with_taken_id_raises_room_exists():
+    registry = RoomRegistry()
+    registry.create('100', Room('easy', 'first', 30, 7), ['alice'])
+    with pytest.raises(RoomExists):
+        registry.create('100', Room('easy', 'first', 30, 7), ['bob'])
+    assert registry.room_of('bob') == (None, None)
+    registry.check_consistency()
+
+
+def test_id_allocator_covers_namespace_once():
+    """整個命名空間恰好分配一次，用完後重複使用釋放的ID"""
+    ids = RoomIdAllocator(key=15)
+    seen = {ids.allocate() for _ in range(ids.size)}
+    assert len(seen) == ids.size
+    assert all(ids.is_reserved(i) for i in seen)
+    ids.release('000042')
+    assert ids.allocate() == '000042'
+
+
+@pytest.fixture(params=['sqlite', 'local-redis'])
+def shared_store(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteRoomStore(str(tmp_path / 'rooms.db'))
+    return RedisRoomStore(LocalRedis())
+
+
+def test_shared_store_race(shared_store):
+    """
+    4 個 worker（各自的 RoomRegistry）以執行緒同時進出房間，
+    結束後儲存層中每位玩家最多在一個房間，且 user_room 對應與房間成員一致
+    """
+    store = shared_store
+    registries = [RoomRegistry(store=store) for _ in range(4)]
+    users = [f'user{i}' for i in range(30)]
+
+    def work(registry, seed):
+        rng = random.Random(seed)
+        for _ in range(500):
+            username = rng.choice(users)
+            op = rng.random()
+            room_ids = store.room_ids()
+            if op < 0.15:
+                registry.create(None, Room('easy', 'first', 30, 7), [username])
+            elif op < 0.6 and room_ids:
+                try:
+                    registry.add_player(rng.choice(room_ids), username)
+                except KeyError:
+                    pass
+            else:
+                room_id, _ = registry.room_of(username)
+                if room_id is not None:
+                    registry.remove_player(room_id, username)
+
+    threads = [threading.Thread(target=work, args=(r, i)) for i, r in enumerate(registries)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    members = {}
+    for room_id in store.room_ids():
+        for username in store.load(room_id)[1]['players']:
+            assert username not in members, f"{username} 同時在 {members[username]} 與 {room_id}"
+            members[username] = room_id
+    for username in users:
+        assert store.get_user_room(username) == members.get(username), username
+
+
+def test_update_survives_concurrent_writers(shared_store):
+    """多個 worker 同時修改同一個房間，每次修改都不會遺失"""
+    store = shared_store
+    registries = [RoomRegistry(store=store) for _ in range(4)]
+    registries[0].create('100', Room('easy', 'first', 30, 7), ['alice'])
+
+    def bump(room):
+        room.scores['alice'] += 1
+        return room
+
+    def work(registry):
+        for _ in range(100):
+            assert registry.update('100', bump) is not None
+
+    threads = [threading.Thread(target=work, args=(r,)) for r in registries]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert store.load('100')[1]['scores']['alice'] == 400
@@ -0,0 +1,181 @@
+import itertools
+import time
+
+import pytest
+
+import room_status
+from room import Room, RoomState
+
+
+def apply(state, message):
+    """與前端 game.js 相同的套用規則；版本不連續時回傳 'sync'"""
+    name, data = message
+    if name == 'room_status':
+        return {
+            'version': data['version'],
+            'players': list(data['players']),
+            'scores': dict(data['scores']),
+            'ready': dict(data['ready']),
+            'game_started': data['game_started'],
+        }
+    if state is None or data['version'] <= state['version']:
+        return state
+    if data['version'] != state['version'] + 1:
+        return 'sync'
+    state['version'] = data['version']
+    for kind, username, *rest in data['changes']:
+        if kind == 'join':
+            if username not in state['players']:
+                state['players'].append(username)
+            state['scores'].setdefault(username, 0)
+            state['ready'][username] = rest[1]
+        elif kind == 'leave':
+            state['players'].remove(username)
+            state['scores'].pop(username, None)
+            state['ready'].pop(username, None)
+        elif kind == 'ready':
+            state['ready'][username] = rest[0]
+        elif kind == 'score':
+            state['scores'][username] = rest[0]
+        elif kind == 'started':
+            state['game_started'] = username
+    return state
+
+
+def server_state(room):
+    return apply(None, ('room_status', room_status.snapshot(room, {})))
+
+
+def view(state):
+    """比較用：比賽結束時伺服器清空 ready，前端則記為未準備，兩者等價"""
+    return dict(state, ready={u for u, r in state['ready'].items() if r})
+
+
+def test_delta_sequence_replays_to_snapshot():
+    """join / ready / started / score / 比賽結束 / leave 依序套用後與伺服器快照一致"""
+    room = Room('easy', 'speed', 30, 7)
+    room.add_player('alice')
+    client = server_state(room)
+
+    def step(mutate, *changes):
+        mutate()
+        message = ('room_delta', room_status.delta(room, *changes))
+        assert message[1]['version'] == client['version'] + 1
+        assert apply(client, message) is client
+        assert view(client) == view(server_state(room))
+
+    step(lambda: room.add_player('bob'), room_status.joined('bob', 1500, False))
+    step(lambda: room.ready.update(alice=True), room_status.ready('alice', True))
+    step(lambda: room.ready.update(bob=True), room_status.ready('bob', True))
+
+    def start():
+        room.state = RoomState.PLAYING
+    step(start, room_status.started(True))
+    step(lambda: room.scores.update(alice=3), room_status.score('alice', 3))
+    step(lambda: room.scores.update(bob=2), room_status.score('bob', 2))
+
+    def finish():
+        room.state = RoomState.WAITING
+        room.ready.clear()
+    step(finish, room_status.started(False),
+         *(room_status.ready(u, False) for u in room.players))
+    step(lambda: room.remove_player('bob'), room_status.left('bob'))
+
+
+def test_stale_delta_is_ignored_and_gap_requests_sync():
+    room = Room('easy', 'first', 30, 7)
+    room.add_player('alice')
+    client = server_state(room)
+    old = room_status.delta(room, room_status.ready('alice', True))
+    room.ready['alice'] = True
+    client = apply(client, ('room_delta', old))
+    assert view(apply(client, ('room_delta', old))) == view(server_state(room))
+
+    room_status.delta(room, room_status.score('alice', 1))   # 漏收
+    missed = room_status.delta(room, room_status.score('alice', 2))
+    assert apply(client, ('room_delta', missed)) == 'sync'
+
+
+_names = (f'rs{i}' for i in itertools.count())
+
+
+@pytest.fixture
+def players(app_module):
+    """兩位已登入的玩家：(http client, username)"""
+    result = []
+    for _ in range(2):
+        username = next(_names)
+        client = app_module.app.test_client()
+        client.post('/register', data={'username': username, 'password': 'pw'})
+        assert client.post('/login', data={'username': username, 'password': 'pw'}).status_code == 302
+        result.append((client, username))
+    return result
+
+
+def received(socket_client):
+    return [(m['name'], m['args'][0]) for m in socket_client.get_received()]
+
+
+def wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "逾時"
+        time.sleep(0.02)
+
+
+def test_game_deltas_replay_to_server_state(app_module, players, monkeypatch):
+    A = app_module
+    for name in ('GAME_START_COUNTDOWN', 'NEXT_QUESTION_COUNTDOWN', 'ANSWER_REVEAL_DELAY'):
+        monkeypatch.setattr(A, name, 0.05)
+    (c1, alice), (c2, bob) = players
+    room_id = c1.post('/create_room', data={'difficulty': 'easy', 'game_mode': 'first',
+                                            'game_time': '15', 'question_count': '3'}).get_json()['room_id']
+    s1 = A.socketio.test_client(A.app, flask_test_client=c1)
+    c2.post('/join_room', data={'room_id': room_id})
+    s2 = A.socketio.test_client(A.app, flask_test_client=c2)
+    s1.emit('player_ready')
+    s2.emit('player_ready')
+    room = A.rooms[room_id]
+    previous = None
+    for _ in range(3):
+        wait_for(lambda: room.current_question is not None and room.current_question is not previous)
+        previous = room.current_question
+        s1.emit('submit_answer', {'answer': str(previous['answer'])})
+    wait_for(lambda: A.rooms[room_id].games_played == 1)
+
+    room = A.rooms[room_id]
+    for socket_client in (s1, s2):
+        state = None
+        for message in received(socket_client):
+            if message[0] in ('room_status', 'room_delta'):
+                state = apply(state, message)
+                assert state != 'sync'
+        assert view(state) == view(server_state(room))
+        assert state['scores'][alice] == 3 and not state['game_started']
+
+    # 前端要求同步時收到完整快照
+    s2.emit('sync_room_status')
+    assert [name for name, _ in received(s2)] == ['room_status']
+    s1.disconnect()
+    s2.disconnect()
+
+
+def test_reconnect_after_removal_broadcasts_no_join(app_module, players):
+    A = app_module
+    (c1, alice), (c2, bob) = players
+    room_id = c1.post('/create_room', data={'difficulty': 'easy', 'game_mode': 'first',
+                                            'game_time': '15', 'question_count': '3'}).get_json()['room_id']
+    s1 = A.socketio.test_client(A.app, flask_test_client=c1)
+    c2.post('/join_room', data={'room_id': room_id})
+    s2 = A.socketio.test_client(A.app, flask_test_client=c2)
+    s1.disconnect()
+    assert A.rooms[room_id].player_list() == [bob]
+    received(s2)
+
+    s1 = A.socketio.test_client(A.app, flask_test_client=c1)
+    names = [name for name, _ in received(s2)]
+    assert 'user_joined' not in names and 'room_delta' not in names
+    assert [name for name, _ in received(s1)] == ['room_status']
+    assert alice not in A.rooms[room_id]
+    s1.disconnect()
+    s2.disconnect()
@@ -0,0 +1,20 @@
+import random
+
+from timer_wheel import TimerWheel
+
+
+def test_timers_fire_exactly_on_their_tick():
+    """隨機新增 / 取消計時器，每個計時器都恰好在到期的 tick 觸發"""
+    rng = random.Random(16)
+    wheel = TimerWheel(tick=1.0, now=0.0)
+    timers = {}
+    for step in range(50_000):
+        if rng.random() < 0.3:
+            delay = rng.choice((rng.randrange(1, 70), rng.randrange(1, 5000), rng.randrange(1, 300_000)))
+            timers[step] = wheel.schedule(delay, step, now=step)
+        if rng.random() < 0.05 and timers:
+            wheel.cancel(timers.popitem()[1])
+        for key in wheel.advance(step + 1):
+            assert timers.pop(key).expires == wheel.current
+    assert len(wheel) == len(timers)
+    assert all(t.expires > wheel.current for t in timers.values())
@@ -0,0 +1,99 @@
+"""
+階層式時間輪（hierarchical timing wheel）
+
+每一層有 WHEEL_SIZE 個槽，第 0 層每槽一個 tick，第 L 層每槽 WHEEL_SIZE^L 個 tick。
+計時器依剩餘時間放入對應層的槽；低層轉完一圈時，把上一層當前槽內的計時器
+重新分配（cascade）到較低層。新增、取消計時器都是 O(1)，每個 tick 只處理
+到期的槽，與計時器總數無關。
+"""
+import math
+import time
+
+
+class Timer:
+    __slots__ = ('expires', 'key', '_slot')
+
+    def __init__(self, expires, key):
+        self.expires = expires      # 到期的 tick
+        self.key = key
+        self._slot = None           # 目前所在的槽（set），取消時直接移除
+
+    @property
+    def active(self):
+        return self._slot is not None
+
+
+class TimerWheel:
+    WHEEL_SIZE = 64
+    LEVELS = 4                      # 64^4 個 tick，以 1 秒為單位約 194 天
+
+    def __init__(self, tick=1.0, now=None):
+        self.tick = tick
+        self._origin = time.monotonic() if now is None else now
+        self.current = 0            # 已處理到的 tick
+        self._levels = [[set() for _ in range(self.WHEEL_SIZE)] for _ in range(self.LEVELS)]
+        self._count = 0
+        self.cascaded = 0           # 累計被重新分配的計時器數
+
+    def __len__(self):
+        return self._count
+
+    def _tick_at(self, now):
+        return int((now - self._origin) / self.tick)
+
+    def _place(self, timer):
+        horizon = self.WHEEL_SIZE ** self.LEVELS
+        if timer.expires - self.current >= horizon:
+            # 超出時間輪範圍：先在最遠可表示的 tick 到期，由呼叫端檢查後重新排程
+            timer.expires = self.current + horizon - 1
+        delta = timer.expires - self.current
+        level_index, span = 0, 1
+        while delta >= span * self.WHEEL_SIZE:
+            level_index += 1
+            span *= self.WHEEL_SIZE
+        slot = self._levels[level_index][(timer.expires // span) % self.WHEEL_SIZE]
+        slot.add(timer)
+        timer._slot = slot
+
+    def schedule(self, delay, key, now=None):
+        """delay 秒後到期，回傳 Timer 供取消使用"""
+        now = time.monotonic() if now is None else now
+        expires = max(math.ceil((now - self._origin + delay) / self.tick), self.current + 1)
+        timer = Timer(expires, key)
+        self._place(timer)
+        self._count += 1
+        return timer
+
+    def cancel(self, timer):
+        if timer._slot is not None:
+            timer._slot.discard(timer)
+            timer._slot = None
+            self._count -= 1
+
+    def _cascade(self, level_index):
+        level = self._levels[level_index]
+        span = self.WHEEL_SIZE ** level_index
+        slot = level[(self.current // span) % self.WHEEL_SIZE]
+        timers = list(slot)
+        slot.clear()
+        for timer in timers:
+            self._place(timer)
+        self.cascaded += len(timers)
+
+    def advance(self, now=None):
+        """推進到 now，回傳所有到期計時器的 key"""
+        target = self._tick_at(time.monotonic() if now is None else now)
+        expired = []
+        while self.current < target:
+            self.current += 1
+            # 由高層往低層 cascade，確保重新分配的計時器能落在正確的槽
+            for level_index in range(self.LEVELS - 1, 0, -1):
+                if self.current % (self.WHEEL_SIZE ** level_index) == 0:
+                    self._cascade(level_index)
+            slot = self._levels[0][self.current % self.WHEEL_SIZE]
+            for timer in slot:
+                timer._slot = None
+                expired.append(timer.key)
+            self._count -= len(slot)
+            slot.clear()
+        return expired